@@ -0,0 +1,592 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Performance benchmarks for the gcode framework. The corpus used is in
+# 'samples/benchmark.ngc' (a synthetic isolation file in the same format
+# linegrinder generates) and can be repeated to simulate larger files.
+# ----------------------------------------------------------------------------
+import re
+from collections import deque
+from copy import deepcopy
+from optparse import OptionParser
+from os import cpu_count, devnull, remove
+from os.path import join, dirname, realpath, exists
+from random import Random
+from sys import argv
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+from timeit import repeat
+
+import numpy as np
+
+from util.cache import cacheName
+from util.command import PARAMS, GCommand
+from util.arcfix import CorrectArc, bendThatArc, bendArcs
+from util.filters import ZLevel, FeedRate, Flip, Translate, Rotate
+from util.gcode import GCode, FilterChain, iterGCode, loadGCode, saveGCode
+from util.logger import Logger
+from util.optimise import Point, Line, airTravel, closestOrder, clusterOrder, hilbertOrder, improveOrder, \
+    multiStartOrder, distance
+from util.state import MachineState
+
+# --- Usage information
+USAGE = """
+Usage:
+       %s [--repeat count] [--scale factor] [--corpus filename] [--workers count] [benchmark ...]
+
+Where:
+
+  --repeat  count     number of times to run each benchmark (best is reported)
+  --scale   factor    number of copies of the corpus to use
+  --corpus  filename  the gcode file to use as the benchmark corpus
+  --workers count     number of processes for the parallel benchmarks
+
+Available benchmarks are:
+
+  %s
+"""
+
+# --- Default corpus
+CORPUS = join(dirname(realpath(__file__)), "samples", "benchmark.ngc")
+
+# --- The regular expression used by the original parser
+REGCODE = re.compile(r"(([A-Z])((-?[0-9]+)\.?([0-9]+)?))|(\(.*\))")
+
+
+# ----------------------------------------------------------------------------
+# Reference implementations
+# ----------------------------------------------------------------------------
+
+class LegacyCommand(GCommand):
+    """ The original regular expression based command parser
+    """
+
+    def __init__(self, line=""):
+        line = line.strip()
+        # Extract any comments
+        self.comment = ""
+        i = line.find("(")
+        if i >= 0:
+            self.comment = line[i:]
+            line = line[:i - 1]
+        line = line.strip()
+        self.command = ""
+        for p in PARAMS:
+            setattr(self, p, None)
+        if len(line) > 0:
+            parts = list([list(cmd) for cmd in REGCODE.findall(line)])
+            if len(parts) > 0:
+                if float(parts[0][2]) == float(parts[0][3]):
+                    self.command = "%s%02d" % (parts[0][1], int(parts[0][3]))
+                else:
+                    self.command = "%s%02.1f" % (parts[0][1], float(parts[0][2]))
+                for p in parts[1:]:
+                    if p[1] in PARAMS:
+                        setattr(self, str(p[1]), float(p[2]))
+
+
+def legacySave(filename, gcode):
+    """ The original saveGCode(), formatting and writing a line at a time
+    """
+    with open(filename, "w") as target:
+        for line in gcode.lines:
+            target.write(str(line) + "\n")
+
+
+def legacyClone(gcode, *filters):
+    """ The original GCode.clone(), copying every command before filtering
+    """
+    chain = FilterChain(*filters)
+    result = GCode()
+    result.units = gcode.units
+    for cmd in gcode.lines:
+        cmd = chain.apply(cmd.clone())
+        if cmd is not None:
+            if isinstance(cmd, GCommand):
+                result.append(cmd)
+            else:
+                for c in cmd:
+                    result.append(c)
+    return result
+
+
+def legacyOrder(movements, x=0.0, y=0.0):
+    """ The original optimiser ordering, a linear search for each movement
+    """
+    movements = list(movements)
+    ordered = list()
+    while len(movements) > 0:
+        best = None
+        for index, item in enumerate(movements):
+            d = item.distanceFrom(x, y)
+            if (best is None) or (d < best[0]):
+                best = (d, index)
+                if d == 0:
+                    break
+        current = movements.pop(best[1])
+        if distance(current.x, current.y, x, y) > best[0]:
+            current.reverse()
+        ordered.append(current)
+        x, y = current.finish()
+    return ordered
+
+
+def randomSegments(count, seed=1):
+    """ Short random lines spread over a 300x200mm panel
+    """
+    rng = Random(seed)
+    segments = list()
+    for index in range(count):
+        x, y = rng.uniform(0.0, 300.0), rng.uniform(0.0, 200.0)
+        segments.append(Line(x, y, x + rng.uniform(-1.0, 1.0), y + rng.uniform(-1.0, 1.0)))
+    return segments
+
+
+def randomHoles(count, seed=1):
+    """ Random drill holes spread over a 300x200mm panel
+    """
+    rng = Random(seed)
+    return [Point(rng.uniform(0.0, 300.0), rng.uniform(0.0, 200.0)) for index in range(count)]
+
+
+# ----------------------------------------------------------------------------
+# Benchmarks
+# ----------------------------------------------------------------------------
+
+def compare(name, baseline, current, count):
+    """ Time the baseline and current implementations and show the results
+
+      The runs are interleaved so both see the same machine conditions and
+      the best time for each is reported.
+    """
+    best = [None, None]
+    for run in range(count):
+        for index, func in enumerate((baseline, current)):
+            elapsed = repeat(func, number=1, repeat=1)[0]
+            if (best[index] is None) or (elapsed < best[index]):
+                best[index] = elapsed
+    print("  %-30s %10.4fs %10.4fs %8.2fx" % (name, best[0], best[1], best[0] / best[1]))
+
+
+def benchParse(lines, options):
+    """ Compare the command parser with the original regular expression one
+    """
+    for line in lines:
+        if str(GCommand(line)) != str(LegacyCommand(line)):
+            print("  WARNING: Results differ for '%s'" % line.strip())
+            break
+    compare("GCommand(line)",
+            lambda: [LegacyCommand(line) for line in lines],
+            lambda: [GCommand(line) for line in lines],
+            options.repeat)
+
+
+def benchLoad(lines, options):
+    """ Compare sequential and parallel loading of a file
+    """
+    with NamedTemporaryFile("w", suffix=".ngc", delete=False) as target:
+        target.writelines(lines)
+    try:
+        sequential = [str(c) for c in loadGCode(target.name).lines]
+        parallel = [str(c) for c in loadGCode(target.name, workers=options.workers).lines]
+        if sequential != parallel:
+            print("  WARNING: Parallel load differs from sequential")
+        compare("loadGCode(workers=%d)" % options.workers,
+                lambda: loadGCode(target.name, columnar=True),
+                lambda: loadGCode(target.name, workers=options.workers),
+                options.repeat)
+    finally:
+        remove(target.name)
+
+
+def benchCache(lines, options):
+    """ Compare loading a file with and without the binary cache
+    """
+    with NamedTemporaryFile("w", suffix=".ngc", delete=False) as target:
+        target.writelines(lines)
+    try:
+        loaded = [str(c) for c in loadGCode(target.name, columnar=True).lines]
+        # The first load creates the cache, the second reads it
+        loadGCode(target.name, cache=True)
+        cached = [str(c) for c in loadGCode(target.name, cache=True).lines]
+        if loaded != cached:
+            print("  WARNING: Cached load differs from parsing")
+        compare("loadGCode(cache=True)",
+                lambda: loadGCode(target.name, columnar=True),
+                lambda: loadGCode(target.name, cache=True),
+                options.repeat)
+    finally:
+        remove(target.name)
+        if exists(cacheName(target.name)):
+            remove(cacheName(target.name))
+
+
+def benchSave(lines, options):
+    """ Compare saving a program with the original line at a time writer
+    """
+    with NamedTemporaryFile("w", suffix=".ngc", delete=False) as target:
+        target.writelines(lines)
+    gcode = loadGCode(target.name, columnar=True)
+    try:
+        legacySave(target.name, gcode)
+        with open(target.name, "rb") as source:
+            expected = source.read()
+        saveGCode(target.name, gcode)
+        with open(target.name, "rb") as source:
+            if source.read() != expected:
+                print("  WARNING: Saved file differs from the original writer")
+        compare("saveGCode(columnar)",
+                lambda: legacySave(target.name, gcode),
+                lambda: saveGCode(target.name, gcode),
+                options.repeat)
+        gcode = loadGCode(target.name)
+        compare("saveGCode(list)",
+                lambda: legacySave(target.name, gcode),
+                lambda: saveGCode(target.name, gcode),
+                options.repeat)
+    finally:
+        remove(target.name)
+
+
+def benchClone(lines, options):
+    """ Compare cloning a program through filters that rarely change commands
+    """
+    with NamedTemporaryFile("w", suffix=".ngc", delete=False) as target:
+        target.writelines(lines)
+    try:
+        gcode = loadGCode(target.name)
+    finally:
+        remove(target.name)
+    filters = lambda: (ZLevel(), FeedRate(), ZLevel(cut=-0.1))
+    if [str(c) for c in gcode.clone(*filters()).lines] != [str(c) for c in legacyClone(gcode, *filters()).lines]:
+        print("  WARNING: Clone differs from the original")
+    compare("GCode.clone(unchanged)",
+            lambda: legacyClone(gcode, *filters()),
+            lambda: gcode.clone(*filters()),
+            options.repeat)
+
+
+def benchAffine(lines, options):
+    """ Compare placing a board one filter at a time with a combined transform
+    """
+    with NamedTemporaryFile("w", suffix=".ngc", delete=False) as target:
+        target.writelines(lines)
+    try:
+        gcode = loadGCode(target.name)
+        table = loadGCode(target.name, columnar=True)
+    finally:
+        remove(target.name)
+    filters = lambda: (Flip(xflip=20.0), Translate(5.0, 5.0), Rotate(-90.0), Translate(0.0, 50.0))
+
+    def separate(source):
+        for f in filters():
+            source = legacyClone(source, f)
+        return source
+
+    compare("GCode.clone(affine)",
+            lambda: separate(gcode),
+            lambda: gcode.clone(*filters()),
+            options.repeat)
+    compare("GCode.clone(affine, columnar)",
+            lambda: separate(table),
+            lambda: table.clone(*filters()),
+            options.repeat)
+
+
+def benchBatch(lines, options):
+    """ Compare filtering a columnar program a command at a time and in batch
+
+      Use a scale of 200 or more to see the results on a million line program.
+    """
+    with NamedTemporaryFile("w", suffix=".ngc", delete=False) as target:
+        target.writelines(lines)
+    try:
+        table = loadGCode(target.name, columnar=True)
+    finally:
+        remove(target.name)
+    filters = lambda: (ZLevel(cut=-0.1, safe=2.0), FeedRate(cutting=300.0), Rotate(-90.0), CorrectArc())
+    if [str(c) for c in table.clone(*filters()).lines] != [str(c) for c in legacyClone(table, *filters()).lines]:
+        print("  WARNING: Batch results differ from filtering each command")
+    compare("GCode.clone(batch)",
+            lambda: legacyClone(table, *filters()),
+            lambda: table.clone(*filters()),
+            options.repeat)
+
+
+def benchParallel(lines, options):
+    """ Compare filtering a program in one process and in parallel chunks
+
+      Shows the scaling for 2, 4, ... processes up to the --workers count.
+    """
+    with NamedTemporaryFile("w", suffix=".ngc", delete=False) as target:
+        target.writelines(lines)
+    try:
+        gcode = loadGCode(target.name)
+    finally:
+        remove(target.name)
+    filters = lambda: (ZLevel(cut=-0.1, safe=2.0), FeedRate(cutting=300.0), Rotate(-30.0), CorrectArc())
+    serial = [str(c) for c in gcode.clone(*filters()).lines]
+    counts = sorted(set([2 ** n for n in range(1, options.workers.bit_length())] + [max(2, options.workers)]))
+    for workers in counts:
+        if [str(c) for c in gcode.clone(*filters(), workers=workers).lines] != serial:
+            print("  WARNING: Parallel filtering with %d workers differs from serial" % workers)
+        compare("GCode.clone(workers=%d)" % workers,
+                lambda: gcode.clone(*filters()),
+                lambda: gcode.clone(*filters(), workers=workers),
+                options.repeat)
+
+
+def benchInPlace(lines, options):
+    """ Compare filtering copies of the commands and filtering them in place
+
+      The GCode timings both include making a fresh copy of the program to
+      filter.
+    """
+    with NamedTemporaryFile("w", suffix=".ngc", delete=False) as target:
+        target.writelines(lines)
+    try:
+        source = loadGCode(target.name)
+        filters = lambda: (ZLevel(cut=-0.1, safe=2.0), FeedRate(cutting=300.0), Rotate(-30.0), CorrectArc())
+
+        def fresh():
+            gcode = GCode()
+            gcode.lines = [c.clone() for c in source.lines]
+            return gcode
+
+        gcode = fresh()
+        gcode.apply(*filters())
+        if [str(c) for c in gcode.lines] != [str(c) for c in source.clone(*filters()).lines]:
+            print("  WARNING: Filtering in place differs from GCode.clone()")
+        compare("GCode.apply()",
+                lambda: fresh().clone(*filters()),
+                lambda: fresh().apply(*filters()),
+                options.repeat)
+        compare("FilterChain.stream(inplace)",
+                lambda: deque(FilterChain(*filters()).stream(iterGCode(target.name)), maxlen=0),
+                lambda: deque(FilterChain(*filters()).stream(iterGCode(target.name), inplace=True), maxlen=0),
+                options.repeat)
+    finally:
+        remove(target.name)
+
+
+def benchCompile(lines, options):
+    """ Compare running a chain of filters as is and compiled into one function
+
+      Each compiled chain uses the cached kernel after the first.
+    """
+    with NamedTemporaryFile("w", suffix=".ngc", delete=False) as target:
+        target.writelines(lines)
+    try:
+        gcode = loadGCode(target.name)
+    finally:
+        remove(target.name)
+    filters = lambda: (Flip(xflip=50.0), Translate(10.0, 20.0), ZLevel(cut=-0.1, safe=2.0), FeedRate(cutting=300.0))
+
+    def run(chain):
+        return [chain.apply(c) for c in gcode.lines]
+
+    if [str(c) for c in run(FilterChain(*filters()))] != [str(c) for c in run(FilterChain(*filters()).compile())]:
+        print("  WARNING: Compiled chain results differ")
+    compare("FilterChain.compile()",
+            lambda: run(FilterChain(*filters())),
+            lambda: run(FilterChain(*filters()).compile()),
+            options.repeat)
+
+
+def benchArcs(lines, options):
+    """ Compare correcting arc centers one at a time and all at once
+
+      The vectorised version is also checked against the scalar one on the
+      corpus and on random arcs (including vertical ones).
+    """
+    with NamedTemporaryFile("w", suffix=".ngc", delete=False) as target:
+        target.writelines(lines)
+    try:
+        table = loadGCode(target.name, columnar=True).lines
+    finally:
+        remove(target.name)
+    state = MachineState(table)
+    x, y, i, j = [table.column(p) for p in ("X", "Y", "I", "J")]
+    arcs = ~np.isnan(x) & ~np.isnan(y) & ~np.isnan(i) & ~np.isnan(j)
+    arcs &= (state.x0 != x) | (state.y0 != y)
+    x0, y0, x1, y1 = state.x0[arcs], state.y0[arcs], x[arcs], y[arcs]
+    x2, y2 = x0 + i[arcs], y0 + j[arcs]
+    # Random arcs with the center moved away from the right radius
+    rng = np.random.default_rng(1)
+    rx0, ry0, rx1, ry1 = rng.uniform(-100.0, 100.0, (4, 100000))
+    rx1[::10] = rx0[::10]
+    rx2, ry2 = (rx0 + rx1) / 2 + rng.normal(0.0, 5.0, len(rx0)), (ry0 + ry1) / 2 + rng.normal(0.0, 5.0, len(rx0))
+
+    def scalar(*values):
+        return np.array([bendThatArc(*v) for v in zip(*[a.tolist() for a in values])]).reshape(-1, 2).T
+
+    for values in ((x0, y0, x1, y1, x2, y2), (rx0, ry0, rx1, ry1, rx2, ry2)):
+        difference = np.abs(np.array(bendArcs(*values)) - scalar(*values))
+        if len(values[0]) and (difference.max() > 1e-9):
+            print("  WARNING: Vectorised arc correction differs by %g" % difference.max())
+    compare("bendArcs(%d arcs)" % len(x0),
+            lambda: scalar(x0, y0, x1, y1, x2, y2),
+            lambda: bendArcs(x0, y0, x1, y1, x2, y2),
+            options.repeat)
+
+
+def benchLogging(lines, options):
+    """ Compare the cost of logging a message for each line of the corpus
+
+      Disabled messages with their arguments formatted up front and lazily,
+      then enabled messages written directly and in blocks.
+    """
+    # Line buffered like a console
+    with open(devnull, "w", buffering=1) as target:
+        quiet = Logger(Logger.MSG_INFO, output=target)
+        compare("Logger.DEBUG(disabled)",
+                lambda: [quiet.DEBUG("Checking %s" % line) for line in lines],
+                lambda: [quiet.DEBUG("Checking %s", line) for line in lines],
+                options.repeat)
+        direct = Logger(Logger.MSG_DEBUG, output=target)
+        buffered = Logger(Logger.MSG_DEBUG, output=target, buffered=True)
+        compare("Logger.DEBUG(buffered)",
+                lambda: [direct.DEBUG("Checking %s", line) for line in lines],
+                lambda: [buffered.DEBUG("Checking %s", line) for line in lines],
+                options.repeat)
+        buffered.flush()
+
+
+def benchOrder(lines, options):
+    """ Compare the linear search and spatial index movement ordering
+
+      The linear search takes minutes for more than 10k segments so only the
+      current version is timed for the larger sizes. The corpus isn't used.
+    """
+    segments = randomSegments(10000)
+    if airTravel(legacyOrder(deepcopy(segments))) != airTravel(closestOrder(deepcopy(segments))):
+        print("  WARNING: Ordering differs from the linear search")
+    compare("closestOrder(10000)",
+            lambda: legacyOrder(deepcopy(segments)),
+            lambda: closestOrder(deepcopy(segments)),
+            1)
+    for count in (100000, 1000000):
+        segments = randomSegments(count)
+        elapsed = repeat(lambda: closestOrder(segments), number=1, repeat=1)[0]
+        print("  %-30s %11s %10.4fs" % ("closestOrder(%d)" % count, "-", elapsed))
+
+
+def benchImprove(lines, options):
+    """ Show the air travel saved by improving the closest first order
+
+      Each size is given 10 seconds. The corpus isn't used.
+    """
+    for count in (1000, 10000, 100000):
+        ordered = closestOrder(randomSegments(count))
+        greedy = airTravel(ordered)
+        start = perf_counter()
+        improved = airTravel(improveOrder(ordered, budget=10.0))
+        print("  %-30s %10.0fmm %9.0fmm %8.1f%% (%0.1fs)" % (
+            "improveOrder(%d)" % count, greedy, improved, 100.0 * (greedy - improved) / greedy, perf_counter() - start))
+
+
+def benchStarts(lines, options):
+    """ Compare ordering from several start points serially and in parallel
+
+      Both must pick the same ordering. The corpus isn't used.
+    """
+    segments = randomSegments(20000)
+    greedy = airTravel(closestOrder(deepcopy(segments)))
+    serial = multiStartOrder(segments, starts=8)
+    parallel = multiStartOrder(segments, starts=8, workers=options.workers)
+    if [(m.x, m.y) for m in serial] != [(m.x, m.y) for m in parallel]:
+        print("  WARNING: Parallel ordering differs from the serial one")
+    print("  %-30s %10.0fmm %9.0fmm %8.1f%%" % (
+        "multiStartOrder(20000)", greedy, airTravel(serial), 100.0 * (greedy - airTravel(serial)) / greedy))
+    compare("multiStartOrder(workers=%d)" % options.workers,
+            lambda: multiStartOrder(segments, starts=8),
+            lambda: multiStartOrder(segments, starts=8, workers=options.workers),
+            1)
+
+
+def benchHoles(lines, options):
+    """ Compare closest first and Hilbert curve ordering of drill holes
+
+      Shows the air travel for each as well as the Hilbert curve order
+      after 5 seconds of improveOrder(). The corpus isn't used.
+    """
+    for count in (10000, 100000):
+        holes = randomHoles(count)
+        if sorted(id(m) for m in hilbertOrder(holes)) != sorted(id(m) for m in holes):
+            print("  WARNING: Hilbert order does not visit every hole once")
+        compare("hilbertOrder(%d)" % count,
+                lambda: closestOrder(holes),
+                lambda: hilbertOrder(holes),
+                1)
+        greedy = airTravel(closestOrder(holes))
+        curve = airTravel(hilbertOrder(holes))
+        improved = airTravel(improveOrder(hilbertOrder(holes), budget=5.0))
+        print("  %-30s %10.0fmm %9.0fmm %9.0fmm (improved)" % (
+            "air travel(%d)" % count, greedy, curve, improved))
+
+
+def benchClusters(lines, options):
+    """ Compare ordering everything at once with ordering by clusters
+
+      Uses 500k segments and the configured number of workers. The corpus
+      isn't used.
+    """
+    def cuts(movements):
+        # The segments regardless of direction
+        return sorted([tuple(sorted(m.ends())) for m in movements])
+
+    segments = randomSegments(500000)
+    ordered = clusterOrder(deepcopy(segments), workers=options.workers)
+    if cuts(ordered) != cuts(segments):
+        print("  WARNING: Cluster order does not cut every segment once")
+    compare("clusterOrder(500000)",
+            lambda: closestOrder(deepcopy(segments)),
+            lambda: clusterOrder(deepcopy(segments), workers=options.workers),
+            1)
+    print("  %-30s %10.0fmm %9.0fmm" % (
+        "air travel(500000)", airTravel(closestOrder(deepcopy(segments))), airTravel(ordered)))
+
+
+BENCHMARKS = {
+    "parse": benchParse,
+    "load": benchLoad,
+    "cache": benchCache,
+    "save": benchSave,
+    "clone": benchClone,
+    "affine": benchAffine,
+    "batch": benchBatch,
+    "parallel": benchParallel,
+    "inplace": benchInPlace,
+    "compile": benchCompile,
+    "arcs": benchArcs,
+    "logging": benchLogging,
+    "order": benchOrder,
+    "improve": benchImprove,
+    "starts": benchStarts,
+    "holes": benchHoles,
+    "clusters": benchClusters,
+}
+
+# --- Main program
+if __name__ == "__main__":
+    # Set up program options
+    parser = OptionParser()
+    parser.add_option("-r", "--repeat", action="store", type="int", dest="repeat", default=5)
+    parser.add_option("-s", "--scale", action="store", type="int", dest="scale", default=10)
+    parser.add_option("-c", "--corpus", action="store", type="string", dest="corpus", default=CORPUS)
+    parser.add_option("-w", "--workers", action="store", type="int", dest="workers", default=cpu_count() or 1)
+    options, args = parser.parse_args()
+    # Check the requested benchmarks
+    names = args or sorted(BENCHMARKS.keys())
+    for name in names:
+        if name not in BENCHMARKS:
+            print(USAGE.strip() % (argv[0], "\n  ".join(sorted(BENCHMARKS.keys()))))
+            exit(1)
+    # Load the corpus
+    with open(options.corpus, "r") as source:
+        lines = source.readlines() * options.scale
+    print("Corpus: %d lines\n" % len(lines))
+    print("  %-30s %11s %11s %9s" % ("", "baseline", "current", "speedup"))
+    for name in names:
+        BENCHMARKS[name](lines, options)
@@ -1,5 +1,25 @@
 #!/usr/bin/env python
 # ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Added the '--hop', '--hop-distance' and '--stay-down' options to reduce
+# the time spent retracting between cuts in the optimised files.
+#
+# Added the '--starts' and '--workers' options to try several orderings of
+# each optimised file (in parallel) and keep the best.
+#
+# Added the '--optimise-time' option to spend longer improving the order
+# of the optimised files.
+#
+# Log messages are only formatted if they will be written, added the
+# '--json-log' option for structured log output.
+#
+# Each board layer is now placed with a single clone() so the rotation and
+# translations are combined into one transform.
+#
+# Added the '--cache' option to keep the parsed board files in a binary
+# cache alongside the originals.
+#
 # 26-Jul-2015 ShaneG
 #
 # Added functionality for generating drill code from standalone Excellon files
@@ -260,7 +280,7 @@ class PCB:
 
           Verify that all the files needed exist and load them
         """
-        global CONFIG, CONTROL
+        global CONFIG, CONTROL, options
         path = join(realpath(CONFIG['boards']), name)
         if not exists(path):
             raise Exception("No board directory found at '%s'" % path)
@@ -272,7 +292,8 @@ class PCB:
         if filename is None:
             raise Exception("Missing board outline for '%s'" % name)
         self.outline = loadGCode(filename,
-                                 BoxedLoader(start=GCommand("G04 P1"), end=GCommand("G00 X0 Y0"), inclusive=False))
+                                 BoxedLoader(start=GCommand("G04 P1"), end=GCommand("G00 X0 Y0"), inclusive=False),
+                                 cache=options.cache)
         self.dx = -self.outline.minx
         self.dy = -self.outline.miny
         self.midpoint = self.outline.minx + ((self.outline.maxx - self.outline.minx) / 2)
@@ -297,23 +318,25 @@ class PCB:
         filename = findFile(path, "Top Copper_ISOLATION_GCODE.ngc")
         if filename is not None:
             self.top = loadGCode(filename,
-                                 BoxedLoader(start=GCommand("G04 P1"), end=GCommand("G00 X0 Y0"), inclusive=False))
+                                 BoxedLoader(start=GCommand("G04 P1"), end=GCommand("G00 X0 Y0"), inclusive=False),
+                                 cache=options.cache)
             self.top = self.top.clone(Translate(self.dx, self.dy))
         # Load the bottom copper
         filename = findFile(path, "Bottom Copper_ISOLATION_GCODE.ngc")
         if filename is None:
             raise Exception("Missing bottom copper for '%s'" % name)
         self.bottom = loadGCode(filename,
-                                BoxedLoader(start=GCommand("G04 P1"), end=GCommand("G00 X0 Y0"), inclusive=False))
+                                BoxedLoader(start=GCommand("G04 P1"), end=GCommand("G00 X0 Y0"), inclusive=False),
+                                cache=options.cache)
         # Add outlines for the drill holes (avoid tearing)
-        global options
         if options.pads:
             if drills is not None:
+                # Adding commands resets the bounds, get the depths first
+                cut, safe = self.bottom.minz, self.bottom.maxz
                 for diam in drills.keys():
                     if diam >= 1.0:  # Holes < 1.0 mm don't need the outline
                         for x, y in drills[diam]:
-                            self.bottom.circle(x, y, (diam - CONFIG['toolwidth']) / 2, self.bottom.minz,
-                                               self.bottom.maxz, step=0.254)
+                            self.bottom.circle(x, y, (diam - CONFIG['toolwidth']) / 2, cut, safe, step=0.254)
         self.bottom = self.bottom.clone(Flip(xflip=self.midpoint), Translate(self.dx, self.dy))
         # Generate an outline as well (to avoid tearing)
         delta = abs(max(self.dx, self.dy)) / 2
@@ -332,10 +355,17 @@ class PCB:
         outline.append(self.bottom)
         self.bottom = outline
 
-    def _rotate(self, gcode):
-        """ Apply the rotation and translation needed for board layout
+    def _placement(self, position):
+        """ Get the filters needed to move the board to the given position
+
+          The filters are all affine so the clone they are used with combines
+          them into a single transform.
         """
-        return gcode.clone(Rotate(-90.0), Translate(0.0, self.outline.maxx))
+        filters = list()
+        if position.rotated:
+            filters.extend((Rotate(-90.0), Translate(0.0, self.outline.maxx)))
+        filters.append(Translate(self.padding + position.x, self.padding + position.y))
+        return filters
 
     def getBoard(self):
         """ Return a BoardPosition for this PCB
@@ -349,12 +379,8 @@ class PCB:
     def generateBottomCopper(self, gcode, position):
         if self.bottom is None:
             return
-        bottom = self.bottom
-        # Rotate if needed
-        if position.rotated:
-            bottom = self._rotate(bottom)
-        # Translate to the right spot
-        bottom = bottom.clone(Translate(self.padding + position.x, self.padding + position.y))
+        # Rotate if needed and translate to the right spot
+        bottom = self.bottom.clone(*self._placement(position))
         # Add to the full gcode
         gcode.append("(INFO: %s @ %04.f, %0.4f rot = %s)" % (self.name, position.x, position.y, position.rotated))
         gcode.append(bottom)
@@ -362,12 +388,8 @@ class PCB:
     def generateOutline(self, gcode, position):
         """ Generate the board outline gcode given the position
         """
-        outline = self.outline
-        # Rotate if needed
-        if position.rotated:
-            outline = self._rotate(outline)
-        # Translate to the right spot
-        outline = outline.clone(Translate(self.padding + position.x, self.padding + position.y))
+        # Rotate if needed and translate to the right spot
+        outline = self.outline.clone(*self._placement(position))
         # Add to the full gcode
         gcode.append("(INFO: %s @ %04.f, %0.4f rot = %s)" % (self.name, position.x, position.y, position.rotated))
         gcode.append(outline)
@@ -376,12 +398,8 @@ class PCB:
         """ Generate the drill files for various diameters
         """
         for diam in self.drills.keys():
-            drill = self.drills[diam]
-            # Rotate if needed
-            if position.rotated:
-                drill = self._rotate(drill)
-            # Translate to the right spot
-            drill = drill.clone(Translate(self.padding + position.x, self.padding + position.y))
+            # Rotate if needed and translate to the right spot
+            drill = self.drills[diam].clone(*self._placement(position))
             # Add to the full gcode
             if not drills.has_key(diam):
                 drills[diam] = GCode()
@@ -441,16 +459,20 @@ class Panel:
         return True
 
     def findPosition(self, layout, board):
-        LOG.DEBUG("Positioning %s" % board)
+        LOG.DEBUG("Positioning %s", board)
+        # Don't even call the logger in the loop unless it is needed
+        debug = LOG.isEnabled(Logger.MSG_DEBUG)
         for x in range(0, int(self.w - board.w - 1)):
             for y in range(0, int(self.h - board.h - 1)):
-                LOG.DEBUG("  Testing %d, %d" % (x, y))
+                if debug:
+                    LOG.DEBUG("  Testing %d, %d", x, y)
                 board.x = x
                 board.y = y
                 # Does it overlap ?
                 safe = True
                 for existing in layout:
-                    LOG.DEBUG("Checking against %s" % existing)
+                    if debug:
+                        LOG.DEBUG("Checking against %s", existing)
                     if board.intersects(existing):
                         safe = False
                 if safe:
@@ -468,7 +490,7 @@ class Panel:
             placed = True
             for board in candidate:
                 if self.findPosition(current, board):
-                    LOG.DEBUG("Placed %s" % board)
+                    LOG.DEBUG("Placed %s", board)
                     current.append(board)
                 else:
                     placed = False
@@ -526,7 +548,7 @@ def loadBoard(name):
             15 + randint(0, 45),
             15 + randint(0, 45)
         )
-        LOG.DEBUG(str(board))
+        LOG.DEBUG("%s", board)
         BOARD_CACHE[name] = board
     # Done
     return board
@@ -556,6 +578,17 @@ if __name__ == "__main__":
     parser.add_option("-m", "--merge", action="store_true", default=False, dest="merge")
     parser.add_option("-f", "--feed", action="store", type="float", dest="feedrate")
     parser.add_option("-r", "--drill", action="store", type="float", dest="drilling")
+    parser.add_option("-k", "--cache", action="store_true", default=False, dest="cache")
+    parser.add_option("-j", "--json-log", action="store_true", default=False, dest="jsonlog")
+    parser.add_option("-t", "--optimise-time", action="store", type="string", dest="optimisetime")
+    parser.add_option("-a", "--starts", action="store", type="int", default=1, dest="starts")
+    parser.add_option("-w", "--workers", action="store", type="int", dest="workers")
+    parser.add_option("-H", "--hop", action="store", type="float", dest="hop",
+                      help="retract to this height for moves up to the hop distance, between any two cuts "
+                           "(not just the same path) so it must clear any clamps or fixtures on the way")
+    parser.add_option("-l", "--hop-distance", action="store", type="float", default=HOP_DISTANCE, dest="hopdistance",
+                      help="longest move that only retracts to the hop height (default %default)")
+    parser.add_option("-g", "--stay-down", action="store", type="float", dest="staydown")
     options, args = parser.parse_args()
     # Check for required options
     for required in ("output", "panel"):
@@ -565,12 +598,24 @@ if __name__ == "__main__":
         LOG.severity = Logger.MSG_DEBUG
     else:
         LOG.severity = Logger.MSG_INFO
+    # Time allowed to improve each optimised file (eg '10s')
+    budget = None
+    if options.optimisetime is not None:
+        try:
+            budget = float(options.optimisetime.rstrip("s"))
+        except ValueError:
+            LOG.FATAL("Invalid optimisation time '%s'", options.optimisetime)
+    optimiseSettings = dict(budget=budget, starts=options.starts, workers=options.workers,
+                            hop=options.hop, hopDistance=options.hopdistance, stayDown=options.staydown)
+    # Debug output can be huge, write it in blocks
+    LOG.buffered = options.debug
+    LOG.structured = options.jsonlog
     # Set up the panel
     try:
         panel = Panel(options.panel)
     except Exception as ex:
         LOG.FATAL("Could not load panel definition '%s'" % options.panel)
-    LOG.DEBUG("Panel - %s" % panel)
+    LOG.DEBUG("Panel - %s", panel)
     # Load boards
     pcbs = dict()
     boards = list()
@@ -608,7 +653,7 @@ if __name__ == "__main__":
     LOG.INFO("Selected layout ...")
     for board in panel.layout:
         if board.name != "_lock_":
-            LOG.INFO("  %s" % board)
+            LOG.INFO("  %s", board)
     # Now we generate the output files
     top = GCode()
     bottom = GCode()
@@ -624,14 +669,14 @@ if __name__ == "__main__":
     if options.optimise:
         LOG.INFO("Optimising ...")
         LOG.INFO("  Top copper")
-        top = optimise(top)
+        top = optimise(top, **optimiseSettings)
         LOG.INFO("  Bottom copper")
-        bottom = optimise(bottom)
+        bottom = optimise(bottom, **optimiseSettings)
         LOG.INFO("  Board outline")
-        outline = optimise(outline)
+        outline = optimise(outline, **optimiseSettings)
         for diam in drills.keys():
-            LOG.INFO("  Drill (%0.1fmm)" % diam)
-            drills[diam] = optimise(drills[diam])
+            LOG.INFO("  Drill (%0.1fmm)", diam)
+            drills[diam] = optimise(drills[diam], **optimiseSettings)
     # Adjust the feed rate if required
     feedrate = getattr(options, "feedrate")
     if feedrate is not None:
@@ -649,9 +694,9 @@ if __name__ == "__main__":
             # Write the file
             filename = options.output + filename
             filenames.append(filename)
-            LOG.INFO("Generating %s" % filename)
+            LOG.INFO("Generating %s", filename)
             saveGCode(filename, gcode, prefix=settings['prefix'], suffix=settings['suffix'])
-            LOG.INFO("  %s" % str(gcode))
+            LOG.INFO("  %s", gcode)
             gcode.render(splitext(filename)[0] + ".png")
     # Save the drill files
     index = 3
@@ -668,9 +713,9 @@ if __name__ == "__main__":
         # Write the file
         filename = "%s_%02d_drill_%0.1f.ngc" % (options.output, index, float(diam))
         filenames.append(filename)
-        LOG.INFO("Generating %s" % filename)
+        LOG.INFO("Generating %s", filename)
         saveGCode(filename, drills[diam], prefix=settings['prefix'], suffix=settings['suffix'])
-        LOG.INFO("  %s" % str(drills[diam]))
+        LOG.INFO("  %s", drills[diam])
         drills[diam].render(splitext(filename)[0] + ".png")
         index = index + 1
     # Finally generate a OpenSCAM project with all the files
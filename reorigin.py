@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 # ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Process the file in two streaming passes rather than loading it.
+#
 # 28-Jul-2015 ShaneG
 #
 # Updated to use the new framework.
@@ -12,7 +16,7 @@ from optparse import OptionParser
 from os.path import splitext
 from sys import argv
 
-from util import loadGCode, saveGCode, Translate
+from util import saveGCode, FilterChain, GCode, GCodeStream, Translate
 
 # --- Usage information
 USAGE = """
@@ -37,13 +41,20 @@ if __name__ == "__main__":
     if len(args) != 1:
         print(USAGE.strip() % argv[0])
         exit(1)
-    # Process the file
-    gcode = loadGCode(args[0])
-    if (gcode.minx != 0) or (gcode.miny != 0):
-        print("Translating file by dx = %0.4f, dy = %0.4f" % (-gcode.minx, -gcode.miny))
-        gcode = gcode.clone(Translate(-gcode.minx, -gcode.miny))
+    # First pass to find the bounds
+    original = GCodeStream()
+    for cmd in original.read(args[0]):
+        pass
+    chain = FilterChain()
+    if (original.minx != 0) or (original.miny != 0):
+        print("Translating file by dx = %0.4f, dy = %0.4f" % (-original.minx, -original.miny))
+        chain = FilterChain(Translate(-original.minx, -original.miny))
     else:
         print("No translation required.")
-    saveGCode(options.output_file, gcode)
+    # Second pass to generate the output
+    gcode = GCodeStream()
+    if options.image:
+        gcode = GCode()
+    saveGCode(options.output_file, gcode.tee(chain.stream(GCodeStream().read(args[0]))))
     if options.image:
         gcode.render(splitext(options.output_file)[0] + ".png")
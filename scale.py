@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 # ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Stream the file rather than loading it all into memory.
+#
 # 28-Dec-2022 Matt L
 #
 # Scale a gcode file
@@ -8,7 +12,7 @@ from optparse import OptionParser
 from os.path import splitext
 from sys import argv
 
-from util import loadGCode, saveGCode, Scale
+from util import saveGCode, FilterChain, GCode, GCodeStream, Scale
 
 # --- Usage information
 USAGE = """
@@ -41,16 +45,19 @@ if __name__ == "__main__":
             exit(1)
     source = args[0]
     # Process the file
-    gcode = loadGCode(source)
-    print("Loaded - %s" % str(gcode))
-    gcode = gcode.clone(Scale(options.factor))
+    name, ext = splitext(options.output)
+    if ext == "":
+        ext = ".ngc"
+    # Only keep the whole program in memory if we need to draw it
+    loaded = GCodeStream()
+    gcode = GCodeStream()
+    if options.image:
+        gcode = GCode()
+    chain = FilterChain(Scale(options.factor))
+    saveGCode(name + ext, gcode.tee(chain.stream(loaded.read(source))))
+    print("Loaded - %s" % str(loaded))
     print("Generated - %s" % str(gcode))
     # Generate an image if required
-    name, ext = splitext(options.output)
     if options.image:
         filename = name + ".png"
         gcode.render(filename)
-    # Generate the output file
-    if ext == "":
-        ext = ".ngc"
-    saveGCode(name + ext, gcode)
@@ -6,10 +6,13 @@
 # ----------------------------------------------------------------------------
 from util.arcfix import CorrectArc
 from util.filename import defaultExtension
-from util.filters import SwapXY, Translate, Rotate, Flip, ZLevel, FeedRate, Scale
-from util.gcode import PARAMS, GCommand, GCode, Loader, Filter, FilterChain, loadGCode, saveGCode
+from util.filters import Affine, SwapXY, Translate, Rotate, Flip, ZLevel, FeedRate, Scale
+from util.gcode import PARAMS, GCommand, GCode, GCodeStream, Loader, Filter, FilterChain, loadGCode, iterGCode, \
+    saveGCode
 from util.jsonhelp import toJSON, fromJSON, fromJSONFile
 from util.loaders import BoxedLoader
 from util.logger import LOG, Logger
-from util.optimise import optimise
+from util.optimise import HOP_DISTANCE, optimise
 from util.options import getSettings
+from util.state import MachineState, Position
+from util.table import CommandTable
@@ -1,5 +1,11 @@
 #!/usr/bin/env python
 # ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Use util.state.Position to track the current location. Added
+# applyInPlace() to correct arcs without copying the command. A CommandTable
+# has all of its arcs corrected at once by bendArcs().
+#
 # 27-Jul-2015 ShaneG
 #
 # Updated to work with the new framework
@@ -12,7 +18,10 @@
 # ----------------------------------------------------------------------------
 from math import sqrt, atan, sin, cos, radians
 
+import numpy as np
+
 from util.gcode import Filter
+from util.state import MachineState, Position
 
 
 # ----------------------------------------------------------------------------
@@ -84,6 +93,30 @@ def bendThatArc(X0, Y0, X1, Y1, X2, Y2):
         # Instead, we simply choose the solution closer to the original center...
         return (X4, Y4)
 
+
+def bendArcs(X0, Y0, X1, Y1, X2, Y2):
+    """ Recalculate the centers of many arcs at once
+
+      The parameters are arrays with the same meaning as for bendThatArc(),
+      which this follows step by step. Returns arrays of the X and Y values
+      of the centers.
+    """
+    R = np.sqrt(np.square(X0 - X2) + np.square(Y0 - Y2))
+    T = np.sqrt(np.square(X0 - X1) + np.square(Y0 - Y1)) / 2
+    S = np.sqrt(np.abs(np.square(R) - np.square(T)))
+    Xm = (X0 + X1) / 2
+    Ym = (Y0 + Y1) / 2
+    # Avoid the division by zero for endpoints on the same vertical
+    vertical = X0 == X1
+    slope = (Y1 - Y0) / np.where(vertical, 1.0, X1 - X0)
+    alfa = np.where(vertical, radians(90), np.arctan(slope))
+    sina, cosa = S * np.sin(alfa), S * np.cos(alfa)
+    # The two possible solutions, pick the one closest to the original center
+    X3, Y3 = Xm + sina, Ym - cosa
+    X4, Y4 = Xm - sina, Ym + cosa
+    first = np.sqrt(np.square(X2 - X3) + np.square(Y2 - Y3)) < np.sqrt(np.square(X2 - X4) + np.square(Y2 - Y4))
+    return np.where(first, X3, X4), np.where(first, Y3, Y4)
+
     # ----------------------------------------------------------------------------
 
 
@@ -94,30 +127,63 @@ class CorrectArc(Filter):
     """ Correct the center point of arcs
     """
 
+    pure = True
+
     def __init__(self):
         """ Constructor
         """
-        self.x = 0.0
-        self.y = 0.0
+        self.position = Position()
 
     def apply(self, command):
         """ Calculate the correct center point for an arc command
         """
+        return self._correct(command, True)
+
+    def applyInPlace(self, command):
+        """ Correct the center point of an arc without copying the command
+        """
+        return self._correct(command, False)
+
+    def _correct(self, command, copy):
+        """ Correct the center point, copying the command first if required
+        """
         # Make sure it is an arc command
         for p in ("X", "Y", "I", "J"):
             if getattr(command, p, None) is None:
                 # Store the last X/Y position
-                self.x = command.X or self.x
-                self.y = command.Y or self.y
+                self.position.update(command)
                 return command
         # Recalculate the center point
-        if dist(self.x, self.y, command.X, command.Y) > 0.0:
-            command = command.clone()
-            i, j = bendThatArc(self.x, self.y, command.X, command.Y, self.x + command.I, self.y + command.J)
-            command.I = i - self.x
-            command.J = j - self.y
+        x, y = self.position.x, self.position.y
+        if dist(x, y, command.X, command.Y) > 0.0:
+            if copy:
+                command = command.clone()
+            i, j = bendThatArc(x, y, command.X, command.Y, x + command.I, y + command.J)
+            command.I = i - x
+            command.J = j - y
         # Store the last X/Y position
-        self.x = command.X or self.x
-        self.y = command.Y or self.y
+        self.position.update(command)
         # Done
         return command
+
+    def applyBatch(self, table):
+        """ Calculate the correct center point for all arcs in a CommandTable
+        """
+        state = MachineState(table, self.position)
+        self.position = state.final()
+        x, y, i, j = [table.column(p) for p in ("X", "Y", "I", "J")]
+        arcs = np.flatnonzero(~np.isnan(x) & ~np.isnan(y) & ~np.isnan(i) & ~np.isnan(j))
+        if len(arcs) == 0:
+            return table
+        x0, y0 = state.x0[arcs], state.y0[arcs]
+        x1, y1 = x[arcs], y[arcs]
+        # Arcs that start and end at the same point are left alone
+        moved = np.sqrt(np.square(x0 - x1) + np.square(y0 - y1)) > 0.0
+        arcs, x0, y0, x1, y1 = arcs[moved], x0[moved], y0[moved], x1[moved], y1[moved]
+        if len(arcs) == 0:
+            return table
+        result = table.copy()
+        cx, cy = bendArcs(x0, y0, x1, y1, x0 + i[arcs], y0 + j[arcs])
+        result.column("I")[arcs] = cx - x0
+        result.column("J")[arcs] = cy - y0
+        return result
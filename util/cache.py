@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Binary cache of parsed gcode files. The cache is written next to the
+# source file (with '.ngcb' added to the name) and holds the columns of
+# each parsed program along with the units and bounds.
+# ----------------------------------------------------------------------------
+from hashlib import blake2b
+from json import dumps, loads
+from mmap import mmap, ACCESS_READ
+from os import stat, replace, remove
+from os.path import basename, exists
+
+import numpy as np
+
+from util.command import PARAMS
+from util.logger import LOG
+from util.table import CommandTable
+
+# Change this whenever the parser or the cache layout changes
+CACHE_VERSION = 2
+
+
+def cacheName(filename):
+    """ Get the name of the cache file for a gcode file
+
+      The full name is kept so files that only differ by extension (eg
+      'board.ngc' and 'board.gcode') have separate caches.
+    """
+    return filename + ".ngcb"
+
+
+def contentHash(filename):
+    """ Calculate a hash of the file contents
+    """
+    digest = blake2b(digest_size=16)
+    with open(filename, "rb") as source:
+        if stat(filename).st_size > 0:
+            with mmap(source.fileno(), 0, access=ACCESS_READ) as data:
+                digest.update(data)
+    return digest.hexdigest()
+
+
+def _packTable(prefix, table, arrays):
+    """ Add the arrays for a table to the dictionary being saved
+
+      Each column is stored as a bit mask of the rows where the parameter
+      is present and the values for those rows only.
+    """
+    codes = table.codes[:len(table)]
+    if len(table.commands) < 256:
+        codes = codes.astype(np.uint8)
+    elif len(table.commands) < 65536:
+        codes = codes.astype(np.uint16)
+    arrays[prefix + "codes"] = codes
+    for p in PARAMS:
+        column = table.column(p)
+        present = ~np.isnan(column)
+        arrays[prefix + "mask" + p] = np.packbits(present)
+        arrays[prefix + "value" + p] = column[present]
+
+
+def _unpackTable(prefix, arrays, header):
+    """ Rebuild a table from the saved arrays
+    """
+    codes = arrays[prefix + "codes"]
+    table = CommandTable(max(1, len(codes)))
+    table.codes[:len(codes)] = codes
+    for p in PARAMS:
+        present = np.unpackbits(arrays[prefix + "mask" + p], count=len(codes)).astype(bool)
+        table.columns[p][:len(codes)][present] = arrays[prefix + "value" + p]
+    table.commands = list(header["commands"])
+    table.lookup = dict([(c, i) for i, c in enumerate(table.commands)])
+    table.comments = dict([(int(row), comment) for row, comment in header["comments"].items()])
+    table.size = len(codes)
+    return table
+
+
+def readCache(filename, signature):
+    """ Read the cached results for a gcode file
+
+      The signature describes the loader configuration used. Returns a list
+      of (table, units, bounds) tuples or None if there is no valid cache.
+    """
+    name = cacheName(filename)
+    if not exists(name):
+        return None
+    try:
+        with np.load(name, allow_pickle=False) as arrays:
+            header = loads(str(arrays["header"]))
+            if (header["version"] != CACHE_VERSION) or (header["signature"] != signature):
+                return None
+            if header["source"] != basename(filename):
+                return None
+            info = stat(filename)
+            if info.st_size != header["size"]:
+                return None
+            if info.st_mtime_ns != header["mtime"]:
+                # Same size but touched, only use it if the content matches
+                if contentHash(filename) != header["hash"]:
+                    return None
+            results = list()
+            for index, entry in enumerate(header["results"]):
+                table = _unpackTable("%d_" % index, arrays, entry)
+                results.append((table, entry["units"], tuple(entry["bounds"])))
+            return results
+    except Exception as ex:
+        LOG.WARN("Ignoring unreadable cache file '%s' - %s", name, ex)
+        return None
+
+
+def writeCache(filename, signature, results):
+    """ Write the cache for a gcode file
+
+      The results are a list of (table, units, bounds) tuples.
+    """
+    name = cacheName(filename)
+    info = stat(filename)
+    header = {
+        "version": CACHE_VERSION,
+        "signature": signature,
+        "source": basename(filename),
+        "size": info.st_size,
+        "mtime": info.st_mtime_ns,
+        "hash": contentHash(filename),
+        "results": list(),
+    }
+    arrays = dict()
+    for index, (table, units, bounds) in enumerate(results):
+        _packTable("%d_" % index, table, arrays)
+        header["results"].append({
+            "units": units,
+            "bounds": bounds,
+            "commands": table.commands,
+            "comments": dict([(str(row), comment) for row, comment in table.comments.items()]),
+        })
+    arrays["header"] = np.array(dumps(header))
+    # Write to a temporary file first so a partial cache is never seen
+    temporary = name + ".tmp"
+    try:
+        with open(temporary, "wb") as target:
+            np.savez(target, **arrays)
+        replace(temporary, name)
+    except Exception as ex:
+        LOG.WARN("Unable to write cache file '%s' - %s", name, ex)
+        if exists(temporary):
+            remove(temporary)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Moved out of gcode.py so the storage engines can share it.
+#
+# 21-Jul-2015 ShaneG
+#
+# Representation of a single gcode command.
+# ----------------------------------------------------------------------------
+# Supported parameter words
+PARAMS = ("X", "Y", "Z", "I", "J", "K", "R", "F", "P")
+
+
+# Lookup for parameter words
+_PARAMS = frozenset(PARAMS)
+
+# Cache of normalised command names (eg "G1" -> "G01")
+_COMMANDS = dict()
+
+# Cache of parsed lines that are frequently repeated
+_REPEATED = dict()
+
+# Translation used to split words when a line is not in the usual format
+_SPLITWORDS = dict([(ord(c), " " + c.upper()) for c in "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"])
+_SPLITWORDS.update(dict([(ord(c), None) for c in " \t\r\n\f\v"]))
+
+
+def _command(word):
+    """ Normalise the command word to look like Gnn or Gnn.n
+    """
+    command = _COMMANDS.get(word, None)
+    if command is None:
+        if not word[0].isalpha():
+            raise ValueError("Invalid command '%s'" % word)
+        value = float(word[1:])
+        if value == int(value):
+            command = "%s%02d" % (word[0], int(value))
+        else:
+            command = "%s%02.1f" % (word[0], value)
+        if len(_COMMANDS) < 1024:
+            _COMMANDS[word] = command
+    return command
+
+
+def _parseWords(line):
+    """ Slow path for parseFields, copes with words that contain spaces or
+        are not separated at all (eg "X 10" or "X10Y5").
+    """
+    fields = dict()
+    for word in line.translate(_SPLITWORDS).split():
+        try:
+            if "command" not in fields:
+                fields["command"] = _command(word)
+            elif word[0] in _PARAMS:
+                fields[word[0]] = float(word[1:])
+        except ValueError:
+            # Not a valid word, ignore it
+            pass
+    return fields
+
+
+def parseFields(line):
+    """ Parse a line of gcode into a dictionary of fields
+
+      The dictionary always contains 'command' and 'comment' entries as well
+      as an entry for each parameter in PARAMS that is present. Comments may be
+      in parentheses or follow a ';'. Words are case insensitive and numbers
+      are not expected to have exponents.
+
+      Lines without X/Y co-ordinates (retracts, plunges, comments) tend to be
+      repeated many times so the results for those are cached.
+    """
+    fields = _REPEATED.get(line, None)
+    if fields is not None:
+        return dict(fields)
+    fields = _parseFields(line)
+    if ("X" not in fields) and ("Y" not in fields) and (len(_REPEATED) < 4096):
+        _REPEATED[line] = dict(fields)
+    return fields
+
+
+def _parseFields(line):
+    """ Parse a line of gcode into a dictionary of fields
+    """
+    comment = ""
+    if ("(" in line) or (";" in line):
+        i = line.find("(")
+        j = line.find(";")
+        if (i < 0) or (0 <= j < i):
+            i = j
+        comment = line[i:].strip()
+        line = line[:i]
+    line = line.upper()
+    if ("E" in line) or ("N" in line):
+        # float() would accept exponents, 'nan' and 'inf'
+        fields = _parseWords(line)
+        fields.setdefault("command", "")
+        fields["comment"] = comment
+        return fields
+    words = line.split()
+    if len(words) == 0:
+        return {"command": "", "comment": comment}
+    try:
+        # Fast path - whitespace separated words with no gaps
+        command = _COMMANDS.get(words[0], None) or _command(words[0])
+        fields = {"command": command, "comment": comment}
+        for word in words[1:]:
+            if word[0] in _PARAMS:
+                fields[word[0]] = float(word[1:])
+    except ValueError:
+        fields = _parseWords(line)
+        fields.setdefault("command", "")
+        fields["comment"] = comment
+    return fields
+
+
+class GCommand:
+    """ Represents a single command (or parameter)
+    """
+
+    # Parameters default to not present
+    X = Y = Z = I = J = K = R = F = P = None
+
+    def __init__(self, line=""):
+        """ Construct from a line
+        """
+        self.__dict__ = parseFields(line)
+
+    @classmethod
+    def fromFields(cls, fields):
+        """ Create an instance from the result of parseFields()
+
+          The fields are copied so they can be shared between commands.
+        """
+        result = cls.__new__(cls)
+        result.__dict__ = dict(fields)
+        return result
+
+    def clone(self):
+        """ Create a copy of this instance
+        """
+        result = GCommand()
+        result.command = self.command
+        result.comment = self.comment
+        for p in PARAMS:
+            setattr(result, p, getattr(self, p))
+        return result
+
+    def matches(self, other):
+        """ Determine if this command matches the other
+        """
+        if self.command != other.command:
+            return False
+        for p in PARAMS:
+            if getattr(self, p) != getattr(other, p):
+                return False
+        return True
+
+    def __str__(self):
+        """ Convert the command back into a string
+        """
+        result = self.command
+        for param in PARAMS:
+            p = getattr(self, param)
+            if p is not None:
+                result = "%s %s%0.4f" % (result, param, p)
+        result = "%s %s" % (result, self.comment)
+        return result.strip()
@@ -1,62 +1,247 @@
 #!/usr/bin/env python
 # ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Arcs now come out of every transform with the same geometry as the rest of
+# the path. Scale used to leave I/J and R alone (so a scaled arc no longer
+# met its own end point) and SwapXY kept the arc direction although swapping
+# the axes is a reflection. Flip only reversed arcs given with I/J.
+#
+# The geometric filters are now all affine transforms so a chain of them
+# can be combined into one.
+#
+# Filters only clone a command when they need to change it, returning the
+# original indicates that it is unchanged. They are marked as pure so
+# GCode.clone() doesn't copy the commands first.
+#
+# Added applyInPlace() to each filter to modify commands without copying
+# them when the source program is not reused.
+#
+# Added kernelSource() so FilterChain.compile() can inline the filters.
+#
 # 22-Jul-2015 ShaneG
 #
 # A simple set of filters.
 # ----------------------------------------------------------------------------
-from math import sin, cos, radians
+from math import sin, cos, radians, sqrt
+
+import numpy as np
 
 from util.gcode import Filter
+from util.kernel import literal
+from util.state import MachineState, Position
 
 
-class SwapXY(Filter):
-    """ Swap X/Y (and I/J) co-ordinates
+class Affine(Filter):
+    """ Apply a 2D affine transform to the X/Y co-ordinates
+
+      The 3x3 matrix maps (x, y, 1) to the new position, the relative I/J
+      values only use the linear part of it. Arcs change direction if the
+      transform is a reflection and R is scaled along with the co-ordinates.
+      A Z offset can be included as well. Consecutive affine filters in a
+      FilterChain are combined into a single transform.
     """
 
+    pure = True
+
+    def __init__(self, matrix=None, dz=0.0):
+        """ Set the transform
+        """
+        if matrix is None:
+            matrix = np.identity(3)
+        self.matrix = np.array(matrix, dtype=float)
+        self.dz = dz
+        (self.a, self.b, self.c), (self.d, self.e, self.f) = self.matrix[:2].tolist()
+        determinant = (self.a * self.e) - (self.b * self.d)
+        # Reflections change the direction of arcs
+        self.reverses = determinant < 0.0
+        self.scale = sqrt(abs(determinant))
+        # Each axis only depends on itself (no rotation or swapping)
+        self.diagonal = (self.b == 0.0) and (self.d == 0.0)
+        # Missing axis values are taken from the current position
+        self.position = Position()
+
+    def compose(self, other):
+        """ Combine with another affine filter applied after this one
+        """
+        if not isinstance(other, Affine):
+            return None
+        return Affine(other.matrix.dot(self.matrix), self.dz + other.dz)
+
+    def transform(self, x, y):
+        """ Transform a point (or arrays of points)
+        """
+        return (self.a * x) + (self.b * y) + self.c, (self.d * x) + (self.e * y) + self.f
+
     def apply(self, command):
-        result = command.clone()
-        result.X, result.Y = command.Y, command.X
-        result.I, result.J = command.J, command.I
+        arc = self.reverses and (command.command in ("G02", "G03"))
+        if (command.X is None) and (command.Y is None) and (command.I is None) and (command.J is None) and \
+                (command.R is None) and ((command.Z is None) or (self.dz == 0.0)) and not arc:
+            return command
+        return self.applyInPlace(command.clone())
+
+    def applyInPlace(self, command):
+        x, y, i, j = command.X, command.Y, command.I, command.J
+        result = command
+        # Do the X, Y co-ordinates
+        if (x is not None) or (y is not None):
+            if self.diagonal:
+                if x is not None:
+                    result.X = (self.a * x) + self.c
+                if y is not None:
+                    result.Y = (self.e * y) + self.f
+            else:
+                if x is None:
+                    x = self.position.x
+                if y is None:
+                    y = self.position.y
+                result.X, result.Y = self.transform(x, y)
+                self.position.x, self.position.y = x, y
+        # I, J are relative to current position so only need the linear part
+        if (i is not None) or (j is not None):
+            if self.diagonal:
+                if i is not None:
+                    result.I = self.a * i
+                if j is not None:
+                    result.J = self.e * j
+            else:
+                i, j = i or 0.0, j or 0.0
+                result.I = (self.a * i) + (self.b * j)
+                result.J = (self.d * i) + (self.e * j)
+        if command.R is not None:
+            result.R = command.R * self.scale
+        if (command.Z is not None) and (self.dz != 0.0):
+            result.Z = command.Z + self.dz
+        # Arcs change direction in a reflection
+        if self.reverses and (command.command in ("G02", "G03")):
+            if command.command == "G02":
+                result.command = "G03"
+            else:
+                result.command = "G02"
+        return result
+
+    def kernelSource(self, name):
+        """ Generate the source for the transform (see Filter.kernelSource())
+        """
+        a, b, c, d, e, f = [literal(v) for v in (self.a, self.b, self.c, self.d, self.e, self.f)]
+        times = lambda k, v: v if k == "1.0" else "(%s * %s)" % (k, v)
+        fields = ["X", "Y", "I", "J", "R"]
+        lines = list()
+        # Do the X, Y co-ordinates
+        if self.diagonal:
+            lines.extend([
+                "if X is not None:",
+                "    X = %s + %s" % (times(a, "X"), c),
+                "    changed = True",
+                "if Y is not None:",
+                "    Y = %s + %s" % (times(e, "Y"), f),
+                "    changed = True",
+                "if I is not None:",
+                "    I = %s" % times(a, "I"),
+                "    changed = True",
+                "if J is not None:",
+                "    J = %s" % times(e, "J"),
+                "    changed = True",
+            ])
+        else:
+            lines.extend([
+                "if (X is not None) or (Y is not None):",
+                "    position = %s.position" % name,
+                "    x = position.x if X is None else X",
+                "    y = position.y if Y is None else Y",
+                "    X = (%s * x) + (%s * y) + %s" % (a, b, c),
+                "    Y = (%s * x) + (%s * y) + %s" % (d, e, f),
+                "    position.x, position.y = x, y",
+                "    changed = True",
+                "if (I is not None) or (J is not None):",
+                "    i, j = I or 0.0, J or 0.0",
+                "    I = (%s * i) + (%s * j)" % (a, b),
+                "    J = (%s * i) + (%s * j)" % (d, e),
+                "    changed = True",
+            ])
+        lines.append("if R is not None:")
+        if self.scale != 1.0:
+            lines.append("    R = R * %s" % literal(self.scale))
+        lines.append("    changed = True")
+        if self.dz != 0.0:
+            fields.append("Z")
+            lines.extend([
+                "if Z is not None:",
+                "    Z = Z + %s" % literal(self.dz),
+                "    changed = True",
+            ])
+        # Arcs change direction in a reflection
+        if self.reverses:
+            fields.append("command")
+            lines.extend([
+                "if code == \"G02\":",
+                "    code = \"G03\"",
+                "    changed = True",
+                "elif code == \"G03\":",
+                "    code = \"G02\"",
+                "    changed = True",
+            ])
+        return fields, lines
+
+    def applyBatch(self, table):
+        """ Apply the transform to every row of a CommandTable
+        """
+        result = table.copy()
+        x, y = result.column("X"), result.column("Y")
+        i, j = result.column("I"), result.column("J")
+        if self.diagonal:
+            x[:], y[:] = (self.a * x) + self.c, (self.e * y) + self.f
+            i *= self.a
+            j *= self.e
+        else:
+            rows = ~np.isnan(x) | ~np.isnan(y)
+            state = MachineState(table, self.position)
+            self.position = state.final()
+            x[rows], y[rows] = self.transform(state.x[rows], state.y[rows])
+            rows = ~np.isnan(i) | ~np.isnan(j)
+            i0, j0 = np.nan_to_num(i[rows]), np.nan_to_num(j[rows])
+            i[rows], j[rows] = (self.a * i0) + (self.b * j0), (self.d * i0) + (self.e * j0)
+        result.column("R")[:] *= self.scale
+        result.column("Z")[:] += self.dz
+        if self.reverses:
+            codes = result.codes[:len(result)]
+            cw, ccw = codes == result.code("G02"), codes == result.code("G03")
+            codes[cw] = result.intern("G03")
+            codes[ccw] = result.intern("G02")
         return result
 
 
-class Translate(Filter):
+class SwapXY(Affine):
+    """ Swap X/Y (and I/J) co-ordinates
+
+      This is a reflection so G02 and G03 are swapped as well.
+    """
+
+    def __init__(self):
+        Affine.__init__(self, ((0.0, 1.0, 0.0), (1.0, 0.0, 0.0), (0.0, 0.0, 1.0)))
+
+
+class Translate(Affine):
     """ Translate on one or more axis
     """
 
     def __init__(self, dx=0.0, dy=0.0, dz=0.0):
+        Affine.__init__(self, ((1.0, 0.0, dx), (0.0, 1.0, dy), (0.0, 0.0, 1.0)), dz)
         self.dx = dx
         self.dy = dy
-        self.dz = dz
-
-    def apply(self, command):
-        result = command.clone()
-        if command.X is not None:
-            result.X = command.X + self.dx
-        if command.Y is not None:
-            result.Y = command.Y + self.dy
-        if command.Z is not None:
-            result.Z = command.Z + self.dz
-        return result
 
 
-class Scale(Filter):
+class Scale(Affine):
     """ Scale on one or more axis
+
+      Arc offsets (I/J) and radii (R) are scaled with the co-ordinates.
     """
 
     def __init__(self, scale):
-        self.scale = scale
-
-    def apply(self, command):
-        result = command.clone()
-        if command.X is not None:
-            result.X = command.X * self.scale
-        if command.Y is not None:
-            result.Y = command.Y * self.scale
-        return result
+        Affine.__init__(self, ((scale, 0.0, 0.0), (0.0, scale, 0.0), (0.0, 0.0, 1.0)))
 
 
-class Rotate(Filter):
+class Rotate(Affine):
     """ Rotate around the origin
     """
 
@@ -64,118 +249,169 @@ class Rotate(Filter):
         """ Set the rotation angle
         """
         self.angle = radians(angle)
-        self.ox, self.oy = 0.0, 0.0
-        self.nx, self.ny = 0.0, 0.0
-
-    def apply(self, command):
-        result = command.clone()
-        # I, J are relative to current position so translate before rotating
-        if (command.I is not None) and (command.J is not None):
-            i = command.I + self.ox
-            j = command.J + self.oy
-            result.I = ((i * cos(self.angle)) - (j * sin(self.angle))) - self.nx
-            result.J = ((i * sin(self.angle)) + (j * cos(self.angle))) - self.ny
-        # Do the X, Y co-ordinates
-        if (command.X is not None) and (command.Y is not None):
-            result.X = (command.X * cos(self.angle)) - (command.Y * sin(self.angle))
-            result.Y = (command.X * sin(self.angle)) + (command.Y * cos(self.angle))
-        # Save position
-        self.ox = command.X or self.ox
-        self.oy = command.Y or self.oy
-        self.nx = (self.ox * cos(self.angle)) - (self.oy * sin(self.angle))
-        self.ny = (self.ox * sin(self.angle)) + (self.oy * cos(self.angle))
-        # Done
-        return result
+        c, s = cos(self.angle), sin(self.angle)
+        Affine.__init__(self, ((c, -s, 0.0), (s, c, 0.0), (0.0, 0.0, 1.0)))
 
 
-class Flip(Filter):
+class Flip(Affine):
     """ Flip X and or Y points around a given center point
+
+      Flipping a single axis changes the direction of arcs, flipping both
+      is a rotation and leaves them alone.
     """
 
     def __init__(self, xflip=None, yflip=None):
-        """ Set the rotation angle
+        """ Set the flip axis
         """
         self.xflip = xflip
         self.yflip = yflip
-        self.ox, self.oy = 0.0, 0.0
-        self.nx, self.ny = 0.0, 0.0
-
-    def apply(self, command):
-        result = command.clone()
-        if self.xflip is not None:
-            if command.X is not None:
-                result.X = self.xflip - (command.X - self.xflip)
-            if command.I is not None:
-                # I is relative so translate first
-                i = command.I + self.ox
-                result.I = (self.xflip - (i - self.xflip)) - self.nx
-                # Arcs change direction in a flip
-                if command.command == "G02":
-                    result.command = "G03"
-                elif command.command == "G03":
-                    result.command = "G02"
-        if self.yflip is not None:
-            if command.Y is not None:
-                result.Y = self.yflip - (command.Y - self.yflip)
-            if command.J is not None:
-                # J is relative so translate first
-                j = command.J + self.oy
-                result.J = (self.yflip - (j - self.yflip)) - self.ny
-                # Arcs change direction in a flip
-                if command.command == "G02":
-                    result.command = "G03"
-                elif command.command == "G03":
-                    result.command = "G02"
-        # Save position
-        self.ox = command.X or self.ox
-        self.oy = command.Y or self.oy
-        self.nx = result.X or self.nx
-        self.ny = result.Y or self.ny
-        # All done
-        return result
+        matrix = np.identity(3)
+        if xflip is not None:
+            matrix[0] = (-1.0, 0.0, 2.0 * xflip)
+        if yflip is not None:
+            matrix[1] = (0.0, -1.0, 2.0 * yflip)
+        Affine.__init__(self, matrix)
 
 
 class ZLevel(Filter):
     """ Adjust Z levels for safe and cut depths
     """
 
+    pure = True
+
     def __init__(self, cut=None, safe=None):
         """ Set the depths to use
         """
         self.cut = cut
         self.safe = safe
 
+    def _level(self, z):
+        """ Get the new value for a Z level
+        """
+        if (z is None) or (z == 0.0):
+            return z
+        if (z < 0.0) and (self.cut is not None):
+            return self.cut
+        if (z > 0.0) and (self.safe is not None):
+            return self.safe
+        return z
+
     def apply(self, command):
-        if command.Z is None:
+        z = self._level(command.Z)
+        if z == command.Z:
             return command
-        command = command.clone()
-        if (command.Z < 0.0) and (self.cut is not None):
-            command.Z = self.cut
-        elif (command.Z > 0.0) and (self.safe is not None):
-            command.Z = self.safe
+        result = command.clone()
+        result.Z = z
         # All done
+        return result
+
+    def applyInPlace(self, command):
+        command.Z = self._level(command.Z)
         return command
 
+    def kernelSource(self, name):
+        lines = list()
+        for test, value in (("Z < 0.0", self.cut), ("Z > 0.0", self.safe)):
+            if value is not None:
+                lines.extend([
+                    "%s %s:" % ("elif" if lines else "if", test),
+                    "    if Z != %s:" % literal(value),
+                    "        Z = %s" % literal(value),
+                    "        changed = True",
+                ])
+        if len(lines) == 0:
+            return (), lines
+        return ("Z", ), ["if Z is not None:"] + ["    " + line for line in lines]
+
+    def applyBatch(self, table):
+        z = table.column("Z")
+        updated = z.copy()
+        if self.cut is not None:
+            updated[z < 0.0] = self.cut
+        if self.safe is not None:
+            updated[z > 0.0] = self.safe
+        if np.array_equal(updated, z, equal_nan=True):
+            return table
+        result = table.copy()
+        result.column("Z")[:] = updated
+        return result
+
 
 class FeedRate(Filter):
     """ Adjust the cutting feed rate
     """
 
+    pure = True
+
     def __init__(self, cutting=None, drilling=None):
         self.cutting = cutting
         self.drilling = drilling
 
-    def apply(self, command):
+    def _feed(self, command):
+        """ Get the new feed rate for a command
+        """
         # Is it a cutting operation ?
         if not command.command in ("G01", "G02", "G03"):
-            return command
+            return command.F
         # Are we drilling?
+        feed = command.F
         if command.Z is not None:
             # Is a feed rate set ?
             if (command.F is not None) and (self.drilling is not None):
-                command.F = self.drilling
+                feed = self.drilling
         elif (command.X is not None) or (command.Y is not None):
             # Is a feed rate set ?
             if (command.F is not None) and (self.cutting is not None):
-                command.F = self.cutting
+                feed = self.cutting
+        return feed
+
+    def apply(self, command):
+        feed = self._feed(command)
+        if feed == command.F:
+            return command
+        result = command.clone()
+        result.F = feed
+        return result
+
+    def applyInPlace(self, command):
+        command.F = self._feed(command)
         return command
+
+    def kernelSource(self, name):
+        def update(value):
+            return [
+                "        if (F is not None) and (F != %s):" % literal(value),
+                "            F = %s" % literal(value),
+                "            changed = True",
+            ]
+        lines = ["if code in (\"G01\", \"G02\", \"G03\"):"]
+        if self.drilling is not None:
+            lines.append("    if Z is not None:")
+            lines.extend(update(self.drilling))
+            if self.cutting is not None:
+                lines.append("    elif (X is not None) or (Y is not None):")
+                lines.extend(update(self.cutting))
+        elif self.cutting is not None:
+            lines.append("    if (Z is None) and ((X is not None) or (Y is not None)):")
+            lines.extend(update(self.cutting))
+        else:
+            return (), list()
+        return ("command", "X", "Y", "Z", "F"), lines
+
+    def applyBatch(self, table):
+        codes = table.codes[:len(table)]
+        cutting = np.isin(codes, [table.code(c) for c in ("G01", "G02", "G03")])
+        feed = table.column("F")
+        cutting &= ~np.isnan(feed)
+        drilling = ~np.isnan(table.column("Z"))
+        moving = ~np.isnan(table.column("X")) | ~np.isnan(table.column("Y"))
+        updated = feed.copy()
+        if self.drilling is not None:
+            updated[cutting & drilling] = self.drilling
+        if self.cutting is not None:
+            updated[cutting & ~drilling & moving] = self.cutting
+        if np.array_equal(updated, feed, equal_nan=True):
+            return table
+        result = table.copy()
+        result.column("F")[:] = updated
+        return result
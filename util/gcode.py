@@ -4,134 +4,226 @@
 #
 # Reworking the gcode loader and filter process.
 # ----------------------------------------------------------------------------
-import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from math import degrees, atan2, sqrt, sin, cos, pi
+from mmap import mmap, ACCESS_READ
+from os.path import getsize
+from types import MappingProxyType
 
+import numpy as np
 from PIL import Image, ImageDraw
 
-# Set up the regular expression for processing G-Code
-REGCODE = re.compile("(([A-Z])((-?[0-9]+)\.?([0-9]+)?))|(\(.*\))")
-
-# Supported parameter words
-PARAMS = ("X", "Y", "Z", "I", "J", "K", "R", "F", "P")
+from util.cache import readCache, writeCache
+from util.kernel import buildKernel
+from util.command import PARAMS, GCommand, parseFields
+from util.state import MOTION, MachineState
+from util.table import CommandTable
+from util.writer import PRECISION, writeCommands
 
 
 # ----------------------------------------------------------------------------
 # Public classes
 # ----------------------------------------------------------------------------
 
-class GCommand:
-    """ Represents a single command (or parameter)
+class Loader:
+    """ A loader is used to filter raw gcode while loading
     """
 
-    def __init__(self, line=""):
-        """ Construct from a line
-        """
-        line = line.strip()
-        # Extract any comments
-        self.comment = ""
-        i = line.find("(")
-        if i >= 0:
-            self.comment = line[i:]
-            line = line[:i - 1]
-        line = line.strip()
-        self.command = ""
-        for p in PARAMS:
-            setattr(self, p, None)
-        if len(line) > 0:
-            # Now we should just have command and arguments
-            #
-            # The regex will split it into parts like this ...
-            # (u'X10.768569', u'X', u'10.768569', u'10', u'768569', u'')
-            parts = list([list(cmd) for cmd in REGCODE.findall(line)])
-            if len(parts) > 0:
-                # Make sure the command looks like Gnn or Gnn.n
-                if float(parts[0][2]) == float(parts[0][3]):
-                    self.command = "%s%02d" % (parts[0][1], int(parts[0][3]))
-                else:
-                    self.command = "%s%02.1f" % (parts[0][1], float(parts[0][2]))
-                # Process the rest
-                for p in parts[1:]:
-                    if p[1] in PARAMS:
-                        setattr(self, str(p[1]), float(p[2]))
-
-    def clone(self):
-        """ Create a copy of this instance
-        """
-        result = GCommand()
-        result.command = self.command
-        result.comment = self.comment
-        for p in PARAMS:
-            setattr(result, p, getattr(self, p))
-        return result
+    def parse(self, line):
+        """ Parse the line and return a GCommand instance for it
 
-    def matches(self, other):
-        """ Determine if this command matches the other
+          This method can return None to indicate that the line should be ignored.
+        """
+        fields = parseFields(line)
+        if not self.accept(line, fields):
+            return None
+        return GCommand.fromFields(fields)
+
+    def accept(self, line, fields):
+        """ Determine if a line that has already been parsed should be kept
+
+          Loaders that only need to accept or reject lines should override this
+          rather than parse() so the line isn't parsed again.
         """
-        if self.command != other.command:
-            return False
-        for p in PARAMS:
-            if getattr(self, p) != getattr(other, p):
-                return False
         return True
 
-    def __str__(self):
-        """ Convert the command back into a string
+    def load(self, line, fields):
+        """ Return a GCommand instance for a line that has already been parsed
+
+          The fields are the (read only) result of parseFields() for the line
+          and are shared with any other loaders. This method can return None to
+          indicate that the line should be ignored. Loaders that override
+          parse() are given the raw line instead (see GCode.parse()).
         """
-        result = self.command
-        for param in PARAMS:
-            p = getattr(self, param)
-            if p is not None:
-                result = "%s %s%0.4f" % (result, param, p)
-        result = "%s %s" % (result, self.comment)
-        return result.strip()
+        if not self.accept(line, fields):
+            return None
+        return GCommand.fromFields(fields)
 
+    def select(self, table):
+        """ Select the rows of a CommandTable this loader would accept
 
-class Loader:
-    """ A loader is used to filter raw gcode while loading
-    """
+          Returns a boolean mask with an entry for each row, or None if the
+          loader can only process the source one line at a time.
+        """
+        return None
 
-    def parse(self, line):
-        """ Parse the line and return a GCommand instance for it
+    def signature(self):
+        """ Describe the configuration of this loader
 
-          This method can return None to indicate that the line should be ignored.
+          The description is used to make sure cached results were created
+          with the same loader settings. Return None (the default) if the
+          loader can't be described, the results will not be cached.
         """
-        return GCommand(line)
+        return None
 
 
 class Filter:
     """ A filter is used to make modifications to the gcode
     """
 
+    # Set this in filters that never modify the command passed to apply()
+    pure = False
+
     def apply(self, command):
         """ Called with a GCommand instance the filter can return None to remove
             the command, a replacement command or a list of replacements.
+
+          GCode.clone() passes in a copy of each command which the filter
+          may modify. Filters that set 'pure' are given the original command
+          instead and must not modify it, returning the same instance means
+          it is unchanged (and it is shared with the clone), use
+          command.clone() to create a replacement. Filters that generate a
+          lot of commands can return a generator, when used in a stream the
+          replacements are never held in memory together.
         """
         return command
 
+    def applyInPlace(self, command):
+        """ Like apply() but the command passed in may be modified
+
+          This saves creating a copy of every command that is changed but is
+          only safe if nothing else uses the command. The default simply
+          calls apply().
+        """
+        return self.apply(command)
+
+    def stream(self, commands, inplace=False):
+        """ Apply the filter to a sequence of commands
+
+          This is a generator, the results are produced as the commands are
+          consumed. If 'inplace' is set the commands are modified directly
+          (see applyInPlace()).
+        """
+        apply = self.apply
+        if inplace:
+            apply = self.applyInPlace
+        for command in commands:
+            result = apply(command)
+            if result is None:
+                continue
+            if isinstance(result, GCommand):
+                yield result
+            else:
+                yield from result
+
+    def applyBatch(self, table):
+        """ Apply the filter to every command in a CommandTable
+
+          Returns a table with the results, the same table (which must not be
+          modified) if nothing changed or None if the filter can only process
+          a command at a time (the default).
+        """
+        return None
+
+    def kernelSource(self, name):
+        """ Generate the source code for the filter (see FilterChain.compile())
+
+          Returns None (the default) if the filter can't be compiled, it will
+          be called as normal. Otherwise return a list of the fields used and
+          a list of lines of code that do the same as apply(). The code works
+          on local variables for each field ('code' for the command itself,
+          'X', 'Y' etc for the parameters), sets 'changed' if it modifies any
+          and can use 'name' to refer to the filter object. Parameters should
+          be included as constants.
+        """
+        return None
+
+    def compose(self, other):
+        """ Combine this filter with one that is applied after it
+
+          Returns a single filter that does the work of both, or None (the
+          default) if they can't be combined.
+        """
+        return None
+
 
 class FilterChain(Filter):
     """ A wrapper for a group of filters
+
+      Consecutive filters that can be combined (see Filter.compose()) are
+      replaced with a single filter. The chain is pure if all the filters
+      are.
     """
 
     def __init__(self, *filters):
         """ Store the filters
         """
-        self.filters = filters
+        combined = list()
+        for f in filters:
+            if len(combined) > 0:
+                fused = combined[-1].compose(f)
+                if fused is not None:
+                    combined[-1] = fused
+                    continue
+            combined.append(f)
+        self.filters = tuple(combined)
+        self.pure = all([f.pure for f in self.filters])
+        self._kernel = None
+
+    def compile(self):
+        """ Generate a single function to apply all of the filters
+
+          The work done by the filters is combined into specialised code for
+          this chain (see Filter.kernelSource()) which is then used by apply()
+          and stream(). The code is cached so chains with the same filters
+          and parameters are only compiled once. Returns the chain.
+        """
+        if self._kernel is None:
+            tails = [FilterChain(*self.filters[index + 1:]) for index in range(len(self.filters))]
+            self._kernel = buildKernel(self.filters, tails)
+        return self
 
     def apply(self, command):
         """ Called with a GCommand instance the filter can return None to remove
             the command, a replacement command or a list of replacements.
         """
+        if self._kernel is not None:
+            return self._kernel(command)
+        return self._process(command, False)
+
+    def applyInPlace(self, command):
+        """ Apply the filters allowing them to modify the command directly
+        """
+        if self._kernel is not None:
+            return self._kernel(command, True)
+        return self._process(command, True)
+
+    def _process(self, command, inplace):
+        """ Pass a command through each filter in turn
+        """
         for f in self.filters:
+            apply = f.apply
+            if inplace:
+                apply = f.applyInPlace
             if command is None:
                 return None
             if isinstance(command, GCommand):
-                command = f.apply(command)
+                command = apply(command)
             else:
                 results = list()
                 for cmd in command:
-                    response = f.apply(cmd)
+                    response = apply(cmd)
                     if response is not None:
                         if isinstance(response, GCommand):
                             results.append(response)
@@ -143,6 +235,38 @@ class FilterChain(Filter):
                     command = results
         return command
 
+    def applyBatch(self, table):
+        """ Apply the filters to every command in a CommandTable
+
+          Returns None unless every filter in the chain supports it.
+        """
+        for f in self.filters:
+            if type(f).applyBatch is Filter.applyBatch:
+                return None
+        for f in self.filters:
+            table = f.applyBatch(table)
+            if table is None:
+                return None
+        return table
+
+    def stream(self, commands, inplace=False):
+        """ Apply the filters to a sequence of commands
+
+          Each filter is a generator stage pulling commands from the one
+          before it so no intermediate lists are built, even when a filter
+          replaces one command with many. The results are produced as the
+          commands are consumed so it can be used with iterGCode() and
+          saveGCode() to process files of any size. If 'inplace' is set the
+          commands are modified directly (see Filter.applyInPlace()).
+
+          A compiled chain processes each command with a single function.
+        """
+        if self._kernel is not None:
+            return Filter.stream(self, commands, inplace)
+        for f in self.filters:
+            commands = f.stream(commands, inplace)
+        return iter(commands)
+
 
 class GCode(Loader):
     """ Represents a gcode file
@@ -152,13 +276,22 @@ class GCode(Loader):
     INCH = "G20"
     MM = "G21"
 
-    def __init__(self, loader=None):
+    def __init__(self, loader=None, columnar=False):
+        """ Create an empty program
+
+          If 'columnar' is set the commands are held in a CommandTable rather
+          than a list of GCommand instances. This uses far less memory for
+          large programs and the 'lines' still behave like GCommand objects.
+        """
         self.loader = loader
         self.units = None
-        self.lines = list()
-        self.minx, self.maxx = None, None
-        self.miny, self.maxy = None, None
-        self.minz, self.maxz = None, None
+        if columnar:
+            self.lines = CommandTable()
+        else:
+            self.lines = list()
+        # Bounds and state are calculated when first needed
+        self._bounds = None
+        self._state = None
 
     def _minVal(self, a, b):
         """ Get the minimum of two values allowing for None
@@ -182,6 +315,76 @@ class GCode(Loader):
             return a
         return max(a, b)
 
+    @property
+    def columnar(self):
+        """ Determine if this program uses columnar storage
+        """
+        return isinstance(self.lines, CommandTable)
+
+    def _calculateBounds(self):
+        """ Calculate the bounds of all the commands in the program
+        """
+        if self.columnar:
+            columns = [self.lines.column(p) for p in ("X", "Y", "Z")]
+        else:
+            values = np.array([(c.X, c.Y, c.Z) for c in self.lines], dtype=float).reshape(-1, 3)
+            columns = values.T
+        bounds = list()
+        for column in columns:
+            column = column[~np.isnan(column)]
+            if len(column) == 0:
+                bounds.extend((None, None))
+            else:
+                bounds.extend((float(column.min()), float(column.max())))
+        return tuple(bounds)
+
+    def _mergeBounds(self, a, b):
+        """ Combine two sets of bounds (as returned by bounds())
+        """
+        merged = list()
+        for index in range(0, 6, 2):
+            merged.append(self._minVal(a[index], b[index]))
+            merged.append(self._maxVal(a[index + 1], b[index + 1]))
+        return tuple(merged)
+
+    def _appended(self, cmd):
+        """ Called when a single command has been added to the program
+        """
+        self._bounds = None
+
+    def _previous(self):
+        """ Get the X and Y values of the last command added
+        """
+        return self.lines[-1].X, self.lines[-1].Y
+
+    def bounds(self):
+        """ Get the bounds of the program
+
+          Returns a tuple of (minx, maxx, miny, maxy, minz, maxz), any of the
+          values may be None if there are no commands for that axis. The
+          result is cached until the program is changed.
+        """
+        if self._bounds is None:
+            self._bounds = self._calculateBounds()
+        return self._bounds
+
+    def state(self):
+        """ Get the modal state of the machine for each command
+
+          Returns a MachineState instance, this is cached until the program
+          is changed.
+        """
+        if self._state is None:
+            self._state = MachineState(self.lines)
+        return self._state
+
+    minx = property(lambda self: self.bounds()[0], doc="Minimum X value")
+    maxx = property(lambda self: self.bounds()[1], doc="Maximum X value")
+    miny = property(lambda self: self.bounds()[2], doc="Minimum Y value")
+    maxy = property(lambda self: self.bounds()[3], doc="Maximum Y value")
+    minz = property(lambda self: self.bounds()[4], doc="Minimum Z value")
+    maxz = property(lambda self: self.bounds()[5], doc="Maximum Z value")
+
     def append(self, cmd):
         """ Append a command the file
 
@@ -190,9 +393,25 @@ class GCode(Loader):
         """
         if cmd is None:
             return
+        self._state = None
         if isinstance(cmd, GCode):
-            for c in cmd.lines:
-                self.append(c)
+            before = self._bounds
+            if self.columnar and cmd.columnar:
+                # Copy the columns directly and fix up any missing axis values
+                start = len(self.lines)
+                self.lines.extend(cmd.lines)
+                self.lines.fillAxes(start)
+            elif cmd.columnar:
+                # Don't keep views into the other program
+                for c in cmd.lines:
+                    self.append(c.clone())
+            else:
+                for c in cmd.lines:
+                    self.append(c)
+            # Missing axis values are only ever filled in from our own commands
+            # so the combined bounds are the union of both.
+            if before is not None:
+                self._bounds = self._mergeBounds(before, cmd.bounds())
         else:
             if not isinstance(cmd, GCommand):
                 cmd = GCommand(str(cmd))
@@ -202,31 +421,33 @@ class GCode(Loader):
             # TODO This assumes the previous command itself has axis data - this may not always be the case
             #   Also will break if the first move command only specifies a single axis
             if (cmd.X is not None) and (cmd.Y is None):
-                cmd.Y = self.lines[-1].Y
+                cmd.Y = self._previous()[1]
             if (cmd.X is None) and (cmd.Y is not None):
-                cmd.X = self.lines[-1].X
+                cmd.X = self._previous()[0]
 
             self.lines.append(cmd)
-            # Update bounds
-            self.minx = self._minVal(self.minx, cmd.X)
-            self.maxx = self._maxVal(self.maxx, cmd.X)
-            self.miny = self._minVal(self.miny, cmd.Y)
-            self.maxy = self._maxVal(self.maxy, cmd.Y)
-            self.minz = self._minVal(self.minz, cmd.Z)
-            self.maxz = self._maxVal(self.maxz, cmd.Z)
+            self._appended(cmd)
 
-    def parse(self, line):
+    def parse(self, line, fields=None):
         """ Parse the line and return a GCommand instance for it
 
-          This method can return None to indicate that the line should be ignored.
+          If the line has already been parsed the result of parseFields() can
+          be passed in as well. This method can return None to indicate that
+          the line should be ignored.
         """
-        # We always parse ourselves, we want to check for units
-        cmd = GCommand(line)
-        if cmd.command in (GCode.INCH, GCode.MM):
-            self.units = cmd.command
-        # If we have a different loader parse it again with that
-        if self.loader is not None:
+        if fields is None:
+            fields = parseFields(line)
+        # We always check for units
+        if fields["command"] in (GCode.INCH, GCode.MM):
+            self.units = fields["command"]
+        # Let the loader decide what to keep
+        if self.loader is None:
+            cmd = GCommand.fromFields(fields)
+        elif type(self.loader).parse is not Loader.parse:
+            # The loader does its own parsing
             cmd = self.loader.parse(line)
+        else:
+            cmd = self.loader.load(line, fields)
         if cmd is not None:
             # Convert to MM
             if self.units == GCode.INCH:
@@ -240,27 +461,134 @@ class GCode(Loader):
             self.append(cmd)
         return cmd
 
-    def clone(self, *filters):
+    def read(self, filename):
+        """ Parse a gcode file generating each command as it is accepted
+
+          The commands are appended to this object as they are generated.
+        """
+        with open(filename, "r") as source:
+            for line in source:
+                cmd = self.parse(line)
+                if cmd is not None:
+                    yield cmd
+
+    def tee(self, commands):
+        """ Append each command in a sequence while passing it on
+        """
+        for cmd in commands:
+            self.append(cmd)
+            yield cmd
+
+    def clone(self, *filters, workers=None):
         """ Make a copy of this gcode object with optional filtering
 
-          If filters are provided they are executed in order.
+          If filters are provided they are executed in order. Each command is
+          copied before the filters see it unless they are all pure (see
+          Filter.apply()), commands pure filters don't change are shared with
+          the copy (a columnar copy always has its own table). Without any
+          filters every command is copied.
+
+          If 'workers' is greater than one (and the filters can't process a
+          whole table at once) the program is split into chunks which are
+          filtered in that many processes. The only state a filter may keep
+          between commands is the current position (as the filters in this
+          package do) and the filters passed in are not updated.
+
+          Otherwise the filters are compiled (see FilterChain.compile()) and
+          run over the commands one at a time.
         """
         chain = FilterChain(*filters)
-        result = GCode()
+        result = GCode(columnar=self.columnar)
         result.units = self.units
+        if len(filters) == 0:
+            # A straight copy of the commands
+            if self.columnar:
+                result.lines = self.lines.copy()
+            else:
+                result.lines = [c.clone() for c in self.lines]
+            result._bounds = self._bounds
+            result._state = self._state
+            return result
+        if self.columnar:
+            # Process the whole table at once if the filters allow it
+            lines = chain.applyBatch(self.lines)
+            if lines is self.lines:
+                result.lines = self.lines.copy()
+                result._bounds = self._bounds
+                return result
+            if lines is not None:
+                lines.fillAxes()
+                result.lines = lines
+                return result
+        if (workers is not None) and (workers > 1) and (len(self.lines) > 0):
+            for cmd in _cloneParallel(self.lines, filters, workers):
+                result.append(cmd)
+            return result
+        chain.compile()
+        unchanged = chain.pure
         for cmd in self.lines:
-            cmd = cmd.clone()
+            if not chain.pure:
+                cmd = cmd.clone()
             # Apply filters
-            cmd = chain.apply(cmd)
-            if cmd is not None:
-                if isinstance(cmd, GCommand):
-                    result.append(cmd)
-                else:
-                    for c in cmd:
-                        result.append(c)
+            response = chain.apply(cmd)
+            if response is cmd:
+                result.append(cmd)
+            elif response is None:
+                unchanged = False
+            elif isinstance(response, GCommand):
+                unchanged = False
+                result.append(response)
+            else:
+                unchanged = False
+                for c in response:
+                    result.append(c)
+        if unchanged:
+            # Same commands so the same bounds
+            result._bounds = self._bounds
         # All done
         return result
 
+    def apply(self, *filters):
+        """ Apply filters to this program, modifying it in place
+
+          This is the same as replacing the program with clone(*filters) but
+          the commands are modified directly rather than copied. Only use it
+          when nothing else shares the commands (a clone made with pure filters
+          shares the commands they didn't change with this program).
+        """
+        chain = FilterChain(*filters)
+        self._bounds = None
+        self._state = None
+        if self.columnar:
+            # Process the whole table at once if the filters allow it
+            lines = chain.applyBatch(self.lines)
+            if lines is not None:
+                if lines is not self.lines:
+                    lines.fillAxes()
+                    self.lines = lines
+                return
+        chain.compile()
+        commands = self.lines
+        results = list()
+        unchanged = True
+        for cmd in commands:
+            response = chain.applyInPlace(cmd)
+            if response is None:
+                unchanged = False
+            elif isinstance(response, GCommand):
+                unchanged = unchanged and (response is cmd)
+                results.append(response)
+            else:
+                unchanged = False
+                results.extend(response)
+        if self.columnar and unchanged:
+            # The rows were updated in the table itself
+            commands.fillAxes()
+            return
+        self.lines = type(commands)()
+        for cmd in results:
+            self.append(cmd)
+
     def render(self, filename, cutdepth=0.0, showall=False):
         """ Render the gcode to an image file for visualisation
         """
@@ -278,12 +606,12 @@ class GCode(Loader):
         drw.line((0, dy, width, dy), fill="black", width=1)
         drw.line((dx, 0, dx, height), fill="black", width=1)
         # Draw the actual image
-        x, y, z = 0.0, 0.0, 0.0
-        for cmd in self.lines:
-            if cmd.command in ("G00", "G01", "G02", "G03"):
+        state = self.state()
+        positions = zip(state.x0.tolist(), state.y0.tolist(), state.z0.tolist(),
+                        state.x.tolist(), state.y.tolist(), state.z.tolist())
+        for cmd, (x, y, z, nx, ny, nz) in zip(self.lines, positions):
+            if cmd.command in MOTION:
                 # Check for X/Y movement
-                nx = cmd.X or x
-                ny = cmd.Y or y
                 if (x != nx) or (y != ny):
                     path = (
                         dx + (pixelsPerMM * x),
@@ -317,7 +645,6 @@ class GCode(Loader):
                             # Anticlockwise
                             drw.arc(bbox, a1, a2, fill="blue")
                 # Check for touchdowns (or drill commands)
-                nz = cmd.Z or z
                 if (nz < 0.0) and (z > 0):
                     points = (
                         dx + (pixelsPerMM * nx) - 1,
@@ -326,8 +653,6 @@ class GCode(Loader):
                         dy + (pixelsPerMM * ny) + 1
                     )
                     drw.ellipse(points, fill="blue")
-                # Save new position
-                x, y, z = nx, ny, nz
         # Save the image
         img = img.transpose(Image.FLIP_TOP_BOTTOM)
         img.save(filename)
@@ -367,49 +692,280 @@ class GCode(Loader):
             return "?"
 
         # Represent as a string
-        bounds = (self.minx, self.maxx, self.miny, self.maxy, self.minz, self.maxz)
-        bounds = tuple([floatStr(x) for x in bounds])
+        bounds = tuple([floatStr(x) for x in self.bounds()])
         return "X: %s, %s Y: %s, %s Z: %s, %s" % bounds
 
 
+class GCodeStream(GCode):
+    """ A gcode program that only keeps the most recent command
+
+      This still tracks the units and bounds of everything that passes
+      through it, so it can be used with read() and tee() to process large
+      files in constant memory.
+    """
+
+    def __init__(self, loader=None):
+        GCode.__init__(self, loader)
+        self.lines = deque(maxlen=1)
+        self._bounds = (None, None, None, None, None, None)
+        self._last = (None, None)
+
+    def _appended(self, cmd):
+        """ The commands aren't kept so the bounds are updated as they arrive
+        """
+        self._bounds = self._mergeBounds(self._bounds, (cmd.X, cmd.X, cmd.Y, cmd.Y, cmd.Z, cmd.Z))
+        # Keep the values as they were added, the command may be filtered in
+        # place after this (see Filter.applyInPlace())
+        self._last = (cmd.X, cmd.Y)
+
+    def _previous(self):
+        """ Get the X and Y values of the last command added
+        """
+        return self._last
+
+
 # ----------------------------------------------------------------------------
 # File operations
 # ----------------------------------------------------------------------------
 
-def loadGCode(filename, *loaders):
-    """ Load a gcode file (with optional filters)
+def _splitFile(filename, count):
+    """ Split a file into (start, end) offsets for 'count' chunks
+
+      The chunks always break just after a newline.
+    """
+    size = getsize(filename)
+    offsets = [0]
+    with open(filename, "rb") as source:
+        with mmap(source.fileno(), 0, access=ACCESS_READ) as data:
+            for index in range(1, count):
+                offset = data.find(b"\n", max(offsets[-1], (index * size) // count))
+                if offset < 0:
+                    break
+                offsets.append(offset + 1)
+    offsets.append(size)
+    return [(a, b) for a, b in zip(offsets[:-1], offsets[1:]) if b > a]
+
+
+def _parseChunk(filename, start, end):
+    """ Parse part of a file into a CommandTable
+
+      This is run in a worker process by _loadParallel()
+    """
+    with open(filename, "rb") as source:
+        with mmap(source.fileno(), 0, access=ACCESS_READ) as data:
+            text = data[start:end].decode()
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    if lines[-1] == "":
+        del lines[-1]
+    return CommandTable.fromLines(lines)
+
+
+def _loadParallel(filename, loaders, workers):
+    """ Load a gcode file by parsing chunks of it in parallel
+
+      The chunks are parsed without any knowledge of the commands before them
+      so the units and missing axis values are fixed up once they have been
+      joined together. Loaders that can't select rows from a table are
+      handled with a separate sequential pass.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [pool.submit(_parseChunk, filename, start, end) for start, end in _splitFile(filename, workers)]
+        table = CommandTable.concatenate([job.result() for job in jobs])
+    # Figure out which rows are in inches
+    codes = table.codes[:len(table)]
+    units = np.zeros(len(table), dtype=np.int8)
+    units[codes == table.code(GCode.INCH)] = 1
+    units[codes == table.code(GCode.MM)] = 2
+    latest = np.maximum.accumulate(np.where(units > 0, np.arange(len(table)), 0))
+    inches = units[latest] == 1
+    # Now build the results for each loader
+    results = list()
+    for loader in (loaders or (None,)):
+        gcode = GCode(loader, columnar=True)
+        if loader is None:
+            mask = np.ones(len(table), dtype=bool)
+        else:
+            mask = loader.select(table)
+            if mask is None:
+                for cmd in gcode.read(filename):
+                    pass
+                results.append(gcode)
+                continue
+        if mask.all() and (len(loaders) <= 1):
+            lines = table
+        else:
+            lines = table.take(mask)
+        # Convert to MM
+        scale = inches[mask]
+        for param in PARAMS:
+            lines.column(param)[scale] *= 25.4
+        converted = np.flatnonzero(lines.codes[:len(lines)] == lines.code(GCode.INCH))
+        lines.codes[converted] = lines.intern(GCode.MM)
+        for row in converted.tolist():
+            lines.comments[row] = "(use mm)"
+        # Fill in missing axis values and update the bounds
+        lines.fillAxes()
+        gcode.lines = lines
+        results.append(gcode)
+    return results
+
+
+def _filterChunk(lines, filters, skip):
+    """ Filter part of a program, discarding the results for the first 'skip'
+        commands (they are only there to set up the state of the filters).
+
+      This is run in a worker process by _cloneParallel()
     """
+    chain = FilterChain(*filters).compile()
     results = list()
+    for index, cmd in enumerate(lines):
+        response = chain.apply(cmd)
+        if (index < skip) or (response is None):
+            continue
+        if isinstance(response, GCommand):
+            results.append(response)
+        else:
+            results.extend(response)
+    if isinstance(lines, CommandTable):
+        # Rows may still refer to the source table, send back a new one
+        return CommandTable.fromCommands(results)
+    return results
+
+
+def _cloneParallel(lines, filters, workers):
+    """ Filter a program by splitting it into chunks processed in parallel
+
+      Filters only track the current position so a worker can get into the
+      same state as the serial version by replaying the commands from the
+      last one (before its chunk) that sets both X and Y. A quick pre-scan
+      finds those commands, the replayed results are thrown away. Returns
+      the filtered commands in order.
+    """
+    if isinstance(lines, CommandTable):
+        both = ~np.isnan(lines.column("X")) & ~np.isnan(lines.column("Y"))
+    else:
+        both = np.array([(c.X is not None) and (c.Y is not None) for c in lines], dtype=bool)
+    # The last row at or before each one with both co-ordinates (or 0)
+    anchor = np.maximum.accumulate(np.where(both, np.arange(len(lines)), 0))
+    size = (len(lines) + workers - 1) // workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = list()
+        for start in range(0, len(lines), size):
+            first = 0
+            if start > 0:
+                first = int(anchor[start - 1])
+            jobs.append(pool.submit(_filterChunk, lines[first:start + size], filters, start - first))
+        for job in jobs:
+            for cmd in job.result():
+                yield cmd
+
+
+def _loaderSignature(loaders):
+    """ Describe the configuration of a set of loaders for the cache
+
+      Returns None if any of the loaders can't be described.
+    """
+    signature = list()
     for loader in loaders:
-        results.append(GCode(loader))
-    if len(results) == 0:
-        results.append(GCode())
-    # Now read the file
-    with open(filename, "r") as source:
-        for line in source.readlines():
-            for loader in results:
-                loader.parse(str(line))
+        description = loader.signature()
+        if description is None:
+            return None
+        signature.append(description)
+    return signature
+
+
+def loadGCode(filename, *loaders, columnar=False, workers=None, cache=False):
+    """ Load a gcode file (with optional filters)
+
+      Set 'columnar' to store the commands in a CommandTable, this is
+      recommended for very large files. If 'workers' is greater than one the
+      file is split into chunks which are parsed in that many processes, the
+      results always use columnar storage in this case.
+
+      If 'cache' is set the parsed results are saved to (and loaded from) a
+      binary file alongside the source, see util.cache. Cached results also
+      use columnar storage.
+    """
+    signature = None
+    if cache:
+        signature = _loaderSignature(loaders)
+    if signature is not None:
+        columnar = True
+        cached = readCache(filename, signature)
+        if cached is not None:
+            results = list()
+            for loader, (lines, units, bounds) in zip(loaders or (None,), cached):
+                gcode = GCode(loader, columnar=True)
+                gcode.lines = lines
+                gcode.units = units
+                gcode._bounds = bounds
+                results.append(gcode)
+            if len(results) == 1:
+                return results[0]
+            return results
+    if (workers is not None) and (workers > 1) and (getsize(filename) > 0):
+        results = _loadParallel(filename, loaders, workers)
+    else:
+        results = list()
+        for loader in loaders:
+            results.append(GCode(loader, columnar=columnar))
+        if len(results) == 0:
+            results.append(GCode(columnar=columnar))
+        # Now read the file, each line is only parsed once
+        with open(filename, "r") as source:
+            for line in source:
+                fields = MappingProxyType(parseFields(line))
+                for r in results:
+                    r.parse(line, fields)
     # Set all units to MM for each object
     for r in results:
         r.units = GCode.MM
+    if signature is not None:
+        writeCache(filename, signature, [
+            (r.lines, r.units, r.bounds()) for r in results])
     # Return the results
     if len(results) == 1:
         return results[0]
     return results
 
 
-def saveGCode(filename, gcode, prefix=None, suffix=None):
+def iterGCode(filename, *loaders):
+    """ Iterate over the commands in a gcode file (with optional filters)
+
+      Unlike loadGCode() the file is processed a line at a time. With a single
+      loader (or none) each accepted command is generated, with multiple
+      loaders a tuple holding the result from each loader (or None) is
+      generated for every line.
+    """
+    streams = list()
+    for loader in loaders:
+        streams.append(GCodeStream(loader))
+    if len(streams) == 0:
+        streams.append(GCodeStream())
+    with open(filename, "r") as source:
+        for line in source:
+            fields = MappingProxyType(parseFields(line))
+            results = tuple([stream.parse(line, fields) for stream in streams])
+            if len(results) > 1:
+                yield results
+            elif results[0] is not None:
+                yield results[0]
+
+
+def saveGCode(filename, gcode, prefix=None, suffix=None, precision=PRECISION, newline=None):
     """ Save a gcode file
+
+      The gcode may be a GCode instance or any sequence of commands, including
+      generators such as those returned by iterGCode() or FilterChain.stream().
+      Values are written with 'precision' decimal places and lines end with
+      'newline' (the platform default if None).
     """
-    with open(filename, "w") as target:
+    with open(filename, "w", newline=newline) as target:
         if prefix is not None:
             target.write(str(prefix).strip() + "\n")
         if isinstance(gcode, GCode):
-            for line in gcode.lines:
-                target.write(str(line) + "\n")
-        else:
-            for line in gcode:
-                target.write(str(line) + "\n")
+            gcode = gcode.lines
+        writeCommands(target, gcode, precision)
         if suffix is not None:
             target.write(str(suffix).strip() + "\n")
 
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Generate a single specialised function for a chain of filters. Filters
+# that support it (see Filter.kernelSource()) provide the source for their
+# work with their parameters as constants, the rest are called as normal.
+# The generated code is cached so the same chain is only compiled once,
+# only the most recently used kernels are kept.
+# ----------------------------------------------------------------------------
+from math import isfinite
+
+import numpy as np
+
+from util.command import PARAMS, GCommand
+
+# The local variable used for each field of the command
+FIELDS = ("command",) + PARAMS
+LOCALS = dict([(f, f) for f in PARAMS] + [("command", "code")])
+
+# Compiled kernels keyed by their source (most recently used last)
+KERNELS = dict()
+
+# Number of compiled kernels to keep
+KERNEL_CACHE = 64
+
+
+def literal(value):
+    """ Get the source for a constant value
+
+      NumPy scalars are converted to the matching Python value first.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not isfinite(value):
+        return "float(%r)" % repr(value)
+    return repr(value)
+
+
+def _inlined(f, name):
+    """ Get the source for a filter (or None if it has to be called)
+
+      Subclasses that change how the filter works are always called.
+    """
+    for cls in type(f).__mro__:
+        if "kernelSource" in cls.__dict__:
+            if (type(f).apply is not cls.apply) or (type(f).applyInPlace is not cls.applyInPlace):
+                return None
+            break
+    return f.kernelSource(name)
+
+
+def kernelSource(filters):
+    """ Generate the source for a chain of filters
+
+      The source defines build(filters, tails) which returns the function,
+      filters[n] is available as 'fn' to the generated code.
+    """
+    names = ["f%d" % index for index in range(len(filters))]
+    inlined = [_inlined(f, name) for f, name in zip(filters, names)]
+    fields = set()
+    for snippet in inlined:
+        if snippet is not None:
+            fields.update(snippet[0])
+    fields = [f for f in FIELDS if f in fields]
+    load = ["    %s = command.%s" % (LOCALS[f], f) for f in fields]
+    store = ["        command.%s = %s" % (f, LOCALS[f]) for f in fields]
+    body = list()
+    body.extend(load)
+    body.append("    changed = False")
+    for index, snippet in enumerate(inlined):
+        if snippet is not None:
+            body.append("    # %s" % type(filters[index]).__name__)
+            body.extend(["    " + line for line in snippet[1]])
+            continue
+        # Call the filter with any changes made so far
+        body.append("    # %s (called)" % type(filters[index]).__name__)
+        body.append("    if changed:")
+        body.append("        if not inplace:")
+        body.append("            command = command.clone()")
+        body.extend(store)
+        body.append("    if inplace:")
+        body.append("        command = %s.applyInPlace(command)" % names[index])
+        body.append("    else:")
+        body.append("        command = %s.apply(command)" % names[index])
+        body.append("    if command is None:")
+        body.append("        return None")
+        body.append("    if not isinstance(command, GCommand):")
+        body.append("        return tails[%d]._process(command, inplace)" % index)
+        body.extend(load)
+        body.append("    changed = False")
+    body.append("    if changed:")
+    body.append("        if not inplace:")
+    body.append("            command = command.clone()")
+    body.extend(store)
+    body.append("    return command")
+    lines = ["def build(filters, tails):"]
+    lines.extend(["    %s = filters[%d]" % (name, index) for index, name in enumerate(names)])
+    lines.append("")
+    lines.append("    def kernel(command, inplace=False):")
+    lines.extend(["    " + line for line in body])
+    lines.append("")
+    lines.append("    return kernel")
+    return "\n".join(lines) + "\n"
+
+
+def buildKernel(filters, tails):
+    """ Create the function for a chain of filters
+
+      The function takes a command (and an 'inplace' flag) and returns the
+      same results as FilterChain.apply() (or applyInPlace()) would. 'tails'
+      has a FilterChain with the filters after each one, these process any
+      lists of commands generated. The compiled code is cached (up to
+      KERNEL_CACHE different chains).
+    """
+    source = kernelSource(filters)
+    build = KERNELS.pop(source, None)
+    if build is None:
+        namespace = {"GCommand": GCommand}
+        exec(compile(source, "<kernel>", "exec"), namespace)
+        build = namespace["build"]
+        while len(KERNELS) >= KERNEL_CACHE:
+            # Drop the least recently used
+            del KERNELS[next(iter(KERNELS))]
+    KERNELS[source] = build
+    return build(filters, tails)
@@ -4,7 +4,9 @@
 #
 # A simple set of loaders.
 # ----------------------------------------------------------------------------
-from util.gcode import Loader, GCommand
+import numpy as np
+
+from util.gcode import PARAMS, Loader, GCommand
 
 
 class BoxedLoader(Loader):
@@ -17,31 +19,74 @@ class BoxedLoader(Loader):
         self.inclusive = inclusive
         self.accepting = start is None
 
-    def _compareLine(self, line, command, match):
+    def _compareLine(self, line, fields, match):
         """ Compare the given line with the requested match
         """
         if isinstance(match, GCommand):
-            return match.matches(command)
+            if match.command != fields["command"]:
+                return False
+            for p in PARAMS:
+                if getattr(match, p) != fields.get(p, None):
+                    return False
+            return True
         return str(line) == str(match)
 
-    def parse(self, line):
-        """ Parse the line and return a GCommand instance for it
+    def _describe(self, match):
+        """ Describe a match for the loader signature
+        """
+        if isinstance(match, GCommand):
+            return [match.command] + [getattr(match, p) for p in PARAMS]
+        return match
+
+    def signature(self):
+        """ Describe the configuration of this loader
+        """
+        return ["BoxedLoader", self._describe(self.start), self._describe(self.end), self.inclusive, self.accepting]
 
-          This method can return None to indicate that the line should be ignored.
+    def select(self, table):
+        """ Select the rows of a CommandTable this loader would accept
+        """
+        for match in (self.start, self.end):
+            if (match is not None) and not isinstance(match, GCommand):
+                # Raw line comparisons need the original text
+                return None
+        starts = np.zeros(len(table), dtype=bool)
+        if self.start is not None:
+            starts = table.matches(self.start)
+        ends = np.zeros(len(table), dtype=bool)
+        if self.end is not None:
+            ends = table.matches(self.end)
+        # Walk through the rows where the state may change
+        mask = np.zeros(len(table), dtype=bool)
+        begin = 0
+        for row in np.flatnonzero(starts | ends).tolist():
+            if self.accepting and ends[row]:
+                self.accepting = False
+                if self.inclusive:
+                    mask[begin:row + 1] = True
+                else:
+                    mask[begin:row] = True
+            elif (not self.accepting) and starts[row]:
+                self.accepting = True
+                if self.inclusive:
+                    begin = row
+                else:
+                    begin = row + 1
+        if self.accepting:
+            mask[begin:] = True
+        return mask
+
+    def accept(self, line, fields):
+        """ Determine if a line that has already been parsed should be kept
         """
-        command = GCommand(line)
         if self.accepting:
             # Should we stop accepting ?
-            if (self.end is not None) and (self._compareLine(line, command, self.end)):
+            if (self.end is not None) and (self._compareLine(line, fields, self.end)):
                 self.accepting = False
-                if not self.inclusive:
-                    command = None
-        else:
-            # Should we start accepting ?
-            if (self.start is not None) and (self._compareLine(line, command, self.start)):
-                self.accepting = True
-                if not self.inclusive:
-                    command = None
-            else:
-                command = None
-        return command
+                return self.inclusive
+            return True
+        # Should we start accepting ?
+        if (self.start is not None) and (self._compareLine(line, fields, self.start)):
+            self.accepting = True
+            return self.inclusive
+        return False
@@ -1,10 +1,36 @@
 #!/usr/bin/env python
 # ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Messages can be given arguments which are only formatted if the message
+# will be written, use isEnabled() to skip building them altogether. Output
+# can be buffered and written as one JSON object per line with timings.
+# Buffered messages are written when the logger is released or at exit.
+#
 # 21-Jul-2015 ShaneG
 #
 # Very simple logging - adapted from Sensaura.
 # ----------------------------------------------------------------------------
+import atexit
+import sys
 from datetime import datetime
+from time import perf_counter
+from weakref import WeakSet
+
+from util.jsonhelp import toJSON
+
+# Loggers holding buffered messages (they are not kept alive by this)
+_PENDING = WeakSet()
+
+
+def _flushAll():
+    """ Write the buffered messages from every logger
+    """
+    for logger in list(_PENDING):
+        logger.flush()
+
+
+atexit.register(_flushAll)
 
 
 class Logger:
@@ -23,6 +49,9 @@ class Logger:
 
     _SEVERITY = ("DEBUG", "INFO", "WARN", "ERROR", "FATAL")
 
+    # Number of messages held before a buffered logger writes them
+    BUFFER = 1024
+
     # --------------------------------------------------------------------------
     # Properties
     # --------------------------------------------------------------------------
@@ -35,43 +64,101 @@ class Logger:
     def severity(self, value):
         self._severity = min(Logger.MSG_FATAL, max(Logger.MSG_DEBUG, value))
 
-    def __init__(self, severity=0):
+    def __init__(self, severity=0, output=None, buffered=False, structured=False):
+        """ Set up the logger
+
+          Messages are written to 'output' (standard output by default). If
+          'buffered' is set they are held and written in blocks (see flush()),
+          if 'structured' is set each message is written as a JSON object with
+          the time and the number of seconds since the logger was created.
+        """
         self.severity = severity
+        self.output = output
+        self.buffered = buffered
+        self.structured = structured
+        self._started = perf_counter()
+        self._pending = list()
+
+    def __del__(self):
+        """ Write anything still buffered when the logger is released
+        """
+        if len(getattr(self, "_pending", ())) > 0:
+            self.flush()
+
+    def isEnabled(self, severity):
+        """ Determine if messages of the given severity will be written
+        """
+        return severity >= self._severity
+
+    def flush(self):
+        """ Write any buffered messages
+        """
+        if len(self._pending) == 0:
+            return
+        output = self.output or sys.stdout
+        output.write("\n".join(self._pending) + "\n")
+        output.flush()
+        self._pending = list()
+        _PENDING.discard(self)
 
     def write(self, timestamp, severity, message):
         """ Actually write the message
         """
         severity = min(Logger.MSG_FATAL, max(Logger.MSG_DEBUG, severity))
-        print("%s: %s" % (Logger._SEVERITY[severity], message))
+        if self.structured:
+            line = toJSON({
+                "time": timestamp.isoformat(),
+                "elapsed": round(perf_counter() - self._started, 6),
+                "severity": Logger._SEVERITY[severity],
+                "message": message,
+            })
+        else:
+            line = "%s: %s" % (Logger._SEVERITY[severity], message)
+        if self.buffered:
+            if len(self._pending) == 0:
+                _PENDING.add(self)
+            self._pending.append(line)
+            if len(self._pending) >= Logger.BUFFER:
+                self.flush()
+        else:
+            (self.output or sys.stdout).write(line + "\n")
+
+    def _log(self, severity, message, args):
+        """ Format the message with its arguments (if any) and write it
+        """
+        if len(args) > 0:
+            message = message % args
+        self.write(datetime.now(), severity, message)
 
-    def DEBUG(self, message):
+    def DEBUG(self, message, *args):
         """ Write a DEBUG message
         """
-        if Logger.MSG_DEBUG >= self.severity:
-            self.write(datetime.now(), Logger.MSG_DEBUG, message)
+        if Logger.MSG_DEBUG >= self._severity:
+            self._log(Logger.MSG_DEBUG, message, args)
 
-    def INFO(self, message):
+    def INFO(self, message, *args):
         """ Write an INFO message
         """
-        if Logger.MSG_INFO >= self.severity:
-            self.write(datetime.now(), Logger.MSG_INFO, message)
+        if Logger.MSG_INFO >= self._severity:
+            self._log(Logger.MSG_INFO, message, args)
 
-    def WARN(self, message):
+    def WARN(self, message, *args):
         """ Write a WARNING message
         """
-        if Logger.MSG_WARN >= self.severity:
-            self.write(datetime.now(), Logger.MSG_WARN, message)
+        if Logger.MSG_WARN >= self._severity:
+            self._log(Logger.MSG_WARN, message, args)
 
-    def ERROR(self, message):
+    def ERROR(self, message, *args):
         """ Write a error message
         """
-        if Logger.MSG_ERROR >= self.severity:
-            self.write(datetime.now(), Logger.MSG_ERROR, message)
+        if Logger.MSG_ERROR >= self._severity:
+            self._log(Logger.MSG_ERROR, message, args)
 
-    def FATAL(self, message):
+    def FATAL(self, message, *args):
         """ Write a FATAL message and exit
         """
-        self.write(datetime.now(), Logger.MSG_FATAL, message)
+        self._log(Logger.MSG_FATAL, message, args)
+        self.flush()
         exit(1)
 
 
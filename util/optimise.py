@@ -1,18 +1,70 @@
 #!/usr/bin/env python
 # ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Very large programs are split into clusters which are ordered first and
+# then each one is ordered on its own (in parallel), see clusterOrder().
+#
+# Short moves between movements can retract to a lower 'hop' height (or
+# not retract at all for tiny gaps in the same region), see planTravel().
+#
+# Programs that only drill holes are ordered along a Hilbert curve (see
+# hilbertOrder()) rather than searching for the closest hole each time.
+#
+# Added multiStartOrder() to try ordering from several start points (in
+# parallel) and keep the best.
+#
+# Lines and arcs that join up are chained together and ordered as a single
+# movement, closed loops can be entered at any point.
+#
+# Added improveOrder() to reduce the air travel further with 2-opt and
+# Or-opt moves for a limited time.
+#
+# The closest movement is found with a spatial index rather than a linear
+# search of every remaining one. Finding the distance to a movement no
+# longer changes its direction, that is done when it is picked.
+#
+# Use the modal state of the source program rather than tracking the
+# position here.
+#
 # 10-Aug-2015 ShaneG
 #
 # Tool path optimisation. This creates new gcode that performs the same
 # cutting operations while minimising the amount of non-cutting movement.
 # ----------------------------------------------------------------------------
-from math import sqrt
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from math import floor, sqrt
+from random import Random
+from time import perf_counter
+
+import numpy as np
 
 from util.gcode import GCode
 from util.logger import LOG
+from util.spatial import SpatialGrid, cellSize, hilbertIndex
+
+# Distance between the ends of movements that are joined into a chain
+TOLERANCE = 0.001
+
+# Smallest reduction in air travel that is counted as an improvement
+EPSILON = 1e-9
+
+# Smallest number of holes in a drilling program to order with hilbertOrder()
+HILBERT_POINTS = 1000
 
+# Longest move (in mm) that only retracts to the hop height
+HOP_DISTANCE = 5.0
 
-def cmp(a, b):
-    return (a > b) - (a < b)
+# Rapid feed rate (in mm/min) assumed when estimating the time saved
+RAPID_FEED = 1000.0
+
+# Smallest number of movements to order with clusterOrder()
+CLUSTER_MOVEMENTS = 200000
+
+# Average number of movements in each cluster
+CLUSTER_SIZE = 20000
 
 
 def distance(x1, y1, x2, y2):
@@ -25,6 +77,9 @@ class Point:
     """ Represent a single point
     """
 
+    # The source path (insertion) the movement was cut in, if known
+    region = None
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -32,6 +87,26 @@ class Point:
     def distanceFrom(self, x, y):
         return distance(self.x, self.y, x, y)
 
+    def ends(self):
+        """ Get the points the movement can start from
+        """
+        return ((self.x, self.y), )
+
+    def finish(self):
+        """ Get the point the movement finishes at
+        """
+        return self.x, self.y
+
+    def enter(self, index):
+        """ Start the movement from the given entry in ends()
+        """
+        pass
+
+    def reverse(self):
+        """ Swap the start and end of the movement
+        """
+        pass
+
     def generate(self, gcode, feed):
         return self.x, self.y
 
@@ -46,13 +121,21 @@ class Line(Point):
         self.ty = ty
 
     def distanceFrom(self, x, y):
-        d1 = distance(self.x, self.y, x, y)
-        d2 = distance(self.tx, self.ty, x, y)
-        if d2 < d1:
-            self.tx, self.x = self.x, self.tx
-            self.ty, self.y = self.y, self.ty
-            return d2
-        return d1
+        return min(distance(self.x, self.y, x, y), distance(self.tx, self.ty, x, y))
+
+    def ends(self):
+        return (self.x, self.y), (self.tx, self.ty)
+
+    def finish(self):
+        return self.tx, self.ty
+
+    def enter(self, index):
+        if index != 0:
+            self.reverse()
+
+    def reverse(self):
+        self.tx, self.x = self.x, self.tx
+        self.ty, self.y = self.y, self.ty
 
     def generate(self, gcode, feed):
         gcode.append("G01 X%0.4f Y%0.4f F%0.4f" % (self.tx, self.ty, feed))
@@ -69,18 +152,12 @@ class Arc(Line):
         self.cy = y + j
         self.cmd = cmd
 
-    def distanceFrom(self, x, y):
-        d1 = distance(self.x, self.y, x, y)
-        d2 = distance(self.tx, self.ty, x, y)
-        if d2 < d1:
-            self.tx, self.x = self.x, self.tx
-            self.ty, self.y = self.y, self.ty
-            if self.cmd == "G02":
-                self.cmd = "G03"
-            else:
-                self.cmd = "G02"
-            return d2
-        return d1
+    def reverse(self):
+        Line.reverse(self)
+        if self.cmd == "G02":
+            self.cmd = "G03"
+        else:
+            self.cmd = "G02"
 
     def generate(self, gcode, feed):
         gcode.append("%s X%0.4f Y%0.4f I%0.4f J%0.4f F%0.4f" % (
@@ -88,34 +165,536 @@ class Arc(Line):
         return self.tx, self.ty
 
 
-def getClosest(candidates, x, y):
-    """ Do a straight linear search for the closest element
+class Chain(Line):
+    """ A sequence of movements that join end to end
+    """
+
+    def __init__(self, movements):
+        self.movements = list(movements)
+        regions = set([m.region for m in self.movements])
+        if len(regions) == 1:
+            self.region = regions.pop()
+        self._update()
+
+    def _update(self):
+        """ Set the start and end points from the movements
+        """
+        self.x, self.y = self.movements[0].x, self.movements[0].y
+        self.tx, self.ty = self.movements[-1].finish()
+
+    def reverse(self):
+        self.movements.reverse()
+        for movement in self.movements:
+            movement.reverse()
+        self._update()
+
+    def generate(self, gcode, feed):
+        for movement in self.movements:
+            movement.generate(gcode, feed)
+        return self.tx, self.ty
+
+
+class Loop(Chain):
+    """ A chain that finishes where it starts, it can be entered at the start
+        of any of the movements
     """
-    best_distance = None
-    best_item = None
-    best_index = None
+
+    def distanceFrom(self, x, y):
+        return min([distance(px, py, x, y) for px, py in self.ends()])
+
+    def ends(self):
+        return [(m.x, m.y) for m in self.movements]
+
+    def enter(self, index):
+        self.movements = self.movements[index:] + self.movements[:index]
+        self._update()
+
+
+def chainMovements(movements, tolerance=TOLERANCE):
+    """ Join movements that share end points (within 'tolerance') into chains
+
+      Each line or arc is extended in both directions for as long as there
+      is another one to join on to, a chain that comes back to its start is
+      a Loop. Points are left as they are. Returns a new list of movements.
+    """
+    segments = [m for m in movements if isinstance(m, Line)]
+    grid = SpatialGrid(cellSize([p for m in segments for p in m.ends()]))
+    for index, segment in enumerate(segments):
+        for tag, (px, py) in enumerate(segment.ends()):
+            grid.insert(index, px, py, tag)
+    used = [False] * len(segments)
+
+    def join(x, y):
+        # Take the closest segment end to the given point if it is in range
+        found = grid.nearest(x, y)
+        if (found is None) or (found[0] > tolerance):
+            return None, None
+        _, index, tag, _, _ = found
+        return take(index), tag
+
+    def take(index):
+        used[index] = True
+        for tag, (px, py) in enumerate(segments[index].ends()):
+            grid.remove(index, px, py, tag)
+        return segments[index]
+
+    results = list()
     index = 0
-    for item in candidates:
-        distance = item.distanceFrom(x, y)
-        if distance == 0:
-            del candidates[index]
-            return candidates, item
-        # Is this the new best?
-        if (best_item is None) or (distance < best_distance):
-            best_item = item
-            best_distance = distance
-            best_index = index
+    for movement in movements:
+        if not isinstance(movement, Line):
+            results.append(movement)
+            continue
         index = index + 1
-    # Return the best result
-    del candidates[best_index]
-    return candidates, best_item
+        if used[index - 1]:
+            continue
+        chain = deque([take(index - 1)])
+        # Follow it forwards
+        while True:
+            segment, tag = join(*chain[-1].finish())
+            if segment is None:
+                break
+            segment.enter(tag)
+            chain.append(segment)
+        (sx, sy), (ex, ey) = (chain[0].x, chain[0].y), chain[-1].finish()
+        if (len(chain) > 1) and (distance(sx, sy, ex, ey) <= tolerance):
+            results.append(Loop(chain))
+            continue
+        # And backwards
+        while True:
+            segment, tag = join(chain[0].x, chain[0].y)
+            if segment is None:
+                break
+            # The end of this one joins the start of the chain
+            segment.enter(1 - tag)
+            chain.appendleft(segment)
+        if len(chain) == 1:
+            results.append(chain[0])
+        else:
+            results.append(Chain(chain))
+    return results
+
+
+def closestOrder(movements, x=0.0, y=0.0):
+    """ Order the movements by repeatedly picking the closest to the end of
+        the previous one (starting at x, y)
+
+      Movements are reversed (or entered at a different point) if that is
+      closer. The ends of all the movements are held in a SpatialGrid so
+      each pick only looks at the movements nearby. Returns a new list.
+    """
+    grid = SpatialGrid(cellSize([p for m in movements for p in m.ends()]))
+    for index, movement in enumerate(movements):
+        for tag, (px, py) in enumerate(movement.ends()):
+            grid.insert(index, px, py, tag)
+    ordered = list()
+    while grid.count > 0:
+        _, index, tag, _, _ = grid.nearest(x, y)
+        current = movements[index]
+        for end, (px, py) in enumerate(current.ends()):
+            grid.remove(index, px, py, end)
+        current.enter(tag)
+        ordered.append(current)
+        x, y = current.finish()
+    return ordered
+
+
+def hilbertOrder(movements, x=0.0, y=0.0):
+    """ Order a list of points by their position along a Hilbert curve
+
+      This is a sort so it is much quicker than closestOrder() for large
+      numbers of points although the air travel is a bit longer, use
+      improveOrder() to refine it. The order is reversed if that starts
+      closer to (x, y). Returns a new list.
+    """
+    index = hilbertIndex([m.x for m in movements], [m.y for m in movements])
+    ordered = [movements[i] for i in np.argsort(index, kind="stable").tolist()]
+    if (len(ordered) > 1) and (ordered[-1].distanceFrom(x, y) < ordered[0].distanceFrom(x, y)):
+        ordered.reverse()
+    return ordered
+
+
+class _Tour:
+    """ An ordered list of movements that can be rearranged cheaply
+
+      Movements are referred to by their index in the original list, the
+      current start and finish point of each is tracked as segments are
+      reversed. The tour starts at a fixed point (position -1).
+    """
+
+    def __init__(self, movements, x, y):
+        self.origin = (x, y)
+        self.start = [(m.x, m.y) for m in movements]
+        self.finish = [m.finish() for m in movements]
+        self.flipped = [False] * len(movements)
+        self.order = list(range(len(movements)))
+        self.position = list(range(len(movements)))
 
+    def tail(self, index):
+        """ Get the point the tool is at after the given position
+        """
+        if index < 0:
+            return self.origin
+        return self.finish[self.order[index]]
 
-def optimise(source):
+    def gap(self, a, b):
+        """ Air travel between the end of position 'a' and the start of 'b'
+        """
+        if b >= len(self.order):
+            return 0.0
+        (x1, y1), (x2, y2) = self.tail(a), self.start[self.order[b]]
+        return distance(x1, y1, x2, y2)
+
+    def flip(self, key):
+        """ Reverse the direction of a single movement
+        """
+        self.start[key], self.finish[key] = self.finish[key], self.start[key]
+        self.flipped[key] = not self.flipped[key]
+
+    def reverse(self, first, last):
+        """ Reverse the order (and direction) of the movements in a range of
+            positions
+        """
+        self.order[first:last + 1] = self.order[first:last + 1][::-1]
+        for index in range(first, last + 1):
+            self.flip(self.order[index])
+            self.position[self.order[index]] = index
+
+    def move(self, first, count, after, backwards):
+        """ Move a block of positions so it follows position 'after'
+        """
+        block = self.order[first:first + count]
+        if backwards:
+            block.reverse()
+            for key in block:
+                self.flip(key)
+        rest = self.order[:first] + self.order[first + count:]
+        at = after + 1 if after < first else after + 1 - count
+        self.order = rest[:at] + block + rest[at:]
+        for index in range(min(first, at), max(first + count, at + count)):
+            self.position[self.order[index]] = index
+
+
+def _twoOpt(tour, index, candidates):
+    """ Try reversing the positions after 'index' up to a nearby movement
+
+      Returns True if an improvement was made.
+    """
+    size = len(tour.order)
+    ax, ay = tour.tail(index)
+    for key in candidates:
+        last = tour.position[key]
+        if last <= index:
+            continue
+        first = index + 1
+        (bx, by), (cx, cy) = tour.start[tour.order[first]], tour.finish[tour.order[last]]
+        before = tour.gap(index, first) + tour.gap(last, last + 1)
+        after = distance(ax, ay, cx, cy)
+        if last + 1 < size:
+            dx, dy = tour.start[tour.order[last + 1]]
+            after = after + distance(bx, by, dx, dy)
+        if before - after > EPSILON:
+            tour.reverse(first, last)
+            return True
+    return False
+
+
+def _orOpt(tour, first, count, candidates):
+    """ Try moving a short block of positions next to a nearby movement
+        (reversing it if that is better)
+
+      Returns True if an improvement was made.
+    """
+    size = len(tour.order)
+    last = first + count - 1
+    (bx, by), (cx, cy) = tour.start[tour.order[first]], tour.finish[tour.order[last]]
+    # Travel saved by taking the block out
+    saved = tour.gap(first - 1, first) + tour.gap(last, last + 1)
+    if last + 1 < size:
+        (px, py), (qx, qy) = tour.tail(first - 1), tour.start[tour.order[last + 1]]
+        saved = saved - distance(px, py, qx, qy)
+    for key in candidates:
+        for after in (tour.position[key] - 1, tour.position[key]):
+            if first - 1 <= after <= last:
+                continue
+            px, py = tour.tail(after)
+            joined = 0.0
+            if after + 1 < size:
+                qx, qy = tour.start[tour.order[after + 1]]
+                joined = distance(px, py, qx, qy)
+                forward = distance(px, py, bx, by) + distance(cx, cy, qx, qy)
+                backward = distance(px, py, cx, cy) + distance(bx, by, qx, qy)
+            else:
+                forward = distance(px, py, bx, by)
+                backward = distance(px, py, cx, cy)
+            if saved - (forward - joined) > EPSILON:
+                tour.move(first, count, after, False)
+                return True
+            if saved - (backward - joined) > EPSILON:
+                tour.move(first, count, after, True)
+                return True
+    return False
+
+
+def improveOrder(movements, x=0.0, y=0.0, budget=1.0, neighbours=8):
+    """ Reduce the air travel between an ordered list of movements (starting
+        at x, y) with 2-opt and Or-opt moves
+
+      Only moves that join a movement to one of its closest 'neighbours' are
+      tried. Stops when no move helps or after 'budget' seconds. Movements
+      are reversed as needed (arcs change direction) and the new order is
+      returned.
+    """
+    deadline = perf_counter() + budget
+    tour = _Tour(movements, x, y)
+    size = len(movements)
+    grid = SpatialGrid(cellSize(tour.start + tour.finish))
+    for key in range(size):
+        for tag, (px, py) in enumerate(movements[key].ends()):
+            grid.insert(key, px, py, tag)
+    nearby = dict()
+
+    def candidates(key):
+        # The movements closest to either end of this one
+        if key not in nearby:
+            keys = list()
+            for px, py in movements[key].ends():
+                keys.extend([k for k in grid.neighbours(px, py, neighbours, key) if k not in keys])
+            nearby[key] = keys
+        return nearby[key]
+
+    improved = True
+    while improved and (perf_counter() < deadline):
+        improved = False
+        for index in range(-1, size - 1):
+            if (index % 64 == 0) and (perf_counter() >= deadline):
+                break
+            # Reconnect the end of this position to something close to it
+            if index < 0:
+                keys = grid.neighbours(x, y, neighbours)
+            else:
+                keys = candidates(tour.order[index])
+            if _twoOpt(tour, index, keys):
+                improved = True
+            # Move the next few movements somewhere closer
+            for count in (1, 2, 3):
+                if index + count < size:
+                    first = index + 1
+                    keys = candidates(tour.order[first])
+                    if count > 1:
+                        keys = keys + candidates(tour.order[first + count - 1])
+                    if _orOpt(tour, first, count, keys):
+                        improved = True
+                        break
+    # Update the movements to match
+    for key in range(size):
+        if tour.flipped[key]:
+            movements[key].reverse()
+    return [movements[key] for key in tour.order]
+
+
+def airTravel(movements, x=0.0, y=0.0):
+    """ Calculate the distance travelled between an ordered list of movements
+    """
+    total = 0.0
+    for movement in movements:
+        total = total + distance(x, y, movement.x, movement.y)
+        x, y = movement.finish()
+    return total
+
+
+def startPoints(movements, x=0.0, y=0.0, count=8, seed=0):
+    """ Choose points to start ordering the movements from
+
+      The first is the tool position (x, y) followed by the corners of the
+      area the movements cover and then random points in it. The same
+      'seed' always gives the same points.
+    """
+    xs = [p[0] for m in movements for p in m.ends()]
+    ys = [p[1] for m in movements for p in m.ends()]
+    minx, maxx, miny, maxy = min(xs), max(xs), min(ys), max(ys)
+    points = [(x, y), (minx, miny), (minx, maxy), (maxx, miny), (maxx, maxy)]
+    rng = Random(seed)
+    while len(points) < count:
+        points.append((rng.uniform(minx, maxx), rng.uniform(miny, maxy)))
+    return points[:count]
+
+
+def _orderFrom(movements, start, x, y):
+    """ Order the movements starting from the closest to 'start'
+
+      Returns the air travel (from x, y) and the ordered movements. This is
+      run in a worker process by multiStartOrder().
+    """
+    ordered = closestOrder(movements, *start)
+    return airTravel(ordered, x, y), ordered
+
+
+def multiStartOrder(movements, x=0.0, y=0.0, starts=8, seed=0, workers=None, deadline=None):
+    """ Order the movements from several start points and keep the best
+
+      Each ordering is the same as closestOrder() but begins with the
+      movement closest to one of the points from startPoints(), the one
+      with the least air travel from (x, y) is returned. If 'workers' is
+      given the orderings run in that many processes. Orderings that have
+      not started by the 'deadline' (a perf_counter() time) are skipped.
+      The result only depends on the seed unless that happens.
+    """
+    points = startPoints(movements, x, y, starts, seed)
+    results = list()
+    if (workers is None) or (workers < 2):
+        for point in points:
+            if (deadline is not None) and (perf_counter() >= deadline) and (len(results) > 0):
+                break
+            results.append(_orderFrom(deepcopy(movements), point, x, y))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [pool.submit(_orderFrom, movements, point, x, y) for point in points]
+            for job in jobs:
+                if (deadline is not None) and (perf_counter() >= deadline) and (len(results) > 0):
+                    job.cancel()
+                    if job.cancelled():
+                        continue
+                results.append(job.result())
+    # The earliest start point wins a tie
+    best = min(range(len(results)), key=lambda index: (results[index][0], index))
+    return results[best][1]
+
+
+def planTravel(ordered, cut, safe, insertFeed, feed, hop=None, hopDistance=HOP_DISTANCE, stayDown=None):
+    """ Generate the gcode for an ordered list of movements
+
+      The tool is retracted to the 'safe' height between movements and
+      inserted to the 'cut' depth at 'insertFeed'. If a 'hop' height is
+      given it is used instead for moves up to 'hopDistance' long. Unlike
+      'stayDown' this applies to any two movements (whatever their region)
+      so the hop height has to clear anything the tool could pass over, not
+      just the board. If 'stayDown' is given lines and arcs closer together
+      than that from the same region are joined without retracting at all.
+      Returns the gcode, the air travel and an estimate of the seconds saved
+      by hopping and staying down.
+    """
+    gcode = GCode()
+    x, y, nair, saved = 0.0, 0.0, 0.0, 0.0
+    first = True
+    previous = None
+
+    def plunge(height):
+        # Minutes to retract from the cut depth to 'height' and insert again
+        return ((height - cut) / RAPID_FEED) + ((height - cut) / insertFeed)
+
+    for current in ordered:
+        # Do we need to do a retraction and insertion ?
+        if first or (x != current.x) or (y != current.y):
+            gap = distance(x, y, current.x, current.y)
+            if (not first) and (stayDown is not None) and (gap <= stayDown) and \
+                    isinstance(current, Line) and isinstance(previous, Line) and \
+                    (current.region is not None) and (current.region == previous.region):
+                # Cut straight across to the next movement
+                gcode.append("G01 X%0.4f Y%0.4f F%0.4f" % (current.x, current.y, feed))
+                saved = saved + plunge(safe) + (gap / RAPID_FEED) - (gap / feed)
+                nair = nair + gap
+                x, y = current.x, current.y
+            else:
+                if not first:
+                    # Retract
+                    height = safe
+                    if (hop is not None) and (gap <= hopDistance):
+                        height = hop
+                        saved = saved + plunge(safe) - plunge(hop)
+                    gcode.append("G00 Z%0.4f" % height)
+                first = False
+                if (x != current.x) or (y != current.y):
+                    # Move to co-ordinate
+                    gcode.append("G00 X%0.4f Y%0.4f" % (current.x, current.y))
+                    nair = nair + gap
+                    x, y = current.x, current.y
+                # Insert
+                gcode.append("G01 Z%0.4f F%0.4f" % (cut, insertFeed))
+        # Do the movement
+        x, y = current.generate(gcode, feed)
+        previous = current
+    # Retract
+    gcode.append("G00 Z%0.4f" % safe)
+    return gcode, nair, saved * 60.0
+
+
+def clusters(movements, size=CLUSTER_SIZE):
+    """ Split movements into clusters by the grid cell they start in
+
+      The cells are sized for about 'size' movements each if they were
+      spread evenly. Returns a list of (centroid, movements) for each
+      cluster in the order of their cells.
+    """
+    side = cellSize([(m.x, m.y) for m in movements], size)
+    cells = dict()
+    for movement in movements:
+        cell = int(floor(movement.x / side)), int(floor(movement.y / side))
+        cells.setdefault(cell, list()).append(movement)
+    result = list()
+    for cell in sorted(cells):
+        members = cells[cell]
+        cx = sum([m.x for m in members]) / len(members)
+        cy = sum([m.y for m in members]) / len(members)
+        result.append(((cx, cy), members))
+    return result
+
+
+def clusterOrder(movements, x=0.0, y=0.0, size=CLUSTER_SIZE, workers=None):
+    """ Order a large number of movements a cluster at a time
+
+      The clusters (see clusters()) are visited in a short tour of their
+      centroids, the movements in each one are then put in closestOrder()
+      starting from the centroid of the one before. The clusters are
+      independent so if 'workers' is given they are ordered in that many
+      processes, only a few clusters are waiting at any time. Returns a new
+      list.
+    """
+    groups = clusters(movements, size)
+    centroids = [Point(cx, cy) for (cx, cy), members in groups]
+    tour = improveOrder(closestOrder(centroids, x, y), x, y)
+    lookup = dict([(id(point), members) for point, (centroid, members) in zip(centroids, groups)])
+    # Each cluster starts from the centroid of the previous one
+    jobs = list()
+    for point in tour:
+        jobs.append((lookup[id(point)], x, y))
+        x, y = point.x, point.y
+    ordered = list()
+    if (workers is None) or (workers < 2):
+        for members, sx, sy in jobs:
+            ordered.extend(closestOrder(members, sx, sy))
+        return ordered
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for members, sx, sy in jobs:
+            if len(pending) >= 2 * workers:
+                ordered.extend(pending.popleft().result())
+            pending.append(pool.submit(closestOrder, members, sx, sy))
+        while len(pending) > 0:
+            ordered.extend(pending.popleft().result())
+    return ordered
+
+
+def optimise(source, budget=None, tolerance=TOLERANCE, starts=1, seed=0, workers=None,
+             hop=None, hopDistance=HOP_DISTANCE, stayDown=None):
     """ Return an optimised copy of the given gcode
+
+      Movements that join up (within 'tolerance') are kept together as a
+      single path (see chainMovements()), set it to None to order every
+      movement separately. If 'starts' is more than one that many orderings
+      are tried (see multiStartOrder()), in parallel if 'workers' is given.
+      If a 'budget' (in seconds) is given the order is improved further
+      (see improveOrder()), the whole optimisation takes about that long.
+      Drilling programs with at least HILBERT_POINTS holes are ordered with
+      hilbertOrder() instead and programs with at least CLUSTER_MOVEMENTS
+      movements with clusterOrder() (using the 'workers'). The 'hop',
+      'hopDistance' and 'stayDown' settings control the moves between
+      movements (see planTravel()), each movement is tagged with the
+      insertion it was cut in as its region.
     """
+    deadline = None
+    if budget is not None:
+        deadline = perf_counter() + budget
     # Build up a sequence of cutting operations
-    x, y, z = 0.0, 0.0, 0.0
     cut, safe = source.minz, source.maxz
     insert_feed = 250
     feed = 500
@@ -124,70 +703,73 @@ def optimise(source):
     airtime = 0.0
     insert = False
     cutting = False
-    for cmd in source.lines:
+    paths = 0
+    state = source.state()
+    positions = zip(state.x0.tolist(), state.y0.tolist(), state.z0.tolist(),
+                    state.x.tolist(), state.y.tolist(), state.z.tolist())
+    for cmd, (x, y, z, nx, ny, nz) in zip(source.lines, positions):
         # Look for insertion or retraction. Note that we assume that these moves
         # only change the Z axis
-        nz = cmd.Z or z
         if (nz < 0.0) and (z >= 0.0):
-            z = nz
             insert = True
             cutting = True
+            paths = paths + 1
             insert_feed = cmd.F or insert_feed
             continue
         if (nz >= 0.0) and (z < 0.0):
-            z = nz
             cutting = False
             if insert:
                 # Add as a point
                 movements.append(Point(x, y))
                 insert = False
             continue
-        # Figure out the new position
-        nx = cmd.X or x
-        ny = cmd.Y or y
         if cutting:
+            movement = None
             if cmd.command == "G01":
                 # Line
-                movements.append(Line(x, y, nx, ny))
+                movement = Line(x, y, nx, ny)
                 feed = cmd.F or feed
             elif cmd.command in ("G02", "G03"):
                 # Arc
-                movements.append(Arc(x, y, nx, ny, cmd.I, cmd.J, cmd.command))
+                movement = Arc(x, y, nx, ny, cmd.I, cmd.J, cmd.command)
                 feed = cmd.F or feed
+            if movement is not None:
+                movement.region = paths
+                movements.append(movement)
             insert = False
         else:
             airtime = airtime + distance(x, y, nx, ny)
-        # Update position
-        x, y = nx, ny
-    LOG.INFO("    Original - %d operations, %dmm air travel" % (len(movements), int(airtime)))
+    LOG.INFO("    Original - %d operations, %dmm air travel", len(movements), int(airtime))
     if len(movements) == 0:
         LOG.INFO("    No optimisation can be performed.")
         return source
+    if tolerance is not None:
+        movements = chainMovements(movements, tolerance)
+        LOG.INFO("    Chained - %d paths", len(movements))
+    if (hop is not None) and ((hop <= 0.0) or (hop >= safe)):
+        LOG.WARN("    Hop height %0.4f is not between the surface and safe height, ignoring it", hop)
+        hop = None
     # Now generate an optimised order of operations
-    x, y, nair = 0.0, 0.0, 0.0
-    first = True
-    optimised = GCode()
-    movements.sort(cmp=lambda a, b: cmp(a.distanceFrom(x, y), b.distanceFrom(x, y)))
-    while len(movements) > 0:
-        # Sort by distance to current point
-        movements, current = getClosest(movements, x, y)
-        # Do we need to do a retraction and insertion ?
-        if first or (x != current.x) or (y != current.y):
-            if not first:
-                # Retract
-                optimised.append("G00 Z%0.4f" % safe)
-            first = False
-            if (x != current.x) or (y != current.y):
-                # Move to co-ordinate
-                optimised.append("G00 X%0.4f Y%0.4f" % (current.x, current.y))
-                nair = nair + distance(x, y, current.x, current.y)
-                x, y = current.x, current.y
-            # Insert
-            optimised.append("G01 Z%0.4f F%0.4f" % (cut, insert_feed))
-        # Do the movement
-        x, y = current.generate(optimised, feed)
-    # Retract
-    optimised.append("G00 Z%0.4f" % safe)
+    x, y = 0.0, 0.0
+    points = all([type(m) is Point for m in movements])
+    if points and (len(movements) >= HILBERT_POINTS):
+        LOG.INFO("    Ordering %d holes along a Hilbert curve", len(movements))
+        ordered = hilbertOrder(movements, x, y)
+    elif len(movements) >= CLUSTER_MOVEMENTS:
+        LOG.INFO("    Ordering %d movements in clusters", len(movements))
+        ordered = clusterOrder(movements, x, y, workers=workers)
+    elif starts > 1:
+        ordered = multiStartOrder(movements, x, y, starts, seed, workers, deadline)
+    else:
+        ordered = closestOrder(movements, x, y)
+    improved = ""
+    if budget is not None:
+        greedy = airTravel(ordered, x, y)
+        ordered = improveOrder(ordered, x, y, max(0.0, deadline - perf_counter()))
+        improved = ", %dmm less than the initial order" % int(greedy - airTravel(ordered, x, y))
+    optimised, nair, saved = planTravel(ordered, cut, safe, insert_feed, feed, hop, hopDistance, stayDown)
     # See what we came up with
-    LOG.INFO("    Optimised - %dmm air travel, %d %% of original." % (int(nair), int((100.0 * nair) / airtime)))
+    if saved > 0.0:
+        improved = improved + ", about %ds saved on retractions" % int(saved)
+    LOG.INFO("    Optimised - %dmm air travel, %d %% of original%s.", int(nair), int((100.0 * nair) / airtime), improved)
     return optimised
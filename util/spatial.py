@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# A uniform grid spatial index for nearest neighbour searches. The tool
+# path optimiser uses it to find the closest remaining movement without
+# scanning every one of them. Points can also be sorted along a Hilbert
+# curve which keeps points that are close together near each other.
+# ----------------------------------------------------------------------------
+from math import sqrt, floor
+
+import numpy as np
+
+# Bits used for each axis when calculating Hilbert curve positions
+HILBERT_BITS = 16
+
+
+def cellSize(points, perCell=2.0):
+    """ Choose a cell size for a set of (x, y) points
+
+      The size gives roughly 'perCell' points per cell if they were spread
+      evenly over their bounding box.
+    """
+    if len(points) == 0:
+        return 1.0
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    w, h = max(xs) - min(xs), max(ys) - min(ys)
+    area = w * h
+    if area <= 0.0:
+        # All on a line (or the same point)
+        return max(w, h, 1.0) * perCell / len(points)
+    return sqrt((area * perCell) / len(points))
+
+
+def hilbertIndex(xs, ys, bits=HILBERT_BITS):
+    """ Get the position along a Hilbert curve for each (x, y) point
+
+      The points are scaled to fill a square grid of 2**bits cells on each
+      side, the curve starts at the lower left corner of their bounding box
+      and ends at the lower right. Returns an array of integers.
+    """
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    if len(xs) == 0:
+        return np.zeros(0, dtype=np.int64)
+    side = (1 << bits) - 1
+    minx, miny = xs.min(), ys.min()
+    extent = max(xs.max() - minx, ys.max() - miny)
+    scale = side / extent if extent > 0.0 else 0.0
+    x = np.rint((xs - minx) * scale).astype(np.int64)
+    y = np.rint((ys - miny) * scale).astype(np.int64)
+    index = np.zeros(len(x), dtype=np.int64)
+    s = 1 << (bits - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        index += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve joins up
+        flip = rx & ~ry
+        x = np.where(flip, side - x, x)
+        y = np.where(flip, side - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s = s >> 1
+    return index
+
+
+class SpatialGrid:
+    """ A grid of cells holding points, each tagged with a key
+
+      A key (usually an index into a list) can have several points, they
+      are inserted and removed individually. Searches break ties on
+      distance by the lowest key and then the lowest tag so the results are
+      the same as a linear scan that keeps the first of any equal values.
+    """
+
+    def __init__(self, size):
+        """ Create an empty grid with square cells of the given size
+        """
+        self.size = float(size)
+        self.cells = dict()
+        self.count = 0
+
+    def _cell(self, x, y):
+        """ Get the cell co-ordinates for a point
+        """
+        return int(floor(x / self.size)), int(floor(y / self.size))
+
+    def insert(self, key, x, y, tag=0):
+        """ Add a point for a key
+
+          The tag distinguishes points with the same key (the ends of a line
+          for example) and is returned by nearest().
+        """
+        cell = self._cell(x, y)
+        entries = self.cells.get(cell, None)
+        if entries is None:
+            entries = list()
+            self.cells[cell] = entries
+        entries.append((key, tag, x, y))
+        self.count = self.count + 1
+
+    def remove(self, key, x, y, tag=0):
+        """ Remove a point previously added with insert()
+        """
+        cell = self._cell(x, y)
+        entries = self.cells[cell]
+        entries.remove((key, tag, x, y))
+        if len(entries) == 0:
+            del self.cells[cell]
+        self.count = self.count - 1
+
+    def _search(self, entries, x, y, best):
+        """ Update the best (distance, key, tag, x, y) match from some entries
+        """
+        for key, tag, px, py in entries:
+            d = sqrt((px - x) ** 2 + (py - y) ** 2)
+            if (best is None) or (d < best[0]) or ((d == best[0]) and ((key, tag) < (best[1], best[2]))):
+                best = (d, key, tag, px, py)
+        return best
+
+    def _ring(self, cx, cy, ring):
+        """ Generate the entries for each occupied cell on a ring of cells
+        """
+        for gx in range(cx - ring, cx + ring + 1):
+            edge = (gx == cx - ring) or (gx == cx + ring)
+            for gy in (range(cy - ring, cy + ring + 1) if edge else (cy - ring, cy + ring)):
+                entries = self.cells.get((gx, gy), None)
+                if entries is not None:
+                    yield entries
+
+    def neighbours(self, x, y, count, exclude=None):
+        """ Find the keys with points closest to the given position
+
+          Returns a list of up to 'count' keys (not including 'exclude')
+          ordered by the distance to their closest point.
+        """
+        cx, cy = self._cell(x, y)
+        found = dict()
+        ring = 0
+        while True:
+            everything = (2 * ring + 1) ** 2 >= len(self.cells)
+            if everything:
+                cells = self.cells.values()
+            else:
+                cells = self._ring(cx, cy, ring)
+            for entries in cells:
+                for key, tag, px, py in entries:
+                    if key != exclude:
+                        d = sqrt((px - x) ** 2 + (py - y) ** 2)
+                        if (key not in found) or (d < found[key]):
+                            found[key] = d
+            ranked = sorted(found, key=lambda k: (found[k], k))[:count]
+            if everything or ((len(ranked) == count) and (found[ranked[-1]] < ring * self.size)):
+                return ranked
+            ring = ring + 1
+
+    def nearest(self, x, y):
+        """ Find the closest point to the given position
+
+          Returns a tuple of (distance, key, tag, x, y) or None if the grid is
+          empty. The cells are searched in rings around the position until
+          nothing further out could be closer.
+        """
+        if self.count == 0:
+            return None
+        cx, cy = self._cell(x, y)
+        best = None
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 >= len(self.cells):
+                # Cheaper to look at every cell that is left
+                for entries in self.cells.values():
+                    best = self._search(entries, x, y, best)
+                return best
+            # Search the cells on this ring
+            for entries in self._ring(cx, cy, ring):
+                best = self._search(entries, x, y, best)
+            # Anything on the next ring is at least this far away
+            if (best is not None) and (best[0] < ring * self.size):
+                return best
+            ring = ring + 1
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Modal state tracking. Works out where the machine is (and which modes are
+# active) for every command in a program so the renderer, optimiser and
+# filters don't each have to simulate the machine themselves.
+# ----------------------------------------------------------------------------
+import numpy as np
+
+from util.table import CommandTable
+
+# Motion modes (in the order used by MachineState.motion)
+MOTION = ("G00", "G01", "G02", "G03")
+
+# Units (in the order used by MachineState.units)
+UNITS = ("G20", "G21")
+
+
+class Position:
+    """ Track the current position while processing commands one at a time
+
+      This is for filters that only see a single command at a time, a
+      parameter that is not present leaves that axis where it was.
+    """
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def update(self, command):
+        """ Move to the end point of the given command
+        """
+        if command.X is not None:
+            self.x = command.X
+        if command.Y is not None:
+            self.y = command.Y
+        if command.Z is not None:
+            self.z = command.Z
+
+
+def _carry(values, present, initial):
+    """ Replace the entries that are not present with the last one that was
+
+      Entries before the first present one are set to 'initial'.
+    """
+    index = np.maximum.accumulate(np.where(present, np.arange(len(values)), -1))
+    return np.where(index >= 0, values[np.maximum(index, 0)], initial)
+
+
+def _modes(codes, commands, modes):
+    """ Get the active mode for each row as an index into 'modes' (or -1)
+    """
+    lookup = np.full(max(1, len(commands)), -1, dtype=np.int8)
+    for index, mode in enumerate(modes):
+        if mode in commands:
+            lookup[commands.index(mode)] = index
+    selected = lookup[codes]
+    return _carry(selected, selected >= 0, -1).astype(np.int8)
+
+
+class MachineState:
+    """ The modal state of the machine for each command in a program
+
+      Every attribute is an array with one entry per command -
+
+        x0, y0, z0 - the position before the command
+        x, y, z    - the position after the command
+        motion     - the active motion mode as an index into MOTION (or -1)
+        feed       - the active feed rate (NaN until one is set)
+        units      - the active units as an index into UNITS (or -1)
+
+      The state is calculated in a single vectorised pass over the program.
+      The machine starts at the origin unless a Position is given.
+    """
+
+    def __init__(self, lines, origin=None):
+        if isinstance(lines, CommandTable):
+            columns = [lines.column(p) for p in ("X", "Y", "Z", "F")]
+            codes = lines.codes[:len(lines)]
+            commands = lines.commands
+        else:
+            values = np.array([(c.X, c.Y, c.Z, c.F) for c in lines], dtype=float).reshape(-1, 4)
+            columns = values.T
+            commands = list()
+            lookup = dict()
+            codes = np.zeros(len(values), dtype=np.int32)
+            for row, cmd in enumerate(lines):
+                code = lookup.get(cmd.command, None)
+                if code is None:
+                    code = len(commands)
+                    commands.append(cmd.command)
+                    lookup[cmd.command] = code
+                codes[row] = code
+        # Positions
+        start = (0.0, 0.0, 0.0)
+        if origin is not None:
+            start = (origin.x, origin.y, origin.z)
+        self.start = start
+        self.x, self.y, self.z = [_carry(c, ~np.isnan(c), s) for c, s in zip(columns[:3], start)]
+        ends = (self.x, self.y, self.z)
+        self.x0, self.y0, self.z0 = [np.concatenate(([s], c))[:len(c)] for c, s in zip(ends, start)]
+        # Modes
+        self.feed = _carry(columns[3], ~np.isnan(columns[3]), np.nan)
+        self.motion = _modes(codes, commands, MOTION)
+        self.units = _modes(codes, commands, UNITS)
+
+    def final(self):
+        """ Get the position after the last command (or the start position)
+        """
+        if len(self) == 0:
+            return Position(*self.start)
+        return Position(float(self.x[-1]), float(self.y[-1]), float(self.z[-1]))
+
+    def __len__(self):
+        return len(self.x)
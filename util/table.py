@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Columnar (struct of arrays) storage for large gcode programs.
+# ----------------------------------------------------------------------------
+import numpy as np
+
+from util.command import PARAMS, GCommand, parseFields
+
+
+class CommandTable:
+    """ Stores a sequence of commands as a set of NumPy columns
+
+      Each entry in PARAMS gets a float64 column where NaN marks a parameter
+      that is not present. Command codes ("G01", "M03", ...) are interned and
+      stored as an index into the 'commands' list and comments are kept in a
+      sparse dictionary keyed by row. The table behaves enough like a list of
+      GCommand instances (append, len, iteration and indexing) to be used as
+      the 'lines' of a GCode object.
+    """
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.codes = np.zeros(capacity, dtype=np.int32)
+        self.columns = dict([(p, np.full(capacity, np.nan)) for p in PARAMS])
+        self.commands = [""]
+        self.lookup = {"": 0}
+        self.comments = dict()
+
+    @classmethod
+    def fromCommands(cls, commands):
+        """ Build a table from a sequence of GCommand instances
+        """
+        table = cls()
+        table.extend(commands)
+        return table
+
+    @classmethod
+    def fromLines(cls, lines):
+        """ Parse a sequence of lines straight into a table
+        """
+        lines = list(lines)
+        table = cls(max(1, len(lines)))
+        codes, columns, comments = table.codes, table.columns, table.comments
+        for row, line in enumerate(lines):
+            fields = parseFields(line)
+            codes[row] = table.intern(fields.pop("command"))
+            comment = fields.pop("comment")
+            if comment:
+                comments[row] = comment
+            for name, value in fields.items():
+                columns[name][row] = value
+        table.size = len(lines)
+        return table
+
+    @classmethod
+    def concatenate(cls, tables):
+        """ Join a sequence of tables into a single new one
+        """
+        result = cls(max(1, sum([len(t) for t in tables])))
+        for table in tables:
+            result.extend(table)
+        return result
+
+    def _reserve(self, count):
+        """ Make sure there is space for 'count' rows
+        """
+        capacity = len(self.codes)
+        if count <= capacity:
+            return
+        while capacity < count:
+            capacity = capacity * 2
+        codes = np.zeros(capacity, dtype=np.int32)
+        codes[:self.size] = self.codes[:self.size]
+        self.codes = codes
+        for p in PARAMS:
+            column = np.full(capacity, np.nan)
+            column[:self.size] = self.columns[p][:self.size]
+            self.columns[p] = column
+
+    def intern(self, command):
+        """ Get the code used to represent the given command string
+        """
+        code = self.lookup.get(command, None)
+        if code is None:
+            code = len(self.commands)
+            self.commands.append(command)
+            self.lookup[command] = code
+        return code
+
+    def column(self, name):
+        """ Get a view of the values for a single parameter
+        """
+        return self.columns[name][:self.size]
+
+    def code(self, command):
+        """ Get the code for a command string or -1 if it is not in the table
+        """
+        return self.lookup.get(command, -1)
+
+    def bounds(self, name):
+        """ Get the minimum and maximum value of a parameter
+
+          Returns (None, None) if the parameter is not present in any row.
+        """
+        values = self.column(name)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return None, None
+        return float(values.min()), float(values.max())
+
+    def matches(self, cmd):
+        """ Get a mask of the rows that match the given GCommand
+
+          This is the same comparison as GCommand.matches()
+        """
+        mask = self.codes[:self.size] == self.code(cmd.command)
+        for p in PARAMS:
+            value = getattr(cmd, p)
+            if value is None:
+                mask &= np.isnan(self.column(p))
+            else:
+                mask &= self.column(p) == value
+        return mask
+
+    def append(self, cmd):
+        """ Add a GCommand instance to the end of the table
+        """
+        if self.size == len(self.codes):
+            self._reserve(self.size + 1)
+        row = self.size
+        self.codes[row] = self.intern(cmd.command)
+        for p in PARAMS:
+            value = getattr(cmd, p)
+            if value is not None:
+                self.columns[p][row] = value
+        if cmd.comment:
+            self.comments[row] = cmd.comment
+        self.size = row + 1
+
+    def extend(self, commands):
+        """ Add a sequence of commands (or another table) to the end of this one
+        """
+        if not isinstance(commands, CommandTable):
+            for cmd in commands:
+                self.append(cmd)
+            return
+        other = commands
+        start = self.size
+        self._reserve(start + other.size)
+        # Map the other table's command codes onto ours
+        remap = np.array([self.intern(c) for c in other.commands], dtype=np.int32)
+        self.codes[start:start + other.size] = remap[other.codes[:other.size]]
+        for p in PARAMS:
+            self.columns[p][start:start + other.size] = other.columns[p][:other.size]
+        for row, comment in other.comments.items():
+            self.comments[start + row] = comment
+        self.size = start + other.size
+
+    def take(self, rows):
+        """ Create a new table from a selection of rows
+
+          The rows may be given as a slice, a boolean mask or an array of
+          indices.
+        """
+        if isinstance(rows, slice):
+            rows = np.arange(self.size)[rows]
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        result = CommandTable(max(1, len(rows)))
+        result.commands = list(self.commands)
+        result.lookup = dict(self.lookup)
+        result.codes[:len(rows)] = self.codes[rows]
+        for p in PARAMS:
+            result.columns[p][:len(rows)] = self.columns[p][rows]
+        if len(self.comments) > 0:
+            # Map the old row numbers to the new ones
+            position = np.full(self.size, -1)
+            position[rows] = np.arange(len(rows))
+            for row, comment in self.comments.items():
+                if (row < self.size) and (position[row] >= 0):
+                    result.comments[int(position[row])] = comment
+        result.size = len(rows)
+        return result
+
+    def copy(self):
+        """ Create an independent copy of this table
+        """
+        return self.take(slice(None))
+
+    def fillAxes(self, start=0):
+        """ Carry a missing X or Y value forward from the previous row
+
+          This is the vectorised equivalent of the fix up GCode.append does as
+          each command is added and is applied to all rows from 'start' on.
+        """
+        first = max(start - 1, 0)
+        x = self.columns["X"][first:self.size]
+        y = self.columns["Y"][first:self.size]
+        if len(x) == 0:
+            return
+        xmissing, ymissing = np.isnan(x), np.isnan(y)
+        xonly = ~xmissing & ymissing
+        yonly = xmissing & ~ymissing
+        if start > 0:
+            # The row before the new ones already holds its final values
+            xonly[0] = yonly[0] = False
+        index = np.arange(len(x))
+        for target, mask in ((y, xonly), (x, yonly)):
+            if mask.any():
+                source = np.maximum.accumulate(np.where(mask, 0, index))
+                target[mask] = target[source[mask]]
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for row in range(self.size):
+            yield CommandRow(self, row)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(index)
+        if index < 0:
+            index = index + self.size
+        if (index < 0) or (index >= self.size):
+            raise IndexError("table index out of range")
+        return CommandRow(self, index)
+
+
+class CommandRow(GCommand):
+    """ A GCommand view of a single row in a CommandTable
+
+      Reading or writing the command, comment or any of the parameters goes
+      straight to the underlying table.
+    """
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    @property
+    def command(self):
+        return self.table.commands[self.table.codes[self.row]]
+
+    @command.setter
+    def command(self, value):
+        self.table.codes[self.row] = self.table.intern(value)
+
+    @property
+    def comment(self):
+        return self.table.comments.get(self.row, "")
+
+    @comment.setter
+    def comment(self, value):
+        if value:
+            self.table.comments[self.row] = value
+        else:
+            self.table.comments.pop(self.row, None)
+
+
+def _paramProperty(name):
+    """ Create a property to access a parameter column
+    """
+
+    def getter(self):
+        value = self.table.columns[name][self.row]
+        if value != value:
+            return None
+        return float(value)
+
+    def setter(self, value):
+        if value is None:
+            value = np.nan
+        self.table.columns[name][self.row] = value
+
+    return property(getter, setter)
+
+
+for _param in PARAMS:
+    setattr(CommandRow, _param, _paramProperty(_param))
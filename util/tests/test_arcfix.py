@@ -0,0 +1,86 @@
+import unittest
+
+import numpy as np
+
+from util.arcfix import CorrectArc, bendArcs, bendThatArc
+from util.gcode import GCode
+
+
+def scalar(*values):
+    """ Correct each arc with bendThatArc()
+    """
+    centers = [bendThatArc(*v) for v in zip(*[np.asarray(a).tolist() for a in values])]
+    return np.array(centers).reshape(-1, 2).T
+
+
+class TestBendArcs(unittest.TestCase):
+
+    def assertSameCenters(self, *values):
+        values = [np.asarray(v, dtype=float) for v in values]
+        expected = scalar(*values)
+        actual = np.array(bendArcs(*values))
+        self.assertEqual(expected.shape, actual.shape)
+        np.testing.assert_allclose(actual, expected, rtol=0.0, atol=1e-9)
+
+    def test_random(self):
+        """Random arcs match the scalar version"""
+        rng = np.random.default_rng(17)
+        x0, y0, x1, y1 = rng.uniform(-100.0, 100.0, (4, 5000))
+        x2 = (x0 + x1) / 2 + rng.normal(0.0, 20.0, len(x0))
+        y2 = (y0 + y1) / 2 + rng.normal(0.0, 20.0, len(x0))
+        self.assertSameCenters(x0, y0, x1, y1, x2, y2)
+
+    def test_directions(self):
+        """Centers on either side of the chord (clockwise and anti-clockwise arcs)"""
+        x0, y0, x1, y1 = [0.0] * 4, [0.0] * 4, [10.0, 10.0, -3.0, -3.0], [0.0, 0.0, 7.0, 7.0]
+        x2, y2 = [5.0, 5.0, -4.0, 1.0], [3.0, -3.0, 1.0, 6.0]
+        self.assertSameCenters(x0, y0, x1, y1, x2, y2)
+        cx, cy = bendArcs(*[np.array(v) for v in (x0, y0, x1, y1, x2, y2)])
+        # The corrected centers keep the side of the original
+        self.assertGreater(cy[0], 0.0)
+        self.assertLess(cy[1], 0.0)
+        # and are the same distance from both ends
+        np.testing.assert_allclose(np.hypot(cx, cy), np.hypot(cx - np.array(x1), cy - np.array(y1)))
+
+    def test_degenerate(self):
+        """Vertical chords, zero radius, zero length and half circles"""
+        cases = [
+            (1.0, 1.0, 1.0, 5.0, 3.0, 3.0),     # Vertical chord
+            (1.0, 1.0, 5.0, 1.0, 3.0, 2.0),     # Horizontal chord
+            (1.0, 1.0, 5.0, 5.0, 1.0, 1.0),     # Zero radius
+            (2.0, 2.0, 2.0, 2.0, 4.0, 2.0),     # Zero length chord
+            (0.0, 0.0, 4.0, 0.0, 2.0, 0.0),     # Half circle
+            (0.0, 0.0, 10.0, 0.0, 5.0, 1.0),    # Radius shorter than half the chord
+        ]
+        self.assertSameCenters(*zip(*cases))
+        for case in cases:
+            self.assertTrue(np.all(np.isfinite(bendArcs(*[np.array([v]) for v in case]))))
+
+
+class TestCorrectArc(unittest.TestCase):
+
+    PROGRAM = [
+        "G00 X0.0 Y0.0",
+        "G02 X10.0 Y0.0 I5.0 J2.0",
+        "G03 X10.0 Y10.0 I-1.0 J5.0",
+        "G03 X10.0 Y10.0 I1.0 J1.0",
+        "G02 X0.0 Y10.0 I-5.0 J0.0",
+        "G01 X0.0 Y0.0",
+    ]
+
+    def program(self, columnar):
+        gcode = GCode(columnar=columnar)
+        for line in TestCorrectArc.PROGRAM:
+            gcode.append(line)
+        return gcode
+
+    def test_batch(self):
+        """Correcting a whole table matches correcting each command"""
+        expected = self.program(False).clone(CorrectArc())
+        actual = self.program(True).clone(CorrectArc())
+        for a, b in zip(expected.lines, actual.lines):
+            self.assertEqual(a.command, b.command)
+            for p in ("X", "Y", "I", "J"):
+                self.assertAlmostEqual(getattr(a, p), getattr(b, p), places=9)
+        # Arcs that end where they start are left alone
+        self.assertEqual((actual.lines[3].I, actual.lines[3].J), (1.0, 1.0))
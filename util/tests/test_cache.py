@@ -0,0 +1,47 @@
+import unittest
+from os import utime
+from os.path import join, exists
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from util.cache import cacheName
+from util.gcode import loadGCode
+from util.tests.test_load import PROGRAM, describe
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.folder)
+
+    def write(self, name, text, mtime=None):
+        filename = join(self.folder, name)
+        with open(filename, "w") as target:
+            target.write(text)
+        if mtime is not None:
+            utime(filename, ns=(mtime, mtime))
+        return filename
+
+    def test_cached(self):
+        """A cached program is the same as the parsed one"""
+        filename = self.write("program.ngc", PROGRAM)
+        expected = loadGCode(filename)
+        loadGCode(filename, cache=True)
+        self.assertTrue(exists(cacheName(filename)))
+        cached = loadGCode(filename, cache=True)
+        self.assertEqual(describe(cached), describe(expected))
+        self.assertEqual(cached.bounds(), expected.bounds())
+
+    def test_extensions(self):
+        """Files that only differ by extension don't share a cache"""
+        mtime = 1500000000 * 10 ** 9
+        first = self.write("board.ngc", "G01 X1.0 Y2.0\n", mtime)
+        second = self.write("board.gcode", "G01 X3.0 Y4.0\n", mtime)
+        self.assertNotEqual(cacheName(first), cacheName(second))
+        loadGCode(first, cache=True)
+        loadGCode(second, cache=True)
+        self.assertEqual(loadGCode(first, cache=True).lines[0].X, 1.0)
+        self.assertEqual(loadGCode(second, cache=True).lines[0].X, 3.0)
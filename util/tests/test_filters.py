@@ -0,0 +1,258 @@
+import unittest
+
+import numpy as np
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from util.arcfix import CorrectArc
+from util.filters import FeedRate, Flip, Rotate, Scale, SwapXY, Translate, ZLevel
+from util.gcode import Filter, FilterChain, GCode, iterGCode, loadGCode
+from util.kernel import KERNEL_CACHE, KERNELS
+from util.tests.test_load import PROGRAM, describe
+
+
+class DoubleFeed(Filter):
+    """ Modifies the command it is given like filters written before 'pure'
+    """
+
+    def apply(self, command):
+        if command.F is not None:
+            command.F = command.F * 2.0
+        return command
+
+
+class Repeat(Filter):
+    """ Replaces every move with two copies of it
+    """
+
+    pure = True
+
+    def apply(self, command):
+        if command.command in ("G00", "G01"):
+            return (command, command.clone())
+        return command
+
+
+def chains():
+    """ Generate new instances of the filter chains to compare
+    """
+    return [
+        (ZLevel(cut=-0.3, safe=3.0),),
+        (FeedRate(cutting=250.0, drilling=50.0),),
+        (Translate(5.0, -2.5, 0.1), Rotate(30.0)),
+        (Flip(xflip=10.0), Scale(2.0), SwapXY()),
+        (CorrectArc(), Rotate(-90.0), ZLevel(cut=-0.2), FeedRate(cutting=300.0)),
+        (Translate(1.0, 1.0), Repeat(), ZLevel(cut=-0.5)),
+    ]
+
+
+def program(columnar=False, copies=1):
+    gcode = GCode(columnar=columnar)
+    for line in (PROGRAM * copies).split("\n"):
+        gcode.parse(line)
+    return gcode
+
+
+class TestFilters(unittest.TestCase):
+
+    def test_impure(self):
+        """Filters that modify the command don't change the source program"""
+        for columnar in (False, True):
+            source = program(columnar)
+            expected = describe(source)
+            result = source.clone(DoubleFeed())
+            self.assertEqual(describe(source), expected)
+            self.assertEqual([cmd.F for cmd in result.lines],
+                             [None if cmd.F is None else cmd.F * 2.0 for cmd in source.lines])
+            if not columnar:
+                for a, b in zip(source.lines, result.lines):
+                    self.assertIsNot(a, b)
+
+    def test_pure(self):
+        """Commands pure filters don't change are shared with the clone"""
+        source = program()
+        result = source.clone(FeedRate(cutting=100.0))
+        for a, b in zip(source.lines, result.lines):
+            if a.F == b.F:
+                self.assertIs(a, b)
+            else:
+                self.assertIsNot(a, b)
+        self.assertTrue(FeedRate().pure)
+        self.assertFalse(DoubleFeed().pure)
+
+    def assertSamePrograms(self, expected, actual):
+        expected, actual = describe(expected), describe(actual)
+        self.assertEqual(len(expected), len(actual))
+        for a, b in zip(expected, actual):
+            self.assertEqual(a[:2], b[:2])
+            for x, y in zip(a[2:], b[2:]):
+                if (x is None) or (y is None):
+                    self.assertEqual(x, y)
+                else:
+                    self.assertAlmostEqual(x, y, places=9)
+
+    def test_batch(self):
+        """Filtering a whole table gives the same results as a command at a time"""
+        for expected, batch, check in zip(chains(), chains(), chains()):
+            if FilterChain(*check).applyBatch(program(True).lines) is None:
+                continue
+            self.assertSamePrograms(program().clone(*expected), program(True).clone(*batch))
+
+    def test_stream(self):
+        """Streaming a file through a chain gives the same results as clone()"""
+        folder = mkdtemp()
+        try:
+            filename = join(folder, "program.ngc")
+            with open(filename, "w") as target:
+                target.write(PROGRAM)
+            for expected, streamed in zip(chains(), chains()):
+                result = GCode()
+                for cmd in FilterChain(*streamed).stream(iterGCode(filename)):
+                    result.append(cmd)
+                self.assertSamePrograms(loadGCode(filename).clone(*expected), result)
+        finally:
+            rmtree(folder)
+
+    def test_parallel(self):
+        """Filtering in parallel gives the same results as a single process"""
+        for columnar in (False, True):
+            for expected, parallel in zip(chains() + [(DoubleFeed(),)], chains() + [(DoubleFeed(),)]):
+                self.assertSamePrograms(program(columnar, 20).clone(*expected),
+                                        program(columnar, 20).clone(*parallel, workers=3))
+
+    def test_inplace(self):
+        """Filtering a program in place gives the same results as clone()"""
+        for columnar in (False, True):
+            for expected, inplace in zip(chains() + [(DoubleFeed(),)], chains() + [(DoubleFeed(),)]):
+                cloned = program(columnar).clone(*expected)
+                result = program(columnar)
+                result.apply(*inplace)
+                self.assertSamePrograms(cloned, result)
+                self.assertEqual(cloned.bounds(), result.bounds())
+
+    def filtered(self, chain, inplace=False):
+        """ Run a chain over a program a command at a time
+        """
+        result = GCode()
+        for cmd in program().lines:
+            response = chain.applyInPlace(cmd) if inplace else chain.apply(cmd)
+            if isinstance(response, (list, tuple)):
+                for c in response:
+                    result.append(c)
+            else:
+                result.append(response)
+        return result
+
+    def test_compiled(self):
+        """A compiled chain gives the same results as calling each filter"""
+        def extra():
+            # Parameters given as NumPy scalars
+            return [(ZLevel(cut=np.float64(-0.2), safe=np.float32(2.5)), FeedRate(cutting=np.float32(300.0))),
+                    (Translate(np.float64(1.5), 0.0, np.float64(0.25)), DoubleFeed())]
+
+        for inplace in (False, True):
+            for expected, compiled in zip(chains() + extra(), chains() + extra()):
+                self.assertSamePrograms(self.filtered(FilterChain(*expected), inplace),
+                                        self.filtered(FilterChain(*compiled).compile(), inplace))
+
+    def test_fused(self):
+        """Combining affine filters gives the same results as one at a time"""
+        def sequences():
+            return [
+                (Translate(5.0, -2.5, 0.1), Rotate(30.0)),
+                (Flip(xflip=10.0), Scale(2.0), SwapXY()),
+                (Rotate(45.0), Translate(1.0, 2.0), Flip(yflip=3.0), Rotate(-15.0)),
+                (Scale(0.5), ZLevel(cut=-0.2), SwapXY(), Translate(dz=0.5)),
+            ]
+
+        for columnar in (False, True):
+            for fused, separate in zip(sequences(), sequences()):
+                self.assertLess(len(FilterChain(*fused).filters), len(fused))
+                expected = program(columnar)
+                for f in separate:
+                    expected = expected.clone(f)
+                self.assertSamePrograms(expected, program(columnar).clone(*fused))
+
+    def test_kernel_cache(self):
+        """Only a limited number of compiled chains are kept"""
+        for index in range(KERNEL_CACHE + 10):
+            FilterChain(ZLevel(cut=-index - 1.0)).compile()
+        self.assertLessEqual(len(KERNELS), KERNEL_CACHE)
+
+
+# Arcs given with I/J (centred on the origin and on 0,2) and with R
+ARCS = (
+    "G21",
+    "G00 X1.0 Y0.0 Z1.0",
+    "G01 Z-0.1 F100",
+    "G02 X0.0 Y1.0 I-1.0 J0.0",
+    "G03 X-1.0 Y2.0 I0.0 J1.0",
+    "G02 X1.0 Y2.0 R1.0",
+    "G00 Z1.0",
+    )
+
+
+def arcs(columnar=False):
+    gcode = GCode(columnar=columnar)
+    for line in ARCS:
+        gcode.parse(line)
+    return gcode
+
+
+class TestArcs(unittest.TestCase):
+
+    # The transforms to check and whether they are reflections
+    TRANSFORMS = (
+        (lambda: Translate(2.0, -1.0), False),
+        (lambda: Scale(2.5), False),
+        (lambda: Rotate(30.0), False),
+        (lambda: SwapXY(), True),
+        (lambda: Flip(xflip=3.0), True),
+        (lambda: Flip(yflip=-1.0), True),
+        (lambda: Flip(xflip=3.0, yflip=-1.0), False),
+    )
+
+    def check(self, transform, reflection, source, result):
+        """ Make sure each arc in 'result' is 'transform' applied to 'source'
+        """
+        before, after = source.state(), result.state()
+        scale = transform.scale
+        for row, (a, b) in enumerate(zip(source.lines, result.lines)):
+            if a.command not in ("G02", "G03"):
+                continue
+            # The end points move with the path
+            x, y = transform.transform(before.x[row], before.y[row])
+            self.assertAlmostEqual(after.x[row], x)
+            self.assertAlmostEqual(after.y[row], y)
+            # The direction only changes for a reflection
+            if reflection:
+                self.assertNotEqual(a.command, b.command)
+            else:
+                self.assertEqual(a.command, b.command)
+            if a.R is not None:
+                self.assertAlmostEqual(b.R, a.R * scale)
+                continue
+            # The centre moves with the path
+            cx, cy = transform.transform(before.x0[row] + a.I, before.y0[row] + a.J)
+            self.assertAlmostEqual(after.x0[row] + b.I, cx)
+            self.assertAlmostEqual(after.y0[row] + b.J, cy)
+
+    def test_commands(self):
+        """Arcs keep their geometry when filtered a command at a time"""
+        for create, reflection in self.TRANSFORMS:
+            self.check(create(), reflection, arcs(), arcs().clone(create()))
+
+    def test_batch(self):
+        """Arcs keep their geometry when a whole table is filtered"""
+        for create, reflection in self.TRANSFORMS:
+            self.check(create(), reflection, arcs(True), arcs(True).clone(create()))
+
+    def test_compiled(self):
+        """Arcs keep their geometry in a compiled chain"""
+        for create, reflection in self.TRANSFORMS:
+            chain = FilterChain(create()).compile()
+            result = GCode()
+            for cmd in arcs().lines:
+                result.append(chain.apply(cmd))
+            self.check(create(), reflection, arcs(), result)
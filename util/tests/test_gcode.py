@@ -0,0 +1,67 @@
+import unittest
+
+from util.gcode import GCode
+from util.filters import Translate
+
+
+def build(lines, columnar=False):
+    gcode = GCode(columnar=columnar)
+    for line in lines:
+        gcode.append(line)
+    return gcode
+
+
+def recomputed(gcode):
+    """ Calculate the bounds of a program from scratch
+    """
+    return build([str(cmd) for cmd in gcode.lines]).bounds()
+
+
+class TestBounds(unittest.TestCase):
+
+    def test_append(self):
+        """Appending a command invalidates the cached bounds"""
+        for columnar in (False, True):
+            gcode = build(["G00 Z1.0", "G01 X1.0 Y2.0"], columnar)
+            self.assertEqual(gcode.bounds(), (1.0, 1.0, 2.0, 2.0, 1.0, 1.0))
+            gcode.append("G01 X-3.0 Y5.0 Z-0.5")
+            self.assertEqual(gcode.bounds(), (-3.0, 1.0, 2.0, 5.0, -0.5, 1.0))
+            self.assertEqual((gcode.minx, gcode.maxy, gcode.minz), (-3.0, 5.0, -0.5))
+
+    def test_empty(self):
+        """Axes without any values have no bounds"""
+        gcode = build(["M03", "G01 X1.0 Y1.0"])
+        self.assertEqual(gcode.bounds()[4:], (None, None))
+        self.assertEqual(GCode().bounds(), (None,) * 6)
+
+    def test_merge(self):
+        """Appending a program merges the bounds the same as a full recompute"""
+        for columnar in (False, True):
+            for other in (False, True):
+                first = build(["G00 X0.0 Y0.0 Z1.0", "G01 X2.0 Y3.0"], columnar)
+                second = build(["G01 X-1.0 Y7.0 Z-0.2", "G01 X4.0", "G01 Y-2.0"], other)
+                first.bounds()
+                second.bounds()
+                first.append(second)
+                self.assertEqual(first.bounds(), recomputed(first))
+                self.assertEqual(first.bounds(), (-1.0, 4.0, -2.0, 7.0, -0.2, 1.0))
+
+    def test_clone(self):
+        """Clones without filters keep the bounds"""
+        gcode = build(["G01 X1.0 Y2.0 Z-0.1", "G01 X5.0 Y-2.0"])
+        self.assertEqual(gcode.clone().bounds(), gcode.bounds())
+
+
+class TestClone(unittest.TestCase):
+
+    def test_independent(self):
+        """Changing a clone in place leaves the original alone"""
+        for columnar in (False, True):
+            gcode = build(["G00 Z1.0", "G01 X1.0 Y2.0", "G01 X3.0 Y-1.0 Z-0.1"], columnar)
+            before = [str(cmd) for cmd in gcode.lines]
+            bounds = gcode.bounds()
+            copy = gcode.clone()
+            copy.apply(Translate(5.0, 5.0))
+            self.assertEqual([str(cmd) for cmd in gcode.lines], before)
+            self.assertEqual(gcode.bounds(), bounds)
+            self.assertEqual(copy.bounds()[:4], (6.0, 8.0, 4.0, 7.0))
@@ -0,0 +1,106 @@
+import unittest
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from util.command import PARAMS, GCommand
+from util.gcode import Loader, loadGCode
+from util.loaders import BoxedLoader
+
+# A program that switches units and leaves out axis values
+PROGRAM = """G21 (Use mm)
+G00 Z5.0
+G00 X1.0 Y2.0
+G01 Z-0.1 F100
+G01 X3.5
+G01 Y4.25 F200
+(isolation region 0)
+G00 Z5.0
+G20 (Use Inches)
+G00 X0.5 Y0.25
+G01 Z-0.005 F5
+G02 X1.0 Y0.25 I0.25 J0.0 F8
+G01 Y1.5
+G00 Z0.1
+G21 (Use mm)
+G00 X10.0 Y10.0
+G01 Z-0.2 F150
+G03 X12.0 Y10.0 I1.0 J0.0
+G00 Z5.0
+M05
+"""
+
+
+def describe(gcode):
+    """ Describe the commands in a program for comparison
+    """
+    return [[cmd.command, cmd.comment] + [getattr(cmd, p) for p in PARAMS] for cmd in gcode.lines]
+
+
+class CommentLoader(Loader):
+    """ A loader that does its own parsing and drops comment only lines
+    """
+
+    def parse(self, line):
+        if line.strip().startswith("("):
+            return None
+        return Loader.parse(self, line)
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.filename = join(self.folder, "program.ngc")
+        with open(self.filename, "w") as target:
+            # Repeat it so each worker gets several unit changes
+            target.write(PROGRAM * 20)
+
+    def tearDown(self):
+        rmtree(self.folder)
+
+    def assertSameResults(self, expected, actual):
+        if not isinstance(expected, list):
+            expected, actual = [expected], [actual]
+        self.assertEqual(len(expected), len(actual))
+        for a, b in zip(expected, actual):
+            self.assertEqual(describe(a), describe(b))
+            self.assertEqual(a.units, b.units)
+            self.assertEqual(a.bounds(), b.bounds())
+
+    def test_parallel(self):
+        """Parsing in parallel gives the same program as parsing sequentially"""
+        expected = loadGCode(self.filename)
+        for workers in (2, 3, 7):
+            self.assertSameResults(expected, loadGCode(self.filename, workers=workers))
+
+    def test_units(self):
+        """Commands after G20 are converted to mm"""
+        gcode = loadGCode(self.filename, workers=3)
+        self.assertEqual(gcode.lines[9].X, 0.5 * 25.4)
+        self.assertEqual(gcode.lines[8].command, "G21")
+        self.assertEqual(gcode.lines[8].comment, "(use mm)")
+        self.assertEqual(gcode.lines[15].X, 10.0)
+
+    def test_columnar(self):
+        """Columnar storage gives the same program as a list of commands"""
+        self.assertSameResults(loadGCode(self.filename), loadGCode(self.filename, columnar=True))
+
+    def test_loaders(self):
+        """Loaders select the same commands in parallel"""
+        def loaders():
+            return (BoxedLoader(end=GCommand("G20")),
+                    BoxedLoader(start=GCommand("G20"), end=GCommand("G21"), inclusive=True),
+                    BoxedLoader(start="(isolation region 0)"))
+
+        expected = loadGCode(self.filename, *loaders())
+        self.assertSameResults(expected, loadGCode(self.filename, *loaders(), columnar=True))
+        self.assertSameResults(expected, loadGCode(self.filename, *loaders(), workers=3))
+
+    def test_parse_override(self):
+        """Loaders that override parse() and call the base class still work"""
+        expected = [cmd for cmd in describe(loadGCode(self.filename)) if cmd[0] != ""]
+        self.assertEqual(describe(loadGCode(self.filename, CommentLoader())), expected)
+        self.assertEqual(describe(loadGCode(self.filename, CommentLoader(), workers=3)), expected)
+        self.assertIsNone(CommentLoader().parse("(a comment)"))
+        self.assertEqual(CommentLoader().parse("G01 X1.5").X, 1.5)
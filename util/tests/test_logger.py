@@ -0,0 +1,95 @@
+import gc
+import io
+import json
+import unittest
+
+from util import logger
+from util.logger import Logger
+
+
+class Counted:
+    """ Counts the number of times it is converted to a string
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count = self.count + 1
+        return "counted"
+
+
+class TestLogger(unittest.TestCase):
+
+    def test_lazy(self):
+        """Arguments are only formatted when the message is written"""
+        output = io.StringIO()
+        log = Logger(Logger.MSG_WARN, output)
+        value = Counted()
+        log.INFO("Value %s", value)
+        self.assertEqual(value.count, 0)
+        self.assertEqual(output.getvalue(), "")
+        log.WARN("Value %s (%d)", value, 3)
+        self.assertEqual(value.count, 1)
+        self.assertEqual(output.getvalue(), "WARN: Value counted (3)\n")
+        # Messages without arguments are written as is
+        log.ERROR("100% done")
+        self.assertEqual(output.getvalue().splitlines()[-1], "ERROR: 100% done")
+
+    def test_enabled(self):
+        """isEnabled() follows the severity"""
+        log = Logger(Logger.MSG_INFO, io.StringIO())
+        self.assertFalse(log.isEnabled(Logger.MSG_DEBUG))
+        self.assertTrue(log.isEnabled(Logger.MSG_INFO))
+        self.assertTrue(log.isEnabled(Logger.MSG_FATAL))
+        log.severity = 10
+        self.assertEqual(log.severity, Logger.MSG_FATAL)
+        self.assertFalse(log.isEnabled(Logger.MSG_ERROR))
+        log.severity = -1
+        self.assertTrue(log.isEnabled(Logger.MSG_DEBUG))
+
+    def test_buffered(self):
+        """Buffered messages are held until flushed or the buffer fills"""
+        output = io.StringIO()
+        log = Logger(output=output, buffered=True)
+        log.INFO("first")
+        log.DEBUG("second %d", 2)
+        self.assertEqual(output.getvalue(), "")
+        self.assertIn(log, logger._PENDING)
+        log.flush()
+        self.assertEqual(output.getvalue(), "INFO: first\nDEBUG: second 2\n")
+        self.assertNotIn(log, logger._PENDING)
+        # A full buffer is written straight away
+        for index in range(Logger.BUFFER):
+            log.INFO("line %d", index)
+        self.assertEqual(len(output.getvalue().splitlines()), Logger.BUFFER + 2)
+        # Releasing the logger writes what is left and doesn't keep it alive
+        log.INFO("last")
+        del log
+        gc.collect()
+        self.assertEqual(output.getvalue().splitlines()[-1], "INFO: last")
+        self.assertEqual(len(logger._PENDING), 0)
+
+    def test_flush_all(self):
+        """Every logger with buffered messages is flushed at exit"""
+        outputs = [io.StringIO() for index in range(3)]
+        loggers = [Logger(output=output, buffered=True) for output in outputs]
+        for index, log in enumerate(loggers):
+            log.WARN("logger %d", index)
+        logger._flushAll()
+        for index, output in enumerate(outputs):
+            self.assertEqual(output.getvalue(), "WARN: logger %d\n" % index)
+
+    def test_structured(self):
+        """Structured messages are written as one JSON object per line"""
+        output = io.StringIO()
+        log = Logger(output=output, structured=True)
+        log.INFO("value %s", "one")
+        log.WARN("two")
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([line["severity"] for line in lines], ["INFO", "WARN"])
+        self.assertEqual([line["message"] for line in lines], ["value one", "two"])
+        for line in lines:
+            self.assertEqual(set(line.keys()), {"time", "elapsed", "severity", "message"})
+            self.assertGreaterEqual(line["elapsed"], 0.0)
+        self.assertLessEqual(lines[0]["elapsed"], lines[1]["elapsed"])
@@ -0,0 +1,402 @@
+import sys
+import unittest
+from os.path import dirname, join, realpath
+from random import Random
+from time import perf_counter
+from unittest import mock
+
+import numpy as np
+
+from util.gcode import GCode, loadGCode
+from util.logger import LOG, Logger
+from util.optimise import Arc, Chain, Line, Loop, Point, _Tour, _orOpt, _twoOpt, airTravel, chainMovements, \
+    closestOrder, clusterOrder, clusters, distance, improveOrder, multiStartOrder, optimise, planTravel
+
+# The sample isolation program
+SAMPLE = join(dirname(dirname(dirname(realpath(__file__)))), "samples", "benchmark.ngc")
+
+# A path that moves to a second cut without lifting the tool
+GAP = """G21
+G00 Z1.0
+G00 X0.0 Y0.0
+G01 Z-0.1 F50
+G01 X5.0 Y0.0 F100
+G00 X5.1 Y0.0
+G01 X10.0 Y0.0 F100
+G00 Z1.0
+G00 X10.1 Y0.0
+G01 Z-0.1 F50
+G01 X10.1 Y5.0 F100
+G00 Z1.0
+"""
+
+
+def linearOrder(movements, x=0.0, y=0.0):
+    """ The original ordering, a linear search for the closest movement
+    """
+    movements = list(movements)
+    ordered = list()
+    while len(movements) > 0:
+        best = None
+        for index, item in enumerate(movements):
+            d = item.distanceFrom(x, y)
+            if (best is None) or (d < best[0]):
+                best = (d, index)
+        current = movements.pop(best[1])
+        if distance(current.x, current.y, x, y) > best[0]:
+            current.reverse()
+        ordered.append(current)
+        x, y = current.finish()
+    return ordered
+
+
+def scattered(count, seed=1, spread=6):
+    """ Points, lines and arcs on a small integer grid so many are the same
+        distance apart (or on top of each other)
+    """
+    rng = Random(seed)
+    position = lambda: (float(rng.randint(0, spread)), float(rng.randint(0, spread)))
+    movements = list()
+    for index in range(count):
+        kind = rng.randint(0, 4)
+        (x, y), (tx, ty) = position(), position()
+        if kind == 0:
+            movements.append(Point(x, y))
+        elif kind == 1:
+            movements.append(Arc(x, y, tx, ty, (tx - x) / 2.0, (ty - y) / 2.0, "G02"))
+        else:
+            movements.append(Line(x, y, tx, ty))
+    return movements
+
+
+def describe(movements):
+    """ The type, start and finish of each movement in order
+    """
+    return [(type(m).__name__, m.x, m.y) + m.finish() + (getattr(m, "cmd", None), ) for m in movements]
+
+
+def segments(movements):
+    """ The cuts made by a list of movements (in either direction)
+    """
+    return sorted([tuple(sorted(((m.x, m.y), m.finish()))) for m in movements])
+
+
+def tourTravel(tour):
+    """ The air travel for the current order of a _Tour
+    """
+    return sum([tour.gap(index - 1, index) for index in range(len(tour.order))])
+
+
+def drill(holes, line=False):
+    """ A drilling program for a row of holes (and optionally one line)
+    """
+    gcode = GCode()
+    gcode.parse("G00 Z1.0")
+    for index in range(holes):
+        for cmd in ("G00 X%0.1f Y%0.1f" % ((index * 7) % 13, index), "G01 Z-0.5 F50", "G00 Z1.0"):
+            gcode.parse(cmd)
+    if line:
+        for cmd in ("G00 X0.0 Y-5.0", "G01 Z-0.1 F50", "G01 X5.0 Y-5.0 F100", "G00 Z1.0"):
+            gcode.parse(cmd)
+    return gcode
+
+
+def plunges(gcode):
+    """ Get the (x, y) of every insertion below the surface
+    """
+    state = gcode.state()
+    below = (state.z0 >= 0.0) & (state.z < 0.0)
+    return sorted(zip(state.x[below].tolist(), state.y[below].tolist()))
+
+
+def cuts(gcode):
+    """ Get the (x0, y0, x1, y1) of every move made below the surface
+    """
+    state = gcode.state()
+    below = (state.z0 < 0.0) & (state.z < 0.0) & ((state.x0 != state.x) | (state.y0 != state.y))
+    return np.column_stack((state.x0, state.y0, state.x, state.y))[below]
+
+
+class TestOptimise(unittest.TestCase):
+
+    def setUp(self):
+        self.severity = LOG.severity
+        LOG.severity = Logger.MSG_ERROR
+
+    def tearDown(self):
+        LOG.severity = self.severity
+
+    def assertNoNewCuts(self, source, optimised):
+        original = cuts(source)
+        # Either direction is the same cut
+        original = np.concatenate((original, original[:, (2, 3, 0, 1)]))
+        for cut in cuts(optimised):
+            difference = np.abs(original - cut).max(axis=1).min()
+            self.assertLess(difference, 0.001, "Cut %s is not in the original" % cut)
+
+    def test_stay_down(self):
+        """Staying down never cuts anywhere the original didn't"""
+        source = loadGCode(SAMPLE)
+        for settings in (dict(), dict(stayDown=0.2, hop=0.05), dict(stayDown=1.0)):
+            self.assertNoNewCuts(source, optimise(source, **settings))
+
+    def test_hilbert(self):
+        """Drilling programs switch to the Hilbert order at HILBERT_POINTS holes"""
+        module = sys.modules["util.optimise"]
+        for holes, line, expected in ((9, False, False), (10, False, True), (30, False, True), (30, True, False)):
+            with mock.patch.object(module, "HILBERT_POINTS", 10), \
+                    mock.patch.object(module, "hilbertOrder", wraps=module.hilbertOrder) as hilbert:
+                source = drill(holes, line)
+                optimised = optimise(source)
+            self.assertEqual(hilbert.called, expected)
+            # Every hole is still drilled (the line may be cut either way)
+            self.assertEqual(len(plunges(optimised)), len(plunges(source)))
+            if not line:
+                self.assertEqual(plunges(optimised), plunges(source))
+
+    def retractions(self, gcode):
+        """ The heights retracted to between the cuts (not the final one)
+        """
+        return [cmd.Z for cmd in gcode.lines if (cmd.command == "G00") and (cmd.Z is not None)][:-1]
+
+    def test_hop(self):
+        """Short moves retract to the hop height whatever their region"""
+        def movements():
+            lines = [Line(0.0, 0.0, 1.0, 0.0), Line(3.0, 0.0, 4.0, 0.0), Line(20.0, 0.0, 21.0, 0.0),
+                     Line(23.0, 0.0, 24.0, 0.0)]
+            for region, line in zip((1, 1, 2, 3), lines):
+                line.region = region
+            return lines
+
+        gcode, nair, saved = planTravel(movements(), -0.1, 2.0, 50.0, 100.0)
+        self.assertEqual(self.retractions(gcode), [2.0, 2.0, 2.0])
+        self.assertEqual(saved, 0.0)
+        gcode, hopped, saved = planTravel(movements(), -0.1, 2.0, 50.0, 100.0, hop=0.5, hopDistance=5.0)
+        self.assertEqual(self.retractions(gcode), [0.5, 2.0, 0.5])
+        self.assertEqual(hopped, nair)
+        self.assertGreater(saved, 0.0)
+        # Every move is short enough with a longer distance
+        gcode, _, _ = planTravel(movements(), -0.1, 2.0, 50.0, 100.0, hop=0.5, hopDistance=20.0)
+        self.assertEqual(self.retractions(gcode), [0.5, 0.5, 0.5])
+
+    def test_hop_height(self):
+        """Hop heights outside the surface and safe height are ignored"""
+        source = GCode()
+        for line in GAP.split("\n"):
+            source.parse(line)
+        expected = [str(cmd) for cmd in optimise(source).lines]
+        for hop in (0.0, -0.1, 1.0, 2.0):
+            self.assertEqual([str(cmd) for cmd in optimise(source, hop=hop).lines], expected)
+        hopped = optimise(source, hop=0.5)
+        self.assertNotEqual([str(cmd) for cmd in hopped.lines], expected)
+        self.assertNoNewCuts(source, hopped)
+
+    def test_cluster_switch(self):
+        """Large programs are ordered by cluster and keep every cut"""
+        module = sys.modules["util.optimise"]
+        source = loadGCode(SAMPLE)
+        with mock.patch.object(module, "CLUSTER_MOVEMENTS", 50), \
+                mock.patch.object(module, "clusterOrder", wraps=module.clusterOrder) as clustered:
+            optimised = optimise(source)
+        self.assertTrue(clustered.called)
+        self.assertEqual(len(cuts(optimised)), len(cuts(source)))
+        self.assertNoNewCuts(source, optimised)
+
+    def test_same_path(self):
+        """Gaps are only crossed without lifting within the same insertion"""
+        source = GCode()
+        for line in GAP.split("\n"):
+            source.parse(line)
+        optimised = optimise(source, stayDown=0.2)
+        self.assertNoNewCuts(source, optimised)
+        # The gap in the first path is crossed, the nearby second path is not
+        self.assertEqual(len([cmd for cmd in optimised.lines if cmd.Z == -0.1]), 2)
+
+
+class TestOrder(unittest.TestCase):
+
+    def test_closest(self):
+        """The spatial index picks the same order as a linear search"""
+        for seed in range(5):
+            for spread in (3, 6, 50):
+                for start in ((0.0, 0.0), (2.0, 3.0), (2.5, 2.5)):
+                    expected = linearOrder(scattered(150, seed, spread), *start)
+                    actual = closestOrder(scattered(150, seed, spread), *start)
+                    self.assertEqual(describe(expected), describe(actual))
+
+    def test_multi_start(self):
+        """The best of several starts only depends on the seed"""
+        for seed in (0, 3):
+            expected = describe(multiStartOrder(scattered(200, seed, 50), 5.0, 5.0, 6, seed))
+            for workers in (None, 1, 2, 3):
+                actual = multiStartOrder(scattered(200, seed, 50), 5.0, 5.0, 6, seed, workers)
+                self.assertEqual(describe(actual), expected)
+        # It is never worse than starting from the tool position
+        movements = closestOrder(scattered(200, 1, 50), 5.0, 5.0)
+        best = multiStartOrder(scattered(200, 1, 50), 5.0, 5.0, 6, 1, 2)
+        self.assertLessEqual(airTravel(best, 5.0, 5.0), airTravel(movements, 5.0, 5.0))
+
+    def test_clusters(self):
+        """Every movement is in exactly one cluster"""
+        movements = scattered(2000, 2, 100)
+        groups = clusters(movements, 50)
+        self.assertGreater(len(groups), 10)
+        members = [id(m) for centroid, group in groups for m in group]
+        self.assertEqual(sorted(members), sorted([id(m) for m in movements]))
+        for (cx, cy), group in groups:
+            self.assertAlmostEqual(cx, sum([m.x for m in group]) / len(group))
+            self.assertAlmostEqual(cy, sum([m.y for m in group]) / len(group))
+        self.assertEqual(len(clusters(movements)), 1)
+
+    def test_cluster_order(self):
+        """Ordering by cluster keeps every movement and each cluster together"""
+        movements = scattered(2000, 2, 100)
+        cluster = dict()
+        for number, (centroid, group) in enumerate(clusters(movements, 50)):
+            for m in group:
+                cluster[id(m)] = number
+        expected = segments(movements)
+        ordered = clusterOrder(movements, 10.0, 10.0, 50)
+        self.assertEqual(len(ordered), len(movements))
+        self.assertEqual(sorted([id(m) for m in ordered]), sorted([id(m) for m in movements]))
+        self.assertEqual(segments(ordered), expected)
+        # Once the order leaves a cluster it never comes back
+        visited = [cluster[id(ordered[0])]]
+        for m in ordered[1:]:
+            if cluster[id(m)] != visited[-1]:
+                self.assertNotIn(cluster[id(m)], visited)
+                visited.append(cluster[id(m)])
+        self.assertEqual(len(visited), len(clusters(scattered(2000, 2, 100), 50)))
+        # The same order in parallel
+        parallel = clusterOrder(scattered(2000, 2, 100), 10.0, 10.0, 50, workers=2)
+        self.assertEqual(describe(parallel), describe(ordered))
+
+    def test_moves(self):
+        """Each 2-opt and Or-opt move reduces the air travel"""
+        for seed in range(3):
+            movements = scattered(120, seed, 50)
+            tour = _Tour(movements, 0.0, 0.0)
+            keys = list(range(len(movements)))
+            before = tourTravel(tour)
+            self.assertAlmostEqual(before, airTravel(movements))
+            moves = 0
+            for index in range(-1, len(movements) - 1):
+                candidates = Random(index).sample(keys, 8)
+                if _twoOpt(tour, index, candidates):
+                    moves = moves + 1
+                    after = tourTravel(tour)
+                    self.assertLess(after, before)
+                    before = after
+                for count in (1, 2, 3):
+                    if (index + count < len(movements)) and _orOpt(tour, index + 1, count, candidates):
+                        moves = moves + 1
+                        after = tourTravel(tour)
+                        self.assertLess(after, before)
+                        before = after
+                self.assertEqual(sorted(tour.order), keys)
+            self.assertGreater(moves, 0)
+
+    def test_improve(self):
+        """Improving an order keeps every cut and never adds air travel"""
+        for seed in range(3):
+            for x, y in ((0.0, 0.0), (25.0, 25.0)):
+                movements = closestOrder(scattered(300, seed, 50), x, y)
+                expected, before = segments(movements), airTravel(movements, x, y)
+                improved = improveOrder(movements, x, y, budget=10.0)
+                self.assertEqual(len(improved), len(movements))
+                self.assertEqual(segments(improved), expected)
+                self.assertLessEqual(airTravel(improved, x, y), before)
+                # Arcs still turn around the same centre after being reversed
+                for m in improved:
+                    if isinstance(m, Arc):
+                        self.assertAlmostEqual(distance(m.x, m.y, m.cx, m.cy), distance(m.tx, m.ty, m.cx, m.cy))
+
+    def test_budget(self):
+        """Improving stops when the time budget runs out"""
+        movements = scattered(20000, 1, 1000)
+        started = perf_counter()
+        improved = improveOrder(movements, budget=0.2)
+        self.assertLess(perf_counter() - started, 2.0)
+        self.assertEqual(len(improved), len(movements))
+        started = perf_counter()
+        improveOrder(scattered(100, 1, 50), budget=0.0)
+        self.assertLess(perf_counter() - started, 0.5)
+
+
+def pieces():
+    """ A square loop, an open path with an arc and a hole given out of order
+        and with some of the segments reversed
+    """
+    return [
+        Line(0.0, 0.0, 10.0, 0.0),
+        Line(20.0, 0.0, 21.0, 0.0),
+        Line(10.0, 10.0, 10.0, 0.0),
+        Point(50.0, 50.0),
+        Arc(23.0, 0.0, 21.0, 0.0, -1.0, 0.0, "G03"),
+        Line(0.0, 10.0, 10.0, 10.0),
+        Line(23.0, 0.0, 23.0, 5.0),
+        Line(0.0, 10.0, 0.0, 0.0005),
+    ]
+
+
+def flatten(movement):
+    """ The lines and arcs that make up a movement
+    """
+    if isinstance(movement, Chain):
+        return movement.movements
+    return [movement]
+
+
+class TestChains(unittest.TestCase):
+
+    def assertJoined(self, chain):
+        """ Check the movements in a chain follow on from each other
+        """
+        for a, b in zip(chain.movements, chain.movements[1:]):
+            self.assertLessEqual(distance(*(a.finish() + (b.x, b.y))), 0.001)
+        self.assertEqual((chain.x, chain.y), (chain.movements[0].x, chain.movements[0].y))
+        self.assertEqual(chain.finish(), chain.movements[-1].finish())
+
+    def test_chains(self):
+        """Movements that join up become a Chain or a Loop with every segment"""
+        source = pieces()
+        expected = segments([m for m in source if isinstance(m, Line)])
+        chained = chainMovements(source)
+        self.assertEqual(sorted([type(m).__name__ for m in chained]), ["Chain", "Loop", "Point"])
+        self.assertEqual(segments([s for m in chained if isinstance(m, Line) for s in flatten(m)]), expected)
+        for movement in chained:
+            if isinstance(movement, Chain):
+                self.assertJoined(movement)
+        # The loop isn't closed if the gap is bigger than the tolerance
+        chained = chainMovements(pieces(), 0.0001)
+        self.assertEqual(sorted([type(m).__name__ for m in chained]), ["Chain", "Chain", "Point"])
+
+    def test_loop(self):
+        """A loop can be entered at any of its vertices"""
+        loop = [m for m in chainMovements(pieces()) if isinstance(m, Loop)][0]
+        expected = segments(loop.movements)
+        for index in range(len(loop.movements)):
+            # Entry points are relative to where the loop currently starts
+            px, py = loop.ends()[index]
+            loop.enter(index)
+            self.assertEqual((loop.x, loop.y), (px, py))
+            self.assertLessEqual(distance(*(loop.finish() + (px, py))), 0.001)
+            self.assertJoined(loop)
+            self.assertEqual(segments(loop.movements), expected)
+
+    def test_reverse(self):
+        """Reversing a chain cuts the same path the other way"""
+        for movement in chainMovements(pieces()):
+            if not isinstance(movement, Chain):
+                continue
+            arcs = [(m.cx, m.cy, m.cmd) for m in movement.movements if isinstance(m, Arc)]
+            start, finish = (movement.x, movement.y), movement.finish()
+            expected = segments(movement.movements)
+            movement.reverse()
+            self.assertEqual(((movement.x, movement.y), movement.finish()), (finish, start))
+            self.assertJoined(movement)
+            self.assertEqual(segments(movement.movements), expected)
+            # Arcs keep their centre and change direction
+            reversed = [(m.cx, m.cy, m.cmd) for m in movement.movements if isinstance(m, Arc)]
+            self.assertEqual([(cx, cy) for cx, cy, cmd in reversed], [(cx, cy) for cx, cy, cmd in arcs[::-1]])
+            self.assertEqual([cmd for cx, cy, cmd in reversed], ["G02" if cmd == "G03" else "G03" for cx, cy, cmd in arcs[::-1]])
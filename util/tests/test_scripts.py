@@ -0,0 +1,55 @@
+import subprocess
+import sys
+import unittest
+from os.path import dirname, join, realpath
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from util.filters import Rotate, Scale, ZLevel
+from util.gcode import loadGCode, saveGCode
+from util.tests.test_load import PROGRAM
+
+# Folder holding the command line tools
+TOOLS = dirname(dirname(dirname(realpath(__file__))))
+
+
+class TestScripts(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.source = join(self.folder, "program.ngc")
+        with open(self.source, "w") as target:
+            target.write(PROGRAM)
+
+    def tearDown(self):
+        rmtree(self.folder)
+
+    def runTool(self, tool, *args):
+        """ Run one of the tools and return the text it wrote
+        """
+        output = join(self.folder, "output.ngc")
+        subprocess.run([sys.executable, join(TOOLS, tool)] + list(args) + ["-o", output, self.source],
+                       cwd=TOOLS, check=True, capture_output=True)
+        with open(output, "r") as result:
+            return result.read()
+
+    def expected(self, *filters):
+        """ Load, clone and save the program with the given filters
+        """
+        output = join(self.folder, "expected.ngc")
+        saveGCode(output, loadGCode(self.source).clone(*filters))
+        with open(output, "r") as result:
+            return result.read()
+
+    def test_zlevel(self):
+        """zlevel.py streams the same output as loading the whole file"""
+        self.assertEqual(self.runTool("zlevel.py", "-c", "-0.3", "-s", "2.0"),
+                         self.expected(ZLevel(cut=-0.3, safe=2.0)))
+
+    def test_rotate(self):
+        """rotate.py streams the same output as loading the whole file"""
+        self.assertEqual(self.runTool("rotate.py", "-a", "30"), self.expected(Rotate(30.0)))
+
+    def test_scale(self):
+        """scale.py streams the same output as loading the whole file"""
+        self.assertEqual(self.runTool("scale.py", "-s", "1.5"), self.expected(Scale(1.5)))
@@ -0,0 +1,33 @@
+import unittest
+
+import numpy as np
+
+from util.spatial import hilbertIndex
+
+
+class TestHilbert(unittest.TestCase):
+
+    def test_bijection(self):
+        """Every cell of a full grid has its own position along the curve"""
+        for bits in (1, 2, 3, 4):
+            side = 1 << bits
+            xs, ys = np.meshgrid(np.arange(side), np.arange(side))
+            xs, ys = xs.ravel(), ys.ravel()
+            index = hilbertIndex(xs, ys, bits)
+            self.assertEqual(sorted(index.tolist()), list(range(side * side)))
+            # Each step along the curve moves to a neighbouring cell
+            order = np.argsort(index)
+            steps = np.abs(np.diff(xs[order])) + np.abs(np.diff(ys[order]))
+            self.assertTrue((steps == 1).all())
+            # From the lower left corner to the lower right
+            self.assertEqual((xs[order[0]], ys[order[0]]), (0, 0))
+            self.assertEqual((xs[order[-1]], ys[order[-1]]), (side - 1, 0))
+
+    def test_scaled(self):
+        """Points are scaled to the grid so only their layout matters"""
+        xs, ys = np.array([0.0, 0.0, 1.0, 1.0]), np.array([0.0, 1.0, 1.0, 0.0])
+        expected = hilbertIndex(xs, ys, 1).tolist()
+        self.assertEqual(sorted(expected), [0, 1, 2, 3])
+        self.assertEqual(hilbertIndex(xs * 25.0 - 3.0, ys * 25.0 + 7.0, 1).tolist(), expected)
+        self.assertEqual(hilbertIndex([], []).tolist(), [])
+        self.assertEqual(hilbertIndex([2.0, 2.0], [1.0, 1.0]).tolist(), [0, 0])
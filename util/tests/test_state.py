@@ -0,0 +1,88 @@
+import unittest
+
+from util.gcode import GCode
+from util.filters import Translate
+from util.state import MachineState, Position, MOTION, UNITS
+
+PROGRAM = (
+    "G21",
+    "G00 Z2.0",
+    "G00 X1.0 Y1.0",
+    "G01 Z-0.1 F100",
+    "G01 X3.0",
+    "G02 X5.0 Y1.0 I1.0 J0.0 F200",
+    "G20",
+    "G03 X3.0 Y1.0 I-1.0 J0.0",
+    "G00 Z2.0",
+    )
+
+
+def build(columnar=False, lines=PROGRAM):
+    gcode = GCode(columnar=columnar)
+    for line in lines:
+        gcode.append(line)
+    return gcode
+
+
+class TestState(unittest.TestCase):
+
+    def test_motion(self):
+        """Motion modes carry forward until the next one is set"""
+        for columnar in (False, True):
+            state = build(columnar).state()
+            modes = [MOTION[m] if m >= 0 else None for m in state.motion]
+            self.assertEqual(modes, [None, "G00", "G00", "G01", "G01", "G02", "G02", "G03", "G00"])
+
+    def test_feed(self):
+        """Feed rates are NaN until set and then carried forward"""
+        for columnar in (False, True):
+            state = build(columnar).state()
+            feeds = [None if f != f else float(f) for f in state.feed]
+            self.assertEqual(feeds, [None, None, None, 100.0, 100.0, 200.0, 200.0, 200.0, 200.0])
+
+    def test_units(self):
+        """Unit changes apply from the command that sets them"""
+        for columnar in (False, True):
+            state = build(columnar).state()
+            units = [UNITS[u] for u in state.units]
+            self.assertEqual(units, ["G21"] * 6 + ["G20"] * 3)
+
+    def test_axes(self):
+        """Axes that are not present keep their previous value"""
+        for columnar in (False, True):
+            state = build(columnar).state()
+            self.assertEqual(list(state.x), [0.0, 0.0, 1.0, 1.0, 3.0, 5.0, 5.0, 3.0, 3.0])
+            self.assertEqual(list(state.y), [0.0, 0.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0])
+            self.assertEqual(list(state.z), [0.0, 2.0, 2.0, -0.1, -0.1, -0.1, -0.1, -0.1, 2.0])
+            # The start of each command is the end of the previous one
+            self.assertEqual(list(state.x0[1:]), list(state.x[:-1]))
+            self.assertEqual(list(state.z0[1:]), list(state.z[:-1]))
+            self.assertEqual((state.x0[0], state.y0[0], state.z0[0]), (0.0, 0.0, 0.0))
+            final = state.final()
+            self.assertEqual((final.x, final.y, final.z), (3.0, 1.0, 2.0))
+
+    def test_origin(self):
+        """Axes are carried from the origin when one is given"""
+        state = MachineState(build().lines, Position(1.0, 2.0, 3.0))
+        self.assertEqual((state.x[0], state.y[0], state.z[0]), (1.0, 2.0, 3.0))
+        self.assertEqual((state.y[2], state.z[2]), (1.0, 2.0))
+        final = MachineState([], Position(1.0, 2.0, 3.0)).final()
+        self.assertEqual((final.x, final.y, final.z), (1.0, 2.0, 3.0))
+
+    def test_cache(self):
+        """The state is cached until the program changes"""
+        for columnar in (False, True):
+            gcode = build(columnar)
+            state = gcode.state()
+            self.assertIs(gcode.state(), state)
+            gcode.append("G01 X7.0")
+            self.assertIsNot(gcode.state(), state)
+            self.assertEqual(len(gcode.state()), len(PROGRAM) + 1)
+            self.assertEqual(gcode.state().x[-1], 7.0)
+            state = gcode.state()
+            gcode.apply(Translate(1.0, 0.0))
+            self.assertIsNot(gcode.state(), state)
+            self.assertEqual(gcode.state().x[-1], 8.0)
+            state = gcode.state()
+            gcode.append(build(columnar, ["G00 X8.0 Y9.0"]))
+            self.assertEqual(gcode.state().y[-1], 9.0)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Bulk formatting of gcode for output. Rows in a CommandTable that have the
+# same command and the same parameters present share a format string so a
+# whole group of them can be formatted with a single operation. Everything
+# else is written a line at a time as before, joining them into blocks was
+# no quicker.
+# ----------------------------------------------------------------------------
+import numpy as np
+
+from util.command import PARAMS, GCommand
+from util.table import CommandTable
+
+# Number of table rows formatted and written at a time
+BLOCK = 65536
+
+# Default number of decimal places (matches GCommand.__str__)
+PRECISION = 4
+
+
+def _template(command, params, precision):
+    """ Create the format string for a command with the given parameters
+    """
+    template = command.replace("%", "%%")
+    for param in params:
+        template = "%s %s%%0.%df" % (template, param, precision)
+    return template.strip()
+
+
+def formatCommand(cmd, precision=PRECISION):
+    """ Format a single command with the given number of decimal places
+
+      With the default precision this is the same as str(cmd).
+    """
+    params = [p for p in PARAMS if getattr(cmd, p) is not None]
+    result = _template(cmd.command, params, precision) % tuple([getattr(cmd, p) for p in params])
+    return ("%s %s" % (result, cmd.comment)).strip()
+
+
+def formatTable(table, start=0, end=None, precision=PRECISION):
+    """ Format a range of rows from a CommandTable
+
+      Returns a list with a string for each row.
+    """
+    if end is None:
+        end = len(table)
+    codes = table.codes[start:end].astype(np.int64)
+    values = np.column_stack([table.columns[p][start:end] for p in PARAMS])
+    # Group the rows by command and the parameters present
+    present = ~np.isnan(values)
+    pattern = present.astype(np.int64).dot(1 << np.arange(len(PARAMS)))
+    keys, groups = np.unique((codes << len(PARAMS)) | pattern, return_inverse=True)
+    order = np.argsort(groups, kind="stable")
+    ends = np.cumsum(np.bincount(groups, minlength=len(keys))).tolist()
+    lines = np.empty(end - start, dtype=object)
+    first = 0
+    for index, key in enumerate(keys.tolist()):
+        rows = order[first:ends[index]]
+        first = ends[index]
+        columns = [i for i in range(len(PARAMS)) if key & (1 << i)]
+        template = _template(table.commands[key >> len(PARAMS)], [PARAMS[i] for i in columns], precision)
+        if len(columns) == 0:
+            lines[rows] = template
+        else:
+            # Format the whole group in one go and split it back into lines
+            group = values[rows][:, columns].ravel().tolist()
+            text = ((template + "\n") * len(rows)) % tuple(group)
+            lines[rows] = text.split("\n")[:-1]
+    lines = lines.tolist()
+    # Add the comments
+    for row, comment in table.comments.items():
+        if start <= row < end:
+            lines[row - start] = ("%s %s" % (lines[row - start], comment)).strip()
+    return lines
+
+
+def writeCommands(target, commands, precision=PRECISION):
+    """ Write a sequence of commands (or a CommandTable) to an open file
+
+      Each command is written on a separate line. The rows of a table are
+      formatted and written in blocks of BLOCK lines.
+    """
+    if isinstance(commands, CommandTable):
+        for start in range(0, len(commands), BLOCK):
+            lines = formatTable(commands, start, min(start + BLOCK, len(commands)), precision)
+            target.write("\n".join(lines) + "\n")
+        return
+    if precision == PRECISION:
+        format = str
+    else:
+        def format(cmd):
+            if isinstance(cmd, GCommand):
+                return formatCommand(cmd, precision)
+            return str(cmd)
+    for cmd in commands:
+        target.write(format(cmd) + "\n")
@@ -1,5 +1,10 @@
 #!/usr/bin/env python
 # ----------------------------------------------------------------------------
+# 17-Oct-2026 ShaneG
+#
+# Stream the file rather than loading it all into memory. The commands are
+# filtered in place as nothing else uses them.
+#
 # 28-Jul-2015 ShaneG
 #
 # Updated to use new framework.
@@ -12,7 +17,7 @@
 from optparse import OptionParser
 from sys import argv
 
-from util import loadGCode, saveGCode, ZLevel
+from util import iterGCode, saveGCode, FilterChain, ZLevel
 
 # --- Usage information
 USAGE = """
@@ -44,6 +49,5 @@ if __name__ == "__main__":
         print("You haven't asked me to do anything!")
         exit(1)
     # Now process the file
-    gcode = loadGCode(source)
-    gcode = gcode.clone(ZLevel(cut=options.cut_depth, safe=options.safe_depth))
-    saveGCode(options.output_file, gcode)
+    chain = FilterChain(ZLevel(cut=options.cut_depth, safe=options.safe_depth))
+    saveGCode(options.output_file, chain.stream(iterGCode(source), inplace=True))